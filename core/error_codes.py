@@ -7,17 +7,27 @@ class ErrorCodes(enum.Enum):
     BAD_PHONENUMBER = "The phone number provided is invalid/ doesn't belong to any user"
     ENTITY_NOT_FOUND = "entity {} with identitfier {} not found"
     EVENT_DELETED = "The event has been deleted"
+    EXPIRED_ACCESS_TOKEN = "The access token has expired, please refresh it"
     EXPIRED_REFRESH_TOKEN = "The refresh token has expired, please login again"
     GENERIC_TICKET_TYPE_LISTING = (
         "Global ticket type listing is forbidden. event_id filter is required."
     )
+    IDEMPOTENCY_KEY_IN_PROGRESS = (
+        "A request with the same idempotency key is still being processed"
+    )
+    IDEMPOTENCY_KEY_REUSED = (
+        "The idempotency key was already used with a different request"
+    )
     INTERGRATION_ERROR = "Intergration Error: {}"
     INVALID_ACCESS_TOKEN = "The provided access token is invalid"
+    INVALID_CALLBACK_SIGNATURE = "The payment callback signature could not be verified"
     INVALID_CREDENTIALS = "The provided credentials don't match any user"
     INVALID_EVENT_FOR_TICKET = "Invalid event id on tickect creation"
     INVALID_EVENT_ID = "An event with the given ID does not exist"
+    INVALID_IDEMPOTENCY_KEY = "The idempotency key is invalid: {}"
     INVALID_OTP = "The provided OTP could not be verified"
     INVALID_PARTNER_ID = "A partner with the given ID does not exist"
+    INVALID_PAYMENT_ID = "A payment with the given ID does not exist"
     INVALID_PERSON_ID = "The person with the given ID does not exist"
     INVALID_REFRESH_TOKEN = "The provided refresh token is invalid"
     INVALID_SIGNATURE = "The auth request signature was invalid"
@@ -36,7 +46,10 @@ class ErrorCodes(enum.Enum):
     PAYMENT_PROCESSING_FAILED = "Payment processing failed"
     PROMO_NOT_FOUND = "The promotion code was not found"
     PROVIDER_NOT_SUPPORTED = "The chosen provider is not currently supported"
+    PROVIDER_UNAVAILABLE = "The chosen provider is unavailable, try again shortly"
     REDEEMED_TICKET = "The current ticket has already been redeemed"
+    REVOKED_TOKEN = "The token was revoked, please login again"
+    SERVICE_BUSY = "The server is busy, try again shortly"
     SERVICE_EXCEPTION = "Operation Failed: {}"
     TARGET_MODEL_HAS_NO_SEARCH_VECTOR = "The target model does not have a search vector"
     TICKET_TYPE_OBJECT_DELETED = "Ticket type object sucessfully deleted"
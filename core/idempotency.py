@@ -0,0 +1,223 @@
+import hashlib
+import json
+import time
+import uuid
+from functools import wraps
+from typing import Any, Callable, NamedTuple, Optional, Tuple
+
+import redis
+from fastapi.encoders import jsonable_encoder
+from rest_framework.request import Request
+from rest_framework.response import Response
+from starlette.responses import JSONResponse
+
+from core.error_codes import ErrorCodes
+from core.exceptions import HttpErrorException, HttpErrorExceptionFA
+from core.redis import redis_client
+from eticketing_api import settings
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Deletes the in flight marker only if it still belongs to the caller
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class StoredResponse(NamedTuple):
+    status: int
+    body: Any
+    replayed: bool
+
+
+class IdempotencyError(Exception):
+    def __init__(self, status_code: int, code: ErrorCodes, extra: str = "") -> None:
+        super().__init__(code.name)
+        self.status_code = status_code
+        self.code = code
+        self.extra = extra
+
+
+class IdempotencyStore:
+    """
+    Responses of requests made with an ``Idempotency-Key`` header, kept in
+    redis for ``ttl`` seconds.
+
+    The first request with a key runs while holding an in flight marker,
+    requests repeating the key wait for its response instead of running
+    again and later ones get the stored response straight away. A key
+    reused with a different request body is rejected. Requests run as
+    usual when redis is unavailable.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        key: str,
+        ttl: int,
+        lock_timeout: int = 60,
+        wait_timeout: float = 30.0,
+        poll_interval: float = 0.05,
+    ) -> None:
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._release = client.register_script(RELEASE_SCRIPT)
+
+    @staticmethod
+    def fingerprint(*parts: Any) -> str:
+        encoded = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def _keys(self, scope: str, idempotency_key: str) -> Tuple[str, str]:
+        response_key = f"{self.key}:{scope}:{idempotency_key}"
+        return response_key, f"{response_key}:in_flight"
+
+    def _load(self, response_key: str, fingerprint: str) -> Optional[StoredResponse]:
+        stored = self.client.get(response_key)
+        if not stored:
+            return None
+        stored_fingerprint, status, body = json.loads(stored)
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyError(422, ErrorCodes.IDEMPOTENCY_KEY_REUSED)
+        return StoredResponse(status, body, True)
+
+    def run(
+        self,
+        scope: str,
+        idempotency_key: str,
+        fingerprint: str,
+        handler: Callable[[], Tuple[int, Any]],
+    ) -> StoredResponse:
+        """
+        Return the stored response for the key or run ``handler``, which
+        returns a status code and a json serializable body, and store
+        its response. Server errors aren't stored so they can be retried
+        """
+        if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+            raise IdempotencyError(
+                400,
+                ErrorCodes.INVALID_IDEMPOTENCY_KEY,
+                f"keys are 1 to {MAX_KEY_LENGTH} characters long",
+            )
+        response_key, in_flight_key = self._keys(scope, idempotency_key)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        try:
+            while True:
+                if stored := self._load(response_key, fingerprint):
+                    return stored
+                if self.client.set(in_flight_key, token, nx=True, ex=self.lock_timeout):
+                    break
+                if time.monotonic() >= deadline:
+                    raise IdempotencyError(409, ErrorCodes.IDEMPOTENCY_KEY_IN_PROGRESS)
+                time.sleep(self.poll_interval)
+        except redis.RedisError:
+            status, body = handler()
+            return StoredResponse(status, body, False)
+
+        try:
+            # a response stored between the last check and taking the marker
+            if stored := self._load(response_key, fingerprint):
+                return stored
+            status, body = handler()
+            if status < 500:
+                try:
+                    self.client.set(
+                        response_key,
+                        json.dumps([fingerprint, status, body], separators=(",", ":")),
+                        ex=self.ttl,
+                    )
+                except redis.RedisError:
+                    # the handler's work is committed, answer with it even
+                    # though a retry won't be recognised
+                    pass
+            return StoredResponse(status, body, False)
+        finally:
+            try:
+                self._release(keys=[in_flight_key], args=[token])
+            except redis.RedisError:
+                pass
+
+
+idempotency_store = IdempotencyStore(
+    redis_client,
+    settings.IDEMPOTENCY_KEY,
+    ttl=settings.IDEMPOTENCY_TTL_SECONDS,
+    lock_timeout=settings.IDEMPOTENCY_LOCK_SECONDS,
+    wait_timeout=settings.IDEMPOTENCY_WAIT_SECONDS,
+)
+
+
+def idempotent(scope: str) -> Callable:
+    """
+    Make a DRF view method honour the ``Idempotency-Key`` header
+    """
+
+    def decorator(view_method: Callable[..., Response]) -> Callable[..., Response]:
+        @wraps(view_method)
+        def wrapper(view: Any, request: Request, *args: Any, **kwargs: Any) -> Response:
+            idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+            if idempotency_key is None:
+                return view_method(view, request, *args, **kwargs)
+
+            def handler() -> Tuple[int, Any]:
+                response = view_method(view, request, *args, **kwargs)
+                return response.status_code, jsonable_encoder(response.data)
+
+            try:
+                stored = idempotency_store.run(
+                    scope,
+                    idempotency_key,
+                    idempotency_store.fingerprint(request.path, request.data),
+                    handler,
+                )
+            except IdempotencyError as exc:
+                raise HttpErrorException(
+                    status_code=exc.status_code, code=exc.code, extra=exc.extra
+                )
+            response = Response(stored.body, status=stored.status)
+            if stored.replayed:
+                response[REPLAYED_HEADER] = "true"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def idempotent_response(
+    scope: str,
+    idempotency_key: Optional[str],
+    payload: Any,
+    handler: Callable[[], Any],
+) -> Any:
+    """
+    Run a FastAPI route's ``handler`` under ``idempotency_key`` when given
+    """
+    if idempotency_key is None:
+        return handler()
+    try:
+        stored = idempotency_store.run(
+            scope,
+            idempotency_key,
+            idempotency_store.fingerprint(scope, jsonable_encoder(payload)),
+            lambda: (200, jsonable_encoder(handler())),
+        )
+    except IdempotencyError as exc:
+        raise HttpErrorExceptionFA(
+            status_code=exc.status_code, code=exc.code, extra=exc.extra
+        )
+    return JSONResponse(
+        stored.body,
+        status_code=stored.status,
+        headers={REPLAYED_HEADER: "true"} if stored.replayed else None,
+    )
@@ -0,0 +1,26 @@
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from core.outbox import relay_outbox
+from eticketing_api import settings
+
+
+class Command(BaseCommand):
+    help = "Publish outbox messages to the celery broker"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="publish what is pending and exit instead of polling",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        while True:
+            # a full batch means more messages are waiting
+            if relay_outbox() < settings.OUTBOX_BATCH_SIZE:
+                if options["once"]:
+                    return
+                time.sleep(settings.OUTBOX_RELAY_INTERVAL_SECONDS)
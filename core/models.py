@@ -1,5 +1,6 @@
 import uuid
 
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 
@@ -10,3 +11,18 @@ class BaseModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class OutboxMessage(BaseModel):
+    """
+    Celery task written in the transaction that triggers it, published to
+    the broker by the outbox relay once that transaction commits
+    """
+
+    task = models.CharField(max_length=255, null=False, blank=False)
+    args = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    kwargs = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    queue = models.CharField(max_length=255, null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["created_at"], name="outbox_created")]
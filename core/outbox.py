@@ -0,0 +1,61 @@
+from typing import Any, Dict, Optional, Sequence, Union
+
+from celery import Task
+from django.db import transaction
+
+from core.models import OutboxMessage
+from eticketing_api import settings
+from eticketing_api.celery import celery
+
+
+def enqueue(
+    task: Union[Task, str],
+    args: Sequence[Any] = (),
+    kwargs: Optional[Dict[str, Any]] = None,
+    queue: Optional[str] = settings.CELERY_MAIN_QUEUE,
+) -> OutboxMessage:
+    """
+    Schedule a task from service code. The message is written in the
+    caller's transaction, so it is only published if that commits, and
+    publishing is left to the relay so requests don't wait on the broker
+    """
+    return OutboxMessage.objects.create(
+        task=task if isinstance(task, str) else task.name,
+        args=list(args),
+        kwargs=kwargs or {},
+        queue=queue,
+    )
+
+
+def relay_outbox(batch_size: int = settings.OUTBOX_BATCH_SIZE) -> int:
+    """
+    Publish the oldest committed messages and drop them from the outbox,
+    returns the number published. Relays running side by side take
+    different batches. A relay failing mid batch republishes the batch,
+    delivery is at least once
+    """
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True).order_by(
+                "created_at"
+            )[:batch_size]
+        )
+        if not messages:
+            return 0
+        # publishing reuses the app's pooled broker connections
+        for message in messages:
+            if message.task in celery.tasks:
+                celery.tasks[message.task].apply_async(
+                    args=message.args, kwargs=message.kwargs, queue=message.queue
+                )
+            else:
+                celery.send_task(
+                    message.task,
+                    args=message.args,
+                    kwargs=message.kwargs,
+                    queue=message.queue,
+                )
+        OutboxMessage.objects.filter(
+            id__in=[message.id for message in messages]
+        ).delete()
+    return len(messages)
@@ -0,0 +1,6 @@
+import redis
+
+from eticketing_api import settings
+
+# Connections are opened lazily, importing this module does not require redis
+redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
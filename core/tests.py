@@ -1,8 +1,18 @@
+import uuid
 from typing import Any
+from unittest import mock
+from unittest.mock import Mock
 
-from django.db import connection
+from django.db import connection, transaction
+from django.test import TestCase
 from django.test.runner import DiscoverRunner
 
+from core.models import OutboxMessage
+from core.outbox import enqueue, relay_outbox
+from eticketing_api import settings
+from eticketing_api.celery import celery
+from notifications.tasks import send_sms
+
 
 class TestRunner(DiscoverRunner):
     def teardown_databases(self, old_config: Any, **kwargs: Any) -> None:
@@ -16,3 +26,50 @@ class TestRunner(DiscoverRunner):
             )
             print(f"Killed {len(cursor.fetchall())} stale connections.")
         super().teardown_databases(old_config, **kwargs)
+
+
+class OutboxTestCase(TestCase):
+    def test_rolled_back_messages_never_published(self) -> None:
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            enqueue(send_sms, args=(uuid.uuid4(), "rolled back"))
+            raise RuntimeError()
+
+        assert not OutboxMessage.objects.exists()
+
+    @mock.patch.object(celery, "send_task")
+    @mock.patch("notifications.tasks.send_sms.apply_async")
+    def test_relay_publishes_in_order(
+        self, mock_send_sms: Mock, mock_send_task: Mock
+    ) -> None:
+        person_id = uuid.uuid4()
+        enqueue(
+            send_sms,
+            args=(person_id, "first"),
+            queue=settings.CELERY_NOTIFICATIONS_QUEUE,
+        )
+        enqueue(send_sms, args=(person_id, "second"))
+        enqueue("tasks.not_registered_here", kwargs={"key": "value"})
+
+        assert relay_outbox(batch_size=2) == 2
+        assert relay_outbox(batch_size=2) == 1
+        assert relay_outbox(batch_size=2) == 0
+
+        assert mock_send_sms.call_args_list == [
+            mock.call(
+                args=[str(person_id), "first"],
+                kwargs={},
+                queue=settings.CELERY_NOTIFICATIONS_QUEUE,
+            ),
+            mock.call(
+                args=[str(person_id), "second"],
+                kwargs={},
+                queue=settings.CELERY_MAIN_QUEUE,
+            ),
+        ]
+        mock_send_task.assert_called_once_with(
+            "tasks.not_registered_here",
+            args=[],
+            kwargs={"key": "value"},
+            queue=settings.CELERY_MAIN_QUEUE,
+        )
+        assert not OutboxMessage.objects.exists()
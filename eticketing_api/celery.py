@@ -14,14 +14,64 @@ celery.config_from_object("django.conf:settings", namespace="CELERY")
 celery.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 
 celery.conf.beat_schedule = {
-    "reminders": {"task": "send_out_reminders", "schedule": crontab(minute=0, hour=12)},
-    "promos": {"task": "send_out_promos", "schedule": crontab(hour=8)},
+    "reminders": {
+        "task": "send_out_reminders",
+        "schedule": crontab(minute=0, hour=12),
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
+    },
+    "promos": {
+        "task": "send_out_promos",
+        "schedule": crontab(hour=8),
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
+    },
     "cleanup_notifications": {
         "task": "cleanup_notifications",
         "schedule": crontab(day_of_week="sun"),
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
     },
     "reconcile_payments": {
         "task": "reconcile_payments",
         "schedule": crontab(day_of_week="sun", hour=5),
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
+    },
+    "snapshot_partner_ledger": {
+        "task": "snapshot_partner_ledger",
+        "schedule": crontab(minute=0, hour=3),
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
+    },
+    "resume_partner_payouts": {
+        "task": "resume_partner_payouts",
+        "schedule": crontab(minute=45),
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
+    },
+    "prefetch_event_posters": {
+        "task": "prefetch_event_posters",
+        "schedule": crontab(minute=30),
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
+    },
+    "flush_ticket_scans": {
+        "task": "flush_ticket_scans",
+        "schedule": settings.SCAN_BUFFER_FLUSH_SECONDS,
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
+    },
+    "load_gate_validation": {
+        "task": "load_gate_validation",
+        "schedule": crontab(minute="*/15"),
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
+    },
+    "flush_gate_redemptions": {
+        "task": "flush_gate_redemptions",
+        "schedule": settings.GATE_FLUSH_SECONDS,
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
+    },
+    "process_payment_callbacks": {
+        "task": "process_payment_callbacks",
+        "schedule": settings.PAYMENT_CALLBACK_FLUSH_SECONDS,
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
+    },
+    "sweep_expired_payments": {
+        "task": "sweep_expired_payments",
+        "schedule": crontab(minute="*/5"),
+        "options": {"queue": settings.CELERY_MAIN_QUEUE},
     },
 }
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 from corsheaders.defaults import default_headers
@@ -68,6 +69,7 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
+    "partner.auth.AuthContextMiddleware",
 ]
 
 ROOT_URLCONF = "eticketing_api.urls"
@@ -211,6 +213,11 @@ CELERY_RESULT_BACKEND = "django-db"
 CELERY_BROKER_URL = os.environ["BROKER_URL"]
 CELERY_MAIN_QUEUE = "main_queue"
 CELERY_NOTIFICATIONS_QUEUE = "notifications-queue"
+# tasks sent without a queue must still reach a queue the workers consume
+CELERY_TASK_DEFAULT_QUEUE = CELERY_MAIN_QUEUE
+
+# Redis
+REDIS_URL = os.environ.get("REDIS_URL", CELERY_BROKER_URL)
 
 # EMail
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
@@ -233,7 +240,11 @@ AFRICAS_TALKING_KEY = "test"
 DEFAULT_TICKET_TEMPLATE = "tickets/templates/ticket.html"
 TICKET_EMAIL_TITLE = "Your ticket is here :) !"
 TICKET_EMAIL_BODY = "Hi {} :), your ticket is here! The attachment on this email has all the relevant details"
+# how long a ticket email job holds its tickets before another job may send them
+TICKET_EMAIL_CLAIM_SECONDS = 600
 
+# most recipients handed to the sms provider in one request
+SMS_BATCH_SIZE = 500
 REMINDER_SMS = "Hi {} :), just reminding you that {} is in the next 24 hrs ! Wohoo!"
 
 POST_RECONCILIATION_MESSAGE = "HI {}. Your weekly reconciliation has just completed. Your total balance comes out to {}"
@@ -255,10 +266,22 @@ CORS_ALLOW_METHODS = [
     "PUT",
 ]
 CORS_URLS_REGEX = r"^.*$"
-CORS_ALLOW_HEADERS = list(default_headers)
+CORS_ALLOW_HEADERS = list(default_headers) + ["idempotency-key"]
+CORS_EXPOSE_HEADERS = ["idempotent-replayed"]
 
 AUTH_HEADER = "HTTP_AUTHORIZATION"
 EXTERNAL_API_AUTH_HEADER = "access-token"
+PARTNER_API_CACHE_SECONDS = 60
+PARTNER_API_CACHE_SIZE = 1024
+# issued partner api tokens are handed out again while this much is left
+PARTNER_API_TOKEN_REUSE_MINUTES = 30
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+REFRESH_TOKEN_EXPIRE_MINUTES = int(os.environ.get("REFRESH_TOKEN_EXPIRE_MINUTES", 1440))
+TOKEN_REVOCATION_KEY = "revoked_tokens"
+# pick the rounds with `manage.py benchmark_password_hashing`
+PASSWORD_HASH_ROUNDS = int(os.environ.get("PASSWORD_HASH_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_MAX_QUEUE = 64
 
 if os.environ.get("ENV") != "dev" and not os.environ.get("GITHUB_WORKFLOW", None):
     SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
@@ -277,8 +300,65 @@ AWS_STORAGE_BUCKET_NAME = os.environ["AWS_STORAGE_BUCKET_NAME"]
 AWS_QUERYSTRING_AUTH = False
 BASE_S3_URL = os.environ["BASE_S3_URL"]
 
+# Ticket rendering
+POSTER_CACHE_DIR = os.environ.get(
+    "POSTER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ticketzone-posters")
+)
+POSTER_CACHE_MAX_BYTES = int(
+    os.environ.get("POSTER_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+)
+POSTER_CACHE_REVALIDATE_SECONDS = 300
+POSTER_FETCH_TIMEOUT = (3.05, 15.0)
+POSTER_PREFETCH_DAYS = 7
+
+# Ticket scanning
+SCAN_BUFFER_KEY = "ticket_scans"
+SCAN_BUFFER_FLUSH_SECONDS = 10.0
+GATE_KEY = "gate"
+GATE_KEY_TTL_SECONDS = 2 * 24 * 60 * 60
+GATE_FLUSH_SECONDS = 5.0
+
+# Outbox
+OUTBOX_BATCH_SIZE = 200
+OUTBOX_RELAY_INTERVAL_SECONDS = 0.5
+
+# Idempotency keys
+IDEMPOTENCY_KEY = "idempotency"
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60
+IDEMPOTENCY_LOCK_SECONDS = 60
+IDEMPOTENCY_WAIT_SECONDS = 30.0
+
 # Tests
 TEST_RUNNER = "core.tests.TestRunner"
 
 # Payments
 PAYMENT_PAGE_URL = f"{os.environ['CHECKOUT_PAGE']}/payments/"
+IPAY_BASE_URL = os.environ.get("IPAY_BASE_URL", "https://apis.ipayafrica.com")
+IPAY_PROVIDER_KEY = os.environ.get("iPAY_PROVIDER_KEY", "")
+PAYMENT_PROVIDER_TIMEOUT = (3.05, 15.0)
+PAYMENT_PUSH_TIMEOUT = (3.05, 30.0)
+PAYMENT_PROVIDER_RETRIES = 2
+PAYMENT_CIRCUIT_FAILURES = 5
+PAYMENT_CIRCUIT_RESET_SECONDS = 30.0
+PAYMENT_INITIATION_RETRIES = 3
+PAYMENT_CALLBACK_BATCH_SIZE = 500
+PAYMENT_CALLBACK_FLUSH_SECONDS = 2.0
+PAYMENT_PENDING_EXPIRY_MINUTES = 30
+PAYMENT_SWEEP_CHUNK_SIZE = 500
+PAYMENT_SWEEP_CHECK_PROVIDER = bool(
+    int(os.environ.get("PAYMENT_SWEEP_CHECK_PROVIDER", 1))
+)
+PAYMENT_HEALTH_KEY = "payment_health"
+PAYMENT_HEALTH_WINDOW_SECONDS = 300
+PAYMENT_ROUTE_MAX_ERROR_RATE = 0.25
+PAYMENT_ROUTE_MAX_P95_MS = 5000
+PAYMENT_ROUTE_MIN_CALLS = 10
+# how often a checkout is let through to a method's failed processor
+PAYMENT_ROUTE_PROBE_SECONDS = 5
+PAYOUT_PROVIDER = os.environ.get("PAYOUT_PROVIDER", "MPESA")
+PAYOUT_WORKERS = 8
+PAYOUT_RATE_PER_SECOND = float(os.environ.get("PAYOUT_RATE_PER_SECOND", 5))
+PAYOUT_RATE_BURST = 5
+PAYOUT_MAX_ATTEMPTS = 3
+PARTNER_DASHBOARD_KEY = "partner_dashboard"
+PARTNER_DASHBOARD_CACHE_SECONDS = 30
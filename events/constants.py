@@ -17,3 +17,10 @@ class TicketValidityStates(str, Enum):
     UNDERPAID = "UNDERPAID"
     UNPAID = "UNPAID"
     REDEEMED = "REDEEMED"
+
+
+class SalesGranularity(str, Enum):
+    HOUR = "hour"
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
@@ -0,0 +1,68 @@
+# Generated by Django 4.1.7 on 2026-10-19 17:29
+
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("partner", "0013_delete_tempotpstore"),
+        ("events", "0012_alter_event_is_public"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TicketSalesRollup",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateField(auto_now=True)),
+                ("bucket", models.DateTimeField()),
+                ("tickets", models.IntegerField(default=0)),
+                ("revenue", models.FloatField(default=0.0)),
+                (
+                    "event",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="events.event"
+                    ),
+                ),
+                (
+                    "partner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="partner.partner",
+                    ),
+                ),
+                (
+                    "ticket_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="events.tickettype",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="ticketsalesrollup",
+            index=models.Index(
+                fields=["partner", "bucket"], name="events_tick_partner_0c1df5_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="ticketsalesrollup",
+            constraint=models.UniqueConstraint(
+                fields=("bucket", "ticket_type"), name="unique_rollup_bucket"
+            ),
+        ),
+    ]
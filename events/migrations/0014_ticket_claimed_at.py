@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-19 21:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0013_ticketsalesrollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ticket",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -113,7 +113,7 @@ class Event(BaseModel):
 
     @property
     def assigned_ticketing_agents(self) -> QuerySet[PartnerPerson]:
-        return self._assigned_ticketing_agents.all()
+        return self._assigned_ticketing_agents.with_state().select_related("person")
 
     @property
     def ticket_types(self) -> QuerySet["TicketType"]:
@@ -199,6 +199,9 @@ class Ticket(BaseModel):
         default=False,
         verbose_name="Has the ticket been sent to the user",
     )
+    # when a delivery job took the ticket, other jobs leave it alone until
+    # the claim is older than TICKET_EMAIL_CLAIM_SECONDS
+    claimed_at = models.DateTimeField(null=True, blank=True)
     redeemed = models.BooleanField(
         null=False,
         blank=False,
@@ -236,7 +239,10 @@ class Ticket(BaseModel):
         ]
         payment_validity_map = {
             PaymentStates.UNDERPAID.value: TicketValidityStates.UNDERPAID,
+            PaymentStates.INITIATING.value: TicketValidityStates.UNPAID,
             PaymentStates.PENDING.value: TicketValidityStates.UNPAID,
+            PaymentStates.FAILED.value: TicketValidityStates.UNPAID,
+            PaymentStates.VOIDED.value: TicketValidityStates.UNPAID,
         }
         if self.payment.state not in allowed_payment_states:
             return payment_validity_map[self.payment.state]
@@ -286,3 +292,32 @@ class PartnerPersonSchedule(BaseModel):
 
     def __str__(self) -> str:
         return f"{self.partner_person.person.name} is scheduled as TA for {self.event.name}"
+
+
+class TicketSalesRollup(BaseModel):
+    """
+    Hourly ticket sales per ticket type, maintained as tickets are issued
+    so sales over time can be reported without scanning tickets
+    """
+
+    bucket = models.DateTimeField(null=False, blank=False)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, null=False, blank=False)
+    ticket_type = models.ForeignKey(
+        TicketType, on_delete=models.CASCADE, null=False, blank=False
+    )
+    partner = models.ForeignKey(
+        Partner, on_delete=models.CASCADE, null=False, blank=False
+    )
+    tickets = models.IntegerField(null=False, blank=False, default=0)
+    revenue = models.FloatField(null=False, blank=False, default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bucket", "ticket_type"], name="unique_rollup_bucket"
+            )
+        ]
+        indexes = [models.Index(fields=["partner", "bucket"])]
+
+    def __str__(self) -> str:
+        return f"{self.ticket_type_id} sales @ {self.bucket}"
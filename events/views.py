@@ -23,7 +23,6 @@ from core.serializers import (
 )
 from core.utils import get_selected_fields, stream_model_data
 from core.views import AbstractPermissionedView
-from eticketing_api import settings
 from events.serializers import (
     CategorySerializer,
     EventBaseSerializer,
@@ -50,12 +49,10 @@ from partner.permissions import (
     PartnerOwnerPermissions,
     check_self,
     get_request_partner_id,
+    get_request_user,
     get_request_user_id,
 )
-from partner.utils import (
-    get_request_membership_or_ownership,
-    get_user_from_access_token,
-)
+from partner.utils import get_request_membership_or_ownership
 
 paginator = PageNumberPagination()
 paginator.page_size = 15
@@ -95,8 +92,7 @@ def list_categories(request: Request) -> Response:
 @swagger_auto_schema(method="post", responses={200: VerifyActionSerializer(many=True)})
 @api_view(["POST"])
 def event_reminder_optin(request: Request, event_id: str) -> Response:
-    token_key = settings.AUTH_HEADER
-    person_id = get_user_from_access_token(request.META[token_key]).id
+    person_id = get_request_user(request).id
     event_service.create_reminder_optin(str(person_id), event_id)
     return Response({"done": True})
 
@@ -8,8 +8,10 @@ from partner.models import Person
 
 
 class MockResp:
-    def __init__(self) -> None:
+    def __init__(self, status_code: int = 200, etag: Optional[str] = None) -> None:
         self.content = open("media/42_EluV6G9.jpg", "rb").read()
+        self.status_code = status_code
+        self.headers = {"ETag": etag} if etag else {}
 
 
 def notification_fixture(
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List, Sequence, Tuple
 
 import africastalking
 
@@ -15,5 +15,22 @@ class SMSClient:
     def send(self, message: str, numbers: List[str]) -> None:
         self.sms_client.send(message, numbers)
 
+    def send_many(
+        self,
+        messages: Sequence[Tuple[str, str]],
+        batch_size: int = settings.SMS_BATCH_SIZE,
+    ) -> None:
+        """
+        Send (message, number) pairs, numbers getting the same message
+        share provider requests of up to ``batch_size`` recipients
+        """
+        recipients: Dict[str, List[str]] = {}
+        for message, number in messages:
+            recipients.setdefault(message, []).append(number)
+        for message, numbers in recipients.items():
+            for start in range(0, len(numbers), batch_size):
+                end = start + batch_size
+                self.send(message, numbers[start:end])
+
 
 sms_client = SMSClient()
@@ -1,9 +1,11 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from typing import Any, Dict, List, Optional, Sequence
 
 from celery import shared_task
 from django.contrib import admin, messages
 from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import Q
 from django.db.models.query import QuerySet
 from django.http import HttpRequest
 
@@ -15,7 +17,7 @@ from notifications.models import Notification
 from notifications.pusher import pusher_client
 from notifications.sms import sms_client
 from partner.models import Person
-from tickets.utils import generate_ticket_pdf
+from tickets.utils import generate_ticket_pdf, generate_ticket_qrs
 
 
 @celery.task(name=__name__ + ".send_email")
@@ -146,6 +148,40 @@ def send_sms(person_id: str, message: str) -> None:
     notification.save()
 
 
+@celery.task(name=__name__ + ".send_sms_batch")
+def send_sms_batch(messages: List[List[str]]) -> None:
+    """
+    Send a batch of [person_id, message] pairs, recorded as notifications
+    in bulk
+    """
+    numbers = {
+        str(person_id): number
+        for person_id, number in Person.objects.filter(
+            pk__in=[person_id for person_id, _ in messages]
+        ).values_list("id", "phone_number")
+    }
+    messages = [
+        [person_id, message] for person_id, message in messages if person_id in numbers
+    ]
+    notifications = Notification.objects.bulk_create(
+        [
+            Notification(
+                person_id=person_id,
+                message=message,
+                channel=NotificationsChannels.SMS.value,
+                has_data=False,
+            )
+            for person_id, message in messages
+        ]
+    )
+    sms_client.send_many(
+        [(message, numbers[person_id]) for person_id, message in messages]
+    )
+    Notification.objects.filter(
+        id__in=[notification.id for notification in notifications]
+    ).update(sent=True)
+
+
 @celery.task(name=__name__ + ".resend_notification")
 @admin.action(description="Resend Notification")
 def resend_notification(
@@ -166,3 +202,62 @@ def cleanup_notifications() -> None:
     )
     for notification in notifications:
         notification.delete()
+
+
+@celery.task(
+    name=__name__ + ".send_payment_tickets", acks_late=True, reject_on_worker_lost=True
+)
+def send_payment_tickets(payment_id: str, retry: int = 0) -> int:
+    """
+    Email every unsent ticket of a payment as one message. Tickets are
+    claimed for a while before rendering so concurrent jobs don't send them
+    again, and only marked sent once the email has gone out. A job whose
+    worker dies mid-render is redelivered and takes its tickets back once
+    the claim has lapsed, other failures hand them back and retry
+    """
+    now = datetime.now()
+    lapsed = now - timedelta(seconds=settings.TICKET_EMAIL_CLAIM_SECONDS)
+    with transaction.atomic():
+        tickets = list(
+            Ticket.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(payment_id=payment_id, sent=False)
+            .filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=lapsed))
+            .select_related("payment__person", "ticket_type__event")
+        )
+        ticket_ids = [ticket.id for ticket in tickets]
+        Ticket.objects.filter(id__in=ticket_ids).update(claimed_at=now)
+    if not tickets:
+        return 0
+
+    person: Person = tickets[0].payment.person
+    sent = 0
+    try:
+        attachments = []
+        # hashes missing on any of the tickets are saved in one update
+        for ticket, image in generate_ticket_qrs(tickets):
+            ticket_pdf = generate_ticket_pdf(ticket, image=image)
+            ticket_pdf.seek(0)
+            attachments.append((ticket.__str__(), ticket_pdf.read(), "application/pdf"))
+        email = EmailMessage(
+            subject=settings.TICKET_EMAIL_TITLE,
+            to=(person.email,),
+            attachments=attachments,
+            body=settings.TICKET_EMAIL_BODY.format(person.name),
+        )
+        email.content_subtype = "html"
+        sent = email.send(fail_silently=True)
+    finally:
+        Ticket.objects.filter(id__in=ticket_ids).update(
+            sent=bool(sent), claimed_at=None
+        )
+        if not sent and retry < 5:
+            send_payment_tickets.apply_async(
+                args=(payment_id, retry + 1),
+                queue=settings.CELERY_NOTIFICATIONS_QUEUE,
+            )
+    if not sent:
+        return 0
+    Notification.objects.create(
+        person=person, channel=NotificationsChannels.EMAIL.value, has_data=True
+    )
+    return len(tickets)
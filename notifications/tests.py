@@ -1,4 +1,5 @@
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
+from io import BytesIO
 from typing import Any
 from unittest import mock
 from unittest.mock import ANY
@@ -14,8 +15,10 @@ from notifications.pusher import pusher_client
 from notifications.sms import sms_client
 from notifications.tasks import (
     cleanup_notifications,
+    send_payment_tickets,
     send_push_notification,
     send_sms,
+    send_sms_batch,
     send_ticket_email,
 )
 from partner.fixtures import partner_fixtures
@@ -33,6 +36,26 @@ class NotificationsTestCase(TestCase):
 
         mock_sms_client.assert_called_with(message, [self.person.phone_number])
 
+    @mock.patch.object(sms_client, "send")
+    def test_send_sms_batch(self, mock_sms_client: Any) -> None:
+        other = partner_fixtures.create_person_obj()
+        message = random_string()
+
+        send_sms_batch(
+            [
+                [str(self.person.id), message],
+                [str(other.id), message],
+                [str(other.id), "other message"],
+            ]
+        )
+
+        mock_sms_client.assert_any_call(
+            message, [self.person.phone_number, other.phone_number]
+        )
+        mock_sms_client.assert_any_call("other message", [other.phone_number])
+        assert mock_sms_client.call_count == 2
+        assert Notification.objects.filter(sent=True).count() == 3
+
     @mock.patch.object(pusher_client, "push_web_notification")
     def test_send_push_notification(self, mock_pusher_client: Any) -> None:
         mock_pusher_client.return_value = {"publishId": random_string()}
@@ -43,7 +66,7 @@ class NotificationsTestCase(TestCase):
             user_ids=[str(self.person.id)], body=message, data={message: message}
         )
 
-    @mock.patch("requests.get")
+    @mock.patch("requests.Session.get")
     @mock.patch("notifications.tasks.EmailMessage")
     def test_send_ticket_email(
         self, mock_email_service: Any, mock_get_response: Any
@@ -64,6 +87,110 @@ class NotificationsTestCase(TestCase):
         mock_email_object.send.return_value = 0
         mock_email_object.send.assert_called_with(fail_silently=True)
 
+    @mock.patch("notifications.tasks.generate_ticket_pdf")
+    @mock.patch("notifications.tasks.EmailMessage")
+    def test_send_payment_tickets(
+        self, mock_email_service: Any, mock_generate_pdf: Any
+    ) -> None:
+        mock_generate_pdf.side_effect = lambda ticket, image: BytesIO(b"%PDF")
+        mock_email_service.return_value.send.return_value = 1
+        ticket = ticket_fixtures.create_ticket_obj()
+        ticket_fixtures.create_ticket_obj(
+            ticket_type=ticket.ticket_type, payment=ticket.payment
+        )
+        Ticket.objects.filter(pk=ticket.pk).update(hash=None)
+
+        assert send_payment_tickets(str(ticket.payment_id)) == 2
+        assert send_payment_tickets(str(ticket.payment_id)) == 0
+
+        mock_email_service.assert_called_once_with(
+            subject=settings.TICKET_EMAIL_TITLE,
+            to=(ticket.payment.person.email,),
+            attachments=[ANY, ANY],
+            body=settings.TICKET_EMAIL_BODY.format(ticket.payment.person.name),
+        )
+        assert not Ticket.objects.filter(payment=ticket.payment, sent=False).exists()
+        assert not Ticket.objects.filter(
+            payment=ticket.payment, hash__isnull=True
+        ).exists()
+
+    @mock.patch("notifications.tasks.generate_ticket_pdf")
+    @mock.patch("notifications.tasks.EmailMessage")
+    def test_send_payment_tickets__claimed_once(
+        self, mock_email_service: Any, mock_generate_pdf: Any
+    ) -> None:
+        ticket = ticket_fixtures.create_ticket_obj()
+        overlapping = []
+
+        def render(ticket: Ticket, image: str) -> BytesIO:
+            # a job for the same payment running while this one sends
+            if not overlapping:
+                overlapping.append(send_payment_tickets(str(ticket.payment_id)))
+            return BytesIO(b"%PDF")
+
+        mock_generate_pdf.side_effect = render
+        mock_email_service.return_value.send.return_value = 1
+
+        assert send_payment_tickets(str(ticket.payment_id)) == 1
+        assert overlapping == [0]
+        mock_email_service.assert_called_once()
+
+    @mock.patch("notifications.tasks.send_payment_tickets.apply_async")
+    @mock.patch("notifications.tasks.generate_ticket_pdf")
+    @mock.patch("notifications.tasks.EmailMessage")
+    def test_send_payment_tickets__released_when_not_sent(
+        self, mock_email_service: Any, mock_generate_pdf: Any, mock_retry: Any
+    ) -> None:
+        mock_generate_pdf.side_effect = lambda ticket, image: BytesIO(b"%PDF")
+        mock_email_service.return_value.send.return_value = 0
+        ticket = ticket_fixtures.create_ticket_obj()
+
+        assert send_payment_tickets(str(ticket.payment_id)) == 0
+
+        mock_retry.assert_called_once()
+        ticket.refresh_from_db()
+        assert not ticket.sent
+        assert ticket.claimed_at is None
+
+    @mock.patch("notifications.tasks.send_payment_tickets.apply_async")
+    @mock.patch("notifications.tasks.generate_ticket_pdf")
+    @mock.patch("notifications.tasks.EmailMessage")
+    def test_send_payment_tickets__retried_after_render_error(
+        self, mock_email_service: Any, mock_generate_pdf: Any, mock_retry: Any
+    ) -> None:
+        mock_generate_pdf.side_effect = OSError("wkhtmltopdf exited")
+        ticket = ticket_fixtures.create_ticket_obj()
+
+        with self.assertRaises(OSError):
+            send_payment_tickets(str(ticket.payment_id))
+
+        mock_email_service.return_value.send.assert_not_called()
+        mock_retry.assert_called_once()
+        ticket.refresh_from_db()
+        assert not ticket.sent
+        assert ticket.claimed_at is None
+
+    @mock.patch("notifications.tasks.generate_ticket_pdf")
+    @mock.patch("notifications.tasks.EmailMessage")
+    def test_send_payment_tickets__lapsed_claim_taken_over(
+        self, mock_email_service: Any, mock_generate_pdf: Any
+    ) -> None:
+        mock_generate_pdf.side_effect = lambda ticket, image: BytesIO(b"%PDF")
+        mock_email_service.return_value.send.return_value = 1
+        ticket = ticket_fixtures.create_ticket_obj()
+        lease = timedelta(seconds=settings.TICKET_EMAIL_CLAIM_SECONDS)
+
+        # a job that died while rendering left its claim behind
+        Ticket.objects.filter(pk=ticket.pk).update(claimed_at=datetime.now())
+        assert send_payment_tickets(str(ticket.payment_id)) == 0
+        Ticket.objects.filter(pk=ticket.pk).update(
+            claimed_at=datetime.now() - 2 * lease
+        )
+        assert send_payment_tickets(str(ticket.payment_id)) == 1
+
+        ticket.refresh_from_db()
+        assert ticket.sent
+
     def test_cleanup_old_notifications(self) -> None:
         notification: Notification = notification_fixtures.create_notification_obj()
         notification.created_at = date.today() - timedelta(weeks=2)
@@ -1,12 +1,17 @@
 from django.contrib import admin
 
 from .models import (
+    LedgerEntry,
+    LedgerSnapshot,
     Partner,
+    PartnerBalance,
     PartnerPerson,
     PartnerPromotion,
     PartnerSMS,
     Person,
     PromoOptIn,
+    ReconciliationEntry,
+    ReconciliationRun,
 )
 
 
@@ -55,9 +60,58 @@ class PartnerPersonConfig(admin.ModelAdmin):
     ]
 
 
+class ReconciliationRunConfig(admin.ModelAdmin):
+    list_display = ("watermark", "total_balance", "completed_at")
+    readonly_fields = ["watermark", "total_balance", "completed_at"]
+
+
+class ReconciliationEntryConfig(admin.ModelAdmin):
+    search_fields = ["partner__name", "partner__owner__phone_number"]
+    list_filter = ("run",)
+    readonly_fields = [
+        "run",
+        "partner",
+        "revenue",
+        "sms_cost",
+        "balance",
+        "payments",
+    ]
+
+
+class LedgerEntryConfig(admin.ModelAdmin):
+    search_fields = ["partner__name", "partner__owner__phone_number", "reference"]
+    list_filter = ("entry_type",)
+    readonly_fields = [
+        "partner",
+        "sequence",
+        "entry_type",
+        "amount",
+        "balance",
+        "reference",
+    ]
+
+
+class PartnerBalanceConfig(admin.ModelAdmin):
+    search_fields = ["partner__name", "partner__owner__phone_number"]
+    readonly_fields = [
+        "partner",
+        "revenue",
+        "commission",
+        "expenses",
+        "payouts",
+        "balance",
+        "sequence",
+    ]
+
+
 admin.site.register(Person, PersonAdminConfig)
 admin.site.register(Partner, PartnerAdminConfig)
 admin.site.register(PartnerSMS, PartnerSMSConfig)
 admin.site.register(PartnerPromotion, PartnerPromoConfig)
 admin.site.register(PromoOptIn, PartnerOptinConfig)
 admin.site.register(PartnerPerson, PartnerPersonConfig)
+admin.site.register(ReconciliationRun, ReconciliationRunConfig)
+admin.site.register(ReconciliationEntry, ReconciliationEntryConfig)
+admin.site.register(LedgerEntry, LedgerEntryConfig)
+admin.site.register(PartnerBalance, PartnerBalanceConfig)
+admin.site.register(LedgerSnapshot, PartnerBalanceConfig)
@@ -0,0 +1,181 @@
+import time
+from typing import Any, Callable, Dict, Optional
+
+import redis
+from django.http import HttpRequest, HttpResponse
+from jose import ExpiredSignatureError, JWTError, jwt
+
+from core.error_codes import ErrorCodes
+from core.exceptions import HttpErrorException
+from core.redis import redis_client
+from eticketing_api import settings
+from partner.models import Partner, PartnerPerson, Person
+
+ALGORITHM = "HS256"
+ACCESS_TOKEN = "access"
+REFRESH_TOKEN = "refresh"
+PARTNER_CLAIMS = (
+    "phone_number",
+    "user_id",
+    "partner",
+    "membership",
+    "partner_person",
+    "active",
+    "iat",
+)
+
+
+class TokenRevocations:
+    """
+    People whose tokens issued before a point in time are no longer
+    accepted, kept in redis for as long as any of those tokens could still
+    be valid. Revoking is done when a membership is deactivated, changes
+    role or is removed, the person then refreshes or logs in again to get
+    claims matching their membership.
+    """
+
+    def __init__(self, client: redis.Redis, key: str, ttl: int) -> None:
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+
+    def revoke(self, person_id: str) -> None:
+        self.client.set(f"{self.key}:{person_id}", time.time(), ex=self.ttl)
+
+    def is_revoked(self, person_id: str, issued_at: float) -> bool:
+        try:
+            revoked_at = self.client.get(f"{self.key}:{person_id}")
+        except redis.RedisError:
+            # access tokens are short lived, an unreachable list doesn't
+            # lock every partner out
+            return False
+        return revoked_at is not None and issued_at <= float(revoked_at)
+
+
+token_revocations = TokenRevocations(
+    redis_client,
+    settings.TOKEN_REVOCATION_KEY,
+    ttl=settings.REFRESH_TOKEN_EXPIRE_MINUTES * 60,
+)
+
+
+class AuthContext:
+    """
+    Identity behind a request's access token. Partner tokens carry signed
+    claims for the membership, its role and whether it is active, so they
+    are checked against the revocation list alone. The person, with the
+    partnership they own and their membership, is loaded in a single query
+    only when a helper needs the rows.
+    """
+
+    def __init__(self, token: Optional[str]) -> None:
+        self.token = token
+        self._claims: Optional[Dict[str, Any]] = None
+        self._expired = False
+        self._decoded = False
+        self._person: Optional[Person] = None
+        self._loaded = False
+
+    def _decode(self) -> Optional[Dict[str, Any]]:
+        if not self._decoded:
+            self._decoded = True
+            try:
+                claims = jwt.decode(
+                    self.token or "", settings.SECRET_KEY, algorithms=[ALGORITHM]
+                )
+                if claims.get("type", ACCESS_TOKEN) == ACCESS_TOKEN:
+                    self._claims = claims
+            except ExpiredSignatureError:
+                self._expired = True
+            except JWTError:
+                self._claims = None
+        return self._claims
+
+    def _require_token(self) -> None:
+        if not self.token:
+            raise HttpErrorException(status_code=403, code=ErrorCodes.ACCESS_DENIED)
+        if self._decode() is None and self._expired:
+            raise HttpErrorException(
+                status_code=401, code=ErrorCodes.EXPIRED_ACCESS_TOKEN
+            )
+
+    @property
+    def person(self) -> Optional[Person]:
+        if not self._loaded:
+            self._loaded = True
+            claims = self._decode() or {}
+            if user_id := claims.get("user_id"):
+                try:
+                    self._person = (
+                        Person.objects.select_related("owner", "membership__partner")
+                        .filter(pk=user_id)
+                        .first()
+                    )
+                except ValueError:
+                    self._person = None
+        return self._person
+
+    @property
+    def claims(self) -> Dict[str, Any]:
+        """
+        Claims of a partner token that wasn't revoked
+        """
+        self._require_token()
+        claims = self._decode()
+        if claims is None or any(claim not in claims for claim in PARTNER_CLAIMS):
+            raise HttpErrorException(
+                status_code=403, code=ErrorCodes.UNPROCESSABLE_TOKEN
+            )
+        if token_revocations.is_revoked(claims["user_id"], claims["iat"]):
+            raise HttpErrorException(status_code=401, code=ErrorCodes.REVOKED_TOKEN)
+        return claims
+
+    @property
+    def user(self) -> Person:
+        """
+        Person of any access token, customers' tokens included
+        """
+        self._require_token()
+        if not self.person:
+            raise HttpErrorException(
+                status_code=404, code=ErrorCodes.UNPROCESSABLE_TOKEN
+            )
+        return self.person
+
+    @property
+    def ownership(self) -> Optional[Partner]:
+        try:
+            return self.person.owner if self.person else None
+        except Partner.DoesNotExist:
+            return None
+
+    @property
+    def membership(self) -> Optional[PartnerPerson]:
+        try:
+            return self.person.membership if self.person else None
+        except PartnerPerson.DoesNotExist:
+            return None
+
+
+def get_auth_context(request: Any) -> AuthContext:
+    """
+    The request's auth context, created for requests that didn't pass
+    through the middleware
+    """
+    http_request = getattr(request, "_request", request)
+    context = getattr(http_request, "auth_context", None)
+    if context is None:
+        context = AuthContext(http_request.META.get(settings.AUTH_HEADER))
+        http_request.auth_context = context
+    return context
+
+
+class AuthContextMiddleware:
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]) -> None:
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        request.auth_context = AuthContext(  # type: ignore
+            request.META.get(settings.AUTH_HEADER)
+        )
+        return self.get_response(request)
@@ -13,3 +13,10 @@ class PartnerPromotionPeriod(models.TextChoices):
     WEEKLY = "WEEKLY", _("WEEKLY")
     MONTHLY = "MONTHLY", _("MONTHLY")
     SINGLE_RUN = "SINGLE_RUN", _("SINGLE_RUN")
+
+
+class LedgerEntryType(models.TextChoices):
+    SALE = "SALE", _("SALE")
+    COMMISSION = "COMMISSION", _("COMMISSION")
+    SMS = "SMS", _("SMS")
+    PAYOUT = "PAYOUT", _("PAYOUT")
@@ -0,0 +1,153 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from passlib.context import CryptContext
+
+from core.error_codes import ErrorCodes
+from core.exceptions import HttpErrorException
+from eticketing_api import settings
+
+Result = TypeVar("Result")
+
+_contexts: Dict[int, CryptContext] = {}
+
+
+def crypt_context(rounds: int) -> CryptContext:
+    if rounds not in _contexts:
+        # hashes made with fewer rounds are rehashed once verified
+        _contexts[rounds] = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds,
+        )
+    return _contexts[rounds]
+
+
+def _hash(secret: str, rounds: int) -> Tuple[str, float]:
+    started = time.time()
+    return crypt_context(rounds).hash(secret), started
+
+
+def _verify(
+    secret: str, hashed: str, rounds: int
+) -> Tuple[Tuple[bool, Optional[str]], float]:
+    started = time.time()
+    return crypt_context(rounds).verify_and_update(secret, hashed), started
+
+
+class PasswordHasher:
+    """
+    bcrypt hashing and verification kept off the request threads in a
+    pool of ``workers`` processes, so a burst of logins can't take the
+    CPU the scanning endpoints need. At most ``max_queue`` calls wait on
+    the pool, further calls are refused with a 503 rather than queueing
+    behind them. With no workers hashing is done inline.
+    """
+
+    def __init__(self, rounds: int, workers: int, max_queue: int) -> None:
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._lock = Lock()
+        self._pending = 0
+        self._stats = {
+            "completed": 0,
+            "rejected": 0,
+            "max_pending": 0,
+            "wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "run_ms": 0.0,
+        }
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # a pool inherited from the parent of a forked web worker is unusable
+        if self._pool is None or self._pid != os.getpid():
+            # forking a threaded web worker could copy locks other threads
+            # hold, workers are started from a clean server process instead
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+            self._pid = os.getpid()
+        return self._pool
+
+    def _record(self, submitted: float, started: float) -> None:
+        finished = time.time()
+        wait_ms = max(started - submitted, 0) * 1000
+        self._stats["completed"] += 1
+        self._stats["wait_ms"] += wait_ms
+        self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+        self._stats["run_ms"] += (finished - started) * 1000
+
+    def _run(self, fn: Callable[..., Tuple[Result, float]], *args: Any) -> Result:
+        submitted = time.time()
+        if not self.workers:
+            result, started = fn(*args)
+            with self._lock:
+                self._record(submitted, started)
+            return result
+
+        with self._lock:
+            if self._pending >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise HttpErrorException(status_code=503, code=ErrorCodes.SERVICE_BUSY)
+            self._pending += 1
+            self._stats["max_pending"] = max(self._stats["max_pending"], self._pending)
+            pool = self._executor()
+        try:
+            result, started = pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # a worker died, the next call starts a fresh pool
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            raise
+        finally:
+            with self._lock:
+                self._pending -= 1
+        with self._lock:
+            self._record(submitted, started)
+        return result
+
+    def hash(self, secret: str) -> str:
+        return self._run(_hash, secret, self.rounds)
+
+    def verify(self, secret: str, hashed: str) -> bool:
+        return self.verify_and_update(secret, hashed)[0]
+
+    def verify_and_update(self, secret: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        Whether ``secret`` matches ``hashed`` and, when it does and the hash
+        was made with other settings, its hash with the current ones
+        """
+        return self._run(_verify, secret, hashed, self.rounds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            completed = self._stats["completed"]
+            return {
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "pending": self._pending,
+                "max_pending": self._stats["max_pending"],
+                "completed": completed,
+                "rejected": self._stats["rejected"],
+                "avg_wait_ms": self._stats["wait_ms"] / completed if completed else 0.0,
+                "max_wait_ms": self._stats["max_wait_ms"],
+                "avg_run_ms": self._stats["run_ms"] / completed if completed else 0.0,
+            }
+
+
+password_hasher = PasswordHasher(
+    rounds=settings.PASSWORD_HASH_ROUNDS,
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_queue=settings.PASSWORD_HASH_MAX_QUEUE,
+)
@@ -0,0 +1,224 @@
+from collections import defaultdict
+from typing import DefaultDict, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.db import transaction
+from django.db.models import Sum
+
+from partner.constants import LedgerEntryType
+from partner.models import (
+    LedgerEntry,
+    LedgerSnapshot,
+    LedgerTotals,
+    PartnerBalance,
+    PartnerSMS,
+)
+from tickets.models import Ticket
+
+# running total each entry type adds its amount to, payouts and expenses
+# are debits so they're kept as positive totals
+TOTAL_FIELDS = {
+    LedgerEntryType.SALE: ("revenue", 1),
+    LedgerEntryType.COMMISSION: ("commission", -1),
+    LedgerEntryType.SMS: ("expenses", -1),
+    LedgerEntryType.PAYOUT: ("payouts", -1),
+}
+
+# (entry type, signed amount, reference)
+Posting = Tuple[str, float, Optional[str]]
+
+
+class PartnerLedger:
+    """
+    Double entry record of partner money. Every credit or debit is
+    appended to ``LedgerEntry`` in the transaction of the operation behind
+    it and added to the partner's running ``PartnerBalance`` so balances are
+    read without scanning sales. Snapshots of the running totals let a
+    balance be audited by replaying only the entries made after them.
+    """
+
+    def _apply(self, totals: LedgerTotals, entry_type: str, amount: float) -> None:
+        field, sign = TOTAL_FIELDS[LedgerEntryType(entry_type)]
+        setattr(totals, field, getattr(totals, field) + sign * amount)
+        totals.balance += amount
+
+    def post(self, partner_id: str, postings: Sequence[Posting]) -> List[LedgerEntry]:
+        """
+        Append ``postings`` to the partner's ledger, callers lock partners
+        in a consistent order when posting for several in one transaction
+        """
+        if not postings:
+            return []
+        with transaction.atomic():
+            PartnerBalance.objects.get_or_create(partner_id=partner_id)
+            balance = PartnerBalance.objects.select_for_update().get(
+                partner_id=partner_id
+            )
+            entries = []
+            for entry_type, amount, reference in postings:
+                self._apply(balance, entry_type, amount)
+                balance.sequence += 1
+                entries.append(
+                    LedgerEntry(
+                        partner_id=partner_id,
+                        sequence=balance.sequence,
+                        entry_type=entry_type,
+                        amount=amount,
+                        balance=balance.balance,
+                        reference=reference,
+                    )
+                )
+            LedgerEntry.objects.bulk_create(entries)
+            balance.save()
+        return entries
+
+    def record_sales(self, payment_ids: Iterable[str]) -> int:
+        """
+        Credit partners with what was paid for the tickets of newly
+        confirmed payments and debit their commission, payments already
+        recorded are skipped. Returns the number of entries written
+        """
+        sales = list(
+            Ticket.objects.filter(payment_id__in=list(payment_ids))
+            .values(
+                "payment_id",
+                "payment__amount",
+                "ticket_type__event__partner_id",
+                "ticket_type__event__partner__comission_rate",
+            )
+            .annotate(price=Sum("ticket_type__price"))
+            .order_by("ticket_type__event__partner_id", "payment_id")
+        )
+        # a payment is shared between the partners it bought tickets from
+        # by list price, discounts included
+        order_prices: DefaultDict[str, float] = defaultdict(float)
+        order_partners: DefaultDict[str, int] = defaultdict(int)
+        for sale in sales:
+            order_prices[str(sale["payment_id"])] += sale["price"] or 0
+            order_partners[str(sale["payment_id"])] += 1
+
+        postings: Dict[str, List[Posting]] = {}
+        for sale in sales:
+            partner_id = str(sale["ticket_type__event__partner_id"])
+            reference = str(sale["payment_id"])
+            order_price = order_prices[reference]
+            share = (
+                (sale["price"] or 0) / order_price
+                if order_price
+                else 1 / order_partners[reference]
+            )
+            amount = float(sale["payment__amount"]) * share
+            commission = amount * (
+                sale["ticket_type__event__partner__comission_rate"] / 100
+            )
+            postings.setdefault(partner_id, []).extend(
+                [
+                    (LedgerEntryType.SALE.value, amount, reference),
+                    (LedgerEntryType.COMMISSION.value, -commission, reference),
+                ]
+            )
+
+        written = 0
+        with transaction.atomic():
+            for partner_id, partner_postings in postings.items():
+                recorded = set(
+                    LedgerEntry.objects.filter(
+                        partner_id=partner_id,
+                        entry_type=LedgerEntryType.SALE.value,
+                        reference__in=[posting[2] for posting in partner_postings],
+                    ).values_list("reference", flat=True)
+                )
+                written += len(
+                    self.post(
+                        partner_id,
+                        [
+                            posting
+                            for posting in partner_postings
+                            if posting[2] not in recorded
+                        ],
+                    )
+                )
+        return written
+
+    def record_sms(self, partner_id: str, count: int = 1) -> None:
+        rate = (
+            PartnerSMS.objects.filter(partner_id=partner_id)
+            .values_list("per_sms_rate", flat=True)
+            .first()
+        )
+        if rate:
+            self.post(partner_id, [(LedgerEntryType.SMS.value, -count * rate, None)])
+
+    def record_payout(self, partner_id: str, amount: float, reference: str) -> None:
+        self.post(partner_id, [(LedgerEntryType.PAYOUT.value, -amount, reference)])
+
+    def balance(self, partner_id: str) -> PartnerBalance:
+        return PartnerBalance.objects.filter(
+            partner_id=partner_id
+        ).first() or PartnerBalance(partner_id=partner_id)
+
+    def snapshot(self, chunk_size: int = 1000) -> int:
+        """
+        Snapshot the running totals of partners with entries since their
+        last snapshot
+        """
+        taken = 0
+        balances = PartnerBalance.objects.iterator(chunk_size=chunk_size)
+        latest = dict(
+            LedgerSnapshot.objects.order_by("partner_id", "-sequence")
+            .distinct("partner_id")
+            .values_list("partner_id", "sequence")
+        )
+        batch: List[LedgerSnapshot] = []
+        for balance in balances:
+            if latest.get(balance.partner_id, 0) >= balance.sequence:
+                continue
+            batch.append(
+                LedgerSnapshot(
+                    partner_id=balance.partner_id,
+                    revenue=balance.revenue,
+                    commission=balance.commission,
+                    expenses=balance.expenses,
+                    payouts=balance.payouts,
+                    balance=balance.balance,
+                    sequence=balance.sequence,
+                )
+            )
+            if len(batch) == chunk_size:
+                taken += len(LedgerSnapshot.objects.bulk_create(batch))
+                batch = []
+        taken += len(LedgerSnapshot.objects.bulk_create(batch))
+        return taken
+
+    def replay(self, partner_id: str) -> LedgerTotals:
+        """
+        Rebuild the partner's totals from its latest snapshot and the
+        entries after it, used to audit the running balance
+        """
+        snapshot = (
+            LedgerSnapshot.objects.filter(partner_id=partner_id)
+            .order_by("-sequence")
+            .first()
+        ) or LedgerSnapshot(partner_id=partner_id)
+        totals = LedgerSnapshot(
+            partner_id=partner_id,
+            revenue=snapshot.revenue,
+            commission=snapshot.commission,
+            expenses=snapshot.expenses,
+            payouts=snapshot.payouts,
+            balance=snapshot.balance,
+            sequence=snapshot.sequence,
+        )
+        entries = (
+            LedgerEntry.objects.filter(
+                partner_id=partner_id, sequence__gt=snapshot.sequence
+            )
+            .order_by("sequence")
+            .values_list("entry_type", "amount", "sequence")
+        )
+        for entry_type, amount, sequence in entries.iterator():
+            self._apply(totals, entry_type, amount)
+            totals.sequence = sequence
+        return totals
+
+
+partner_ledger = PartnerLedger()
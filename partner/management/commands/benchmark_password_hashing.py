@@ -0,0 +1,79 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from eticketing_api import settings
+from partner.hashing import PasswordHasher, crypt_context
+
+
+class Command(BaseCommand):
+    help = (
+        "Time bcrypt at increasing rounds to pick PASSWORD_HASH_ROUNDS for a "
+        "target latency, then replay a burst of logins through the pool"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--target-ms",
+            type=float,
+            default=250,
+            help="slowest acceptable time to hash a single password",
+        )
+        parser.add_argument("--min-rounds", type=int, default=10)
+        parser.add_argument("--max-rounds", type=int, default=16)
+        parser.add_argument("--samples", type=int, default=5)
+        parser.add_argument(
+            "--burst",
+            type=int,
+            default=50,
+            help="logins to replay at once through the pool, 0 to skip",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=settings.PASSWORD_HASH_WORKERS
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        rounds = options["min_rounds"]
+        for candidate in range(options["min_rounds"], options["max_rounds"] + 1):
+            context = crypt_context(candidate)
+            timings = []
+            for _ in range(options["samples"]):
+                started = time.perf_counter()
+                context.hash("benchmark")
+                timings.append((time.perf_counter() - started) * 1000)
+            median = statistics.median(timings)
+            self.stdout.write(f"rounds {candidate}: {median:.0f}ms")
+            if median > options["target_ms"]:
+                break
+            rounds = candidate
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"PASSWORD_HASH_ROUNDS={rounds} for a {options['target_ms']:.0f}ms "
+                "target"
+            )
+        )
+
+        if not options["burst"]:
+            return
+        hasher = PasswordHasher(
+            rounds=rounds, workers=options["workers"], max_queue=options["burst"]
+        )
+        hashed = crypt_context(rounds).hash("benchmark")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["burst"]) as requests:
+            list(
+                requests.map(
+                    lambda _: hasher.verify("benchmark", hashed),
+                    range(options["burst"]),
+                )
+            )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{options['burst']} logins on {options['workers']} workers in "
+            f"{elapsed:.1f}s"
+        )
+        for metric, value in hasher.stats().items():
+            self.stdout.write(f"  {metric}: {value}")
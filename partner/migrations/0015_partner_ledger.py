@@ -0,0 +1,139 @@
+# Generated by Django 4.1.7 on 2026-10-19 18:45
+
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("partner", "0014_reconciliationrun_reconciliationentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PartnerBalance",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateField(auto_now=True)),
+                ("revenue", models.FloatField(default=0.0)),
+                ("commission", models.FloatField(default=0.0)),
+                ("expenses", models.FloatField(default=0.0)),
+                ("payouts", models.FloatField(default=0.0)),
+                ("balance", models.FloatField(default=0.0)),
+                ("sequence", models.BigIntegerField(default=0)),
+                (
+                    "partner",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ledger_balance",
+                        to="partner.partner",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="LedgerSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateField(auto_now=True)),
+                ("revenue", models.FloatField(default=0.0)),
+                ("commission", models.FloatField(default=0.0)),
+                ("expenses", models.FloatField(default=0.0)),
+                ("payouts", models.FloatField(default=0.0)),
+                ("balance", models.FloatField(default=0.0)),
+                ("sequence", models.BigIntegerField(default=0)),
+                (
+                    "partner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ledger_snapshots",
+                        to="partner.partner",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="LedgerEntry",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateField(auto_now=True)),
+                ("sequence", models.BigIntegerField()),
+                (
+                    "entry_type",
+                    models.CharField(
+                        choices=[
+                            ("SALE", "SALE"),
+                            ("COMMISSION", "COMMISSION"),
+                            ("SMS", "SMS"),
+                            ("PAYOUT", "PAYOUT"),
+                        ],
+                        max_length=255,
+                    ),
+                ),
+                ("amount", models.FloatField()),
+                ("balance", models.FloatField()),
+                ("reference", models.CharField(blank=True, max_length=255, null=True)),
+                (
+                    "partner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ledger_entries",
+                        to="partner.partner",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="ledgersnapshot",
+            index=models.Index(
+                fields=["partner", "-sequence"], name="ledger_snapshot_sequence"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="ledgerentry",
+            constraint=models.UniqueConstraint(
+                fields=("partner", "sequence"), name="ledger_entry_partner_sequence"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="ledgerentry",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("reference__isnull", False)),
+                fields=("partner", "entry_type", "reference"),
+                name="ledger_entry_reference",
+            ),
+        ),
+    ]
@@ -0,0 +1,114 @@
+# Generated by Django 4.1.7 on 2026-10-19 22:05
+
+from collections import defaultdict
+from typing import Any, DefaultDict, Dict, List
+
+from django.db import migrations
+from django.db.models import Sum
+
+CONFIRMED_PAYMENT_STATES = ["PAID", "OVERPAID"]
+
+
+def open_partner_ledgers(apps: Any, schema_editor: Any) -> None:
+    """
+    Post each partner's sales and sms spend so far as opening entries,
+    sales already reconciled are posted as paid out
+    """
+    Partner = apps.get_model("partner", "Partner")
+    PartnerSMS = apps.get_model("partner", "PartnerSMS")
+    PartnerBalance = apps.get_model("partner", "PartnerBalance")
+    LedgerEntry = apps.get_model("partner", "LedgerEntry")
+    Ticket = apps.get_model("events", "Ticket")
+
+    # what was paid for each payment's tickets, shared between partners by
+    # list price like the ledger does
+    orders: DefaultDict[Any, List[Dict[str, Any]]] = defaultdict(list)
+    for sale in (
+        Ticket.objects.filter(payment__state__in=CONFIRMED_PAYMENT_STATES)
+        .values(
+            "payment_id",
+            "payment__amount",
+            "payment__reconciled",
+            "ticket_type__event__partner_id",
+        )
+        .annotate(price=Sum("ticket_type__price"))
+        .order_by("payment_id")
+        .iterator()
+    ):
+        orders[sale["payment_id"]].append(sale)
+
+    sales: DefaultDict[Any, float] = defaultdict(float)
+    settled: DefaultDict[Any, float] = defaultdict(float)
+    for order in orders.values():
+        order_price = sum(sale["price"] or 0 for sale in order)
+        for sale in order:
+            share = (
+                (sale["price"] or 0) / order_price if order_price else 1 / len(order)
+            )
+            amount = float(sale["payment__amount"]) * share
+            partner_id = sale["ticket_type__event__partner_id"]
+            sales[partner_id] += amount
+            if sale["payment__reconciled"]:
+                settled[partner_id] += amount
+
+    sms_spend = {
+        partner_id: sms_used * per_sms_rate
+        for partner_id, sms_used, per_sms_rate in PartnerSMS.objects.values_list(
+            "partner_id", "sms_used", "per_sms_rate"
+        )
+    }
+
+    balances: List[Any] = []
+    entries: List[Any] = []
+    for partner_id, comission_rate in Partner.objects.values_list(
+        "id", "comission_rate"
+    ).iterator():
+        revenue = sales[partner_id]
+        totals: Dict[str, float] = {
+            "revenue": revenue,
+            "commission": revenue * (comission_rate / 100),
+            "expenses": sms_spend.get(partner_id, 0.0),
+            "payouts": settled[partner_id] * ((100 - comission_rate) / 100),
+        }
+        postings = [
+            ("SALE", totals["revenue"]),
+            ("COMMISSION", -totals["commission"]),
+            ("SMS", -totals["expenses"]),
+            ("PAYOUT", -totals["payouts"]),
+        ]
+        balance = 0.0
+        for sequence, (entry_type, amount) in enumerate(postings, start=1):
+            balance += amount
+            entries.append(
+                LedgerEntry(
+                    partner_id=partner_id,
+                    sequence=sequence,
+                    entry_type=entry_type,
+                    amount=amount,
+                    balance=balance,
+                    reference="opening",
+                )
+            )
+        balances.append(
+            PartnerBalance(
+                partner_id=partner_id,
+                balance=balance,
+                sequence=len(postings),
+                **totals,
+            )
+        )
+    PartnerBalance.objects.bulk_create(balances, batch_size=1000)
+    LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("events", "0013_ticketsalesrollup"),
+        ("partner", "0015_partner_ledger"),
+        ("payments", "0013_payment_unreconciled"),
+    ]
+
+    operations = [
+        migrations.RunPython(open_partner_ledgers, migrations.RunPython.noop),
+    ]
@@ -5,7 +5,7 @@ from django.db import models
 
 from core.models import BaseModel
 from core.utils import generate_agent_number
-from partner.constants import PartnerPromotionPeriod, PersonType
+from partner.constants import LedgerEntryType, PartnerPromotionPeriod, PersonType
 
 
 class Person(BaseModel):
@@ -41,6 +41,30 @@ class Partner(BaseModel):
         return self.name
 
 
+class PartnerPersonQuerySet(models.QuerySet):
+    def with_state(self) -> "PartnerPersonQuerySet":
+        """
+        Annotate ``is_scheduled`` and ``state`` so they are read, filtered
+        and ordered in the database instead of counted per person
+        """
+        from events.models import PartnerPersonSchedule
+
+        return self.annotate(
+            is_scheduled=models.Exists(
+                PartnerPersonSchedule.objects.filter(
+                    partner_person_id=models.OuterRef("pk")
+                )
+            ),
+        ).annotate(
+            state=models.Case(
+                models.When(is_active=False, then=models.Value("archived")),
+                models.When(is_scheduled=True, then=models.Value("scheduled")),
+                default=models.Value("active"),
+                output_field=models.CharField(),
+            )
+        )
+
+
 class PartnerPerson(BaseModel):
     person_number = models.CharField(
         null=False, blank=False, max_length=255, default=generate_agent_number
@@ -72,11 +96,19 @@ class PartnerPerson(BaseModel):
         verbose_name="Is the person hidden", null=False, blank=False, default=False
     )
 
+    objects = PartnerPersonQuerySet.as_manager()
+
+    _scheduled: Optional[bool] = None
+    _state_label: Optional[str] = None
+
     def __str__(self) -> str:
         return f"{self.person.name}: [{self.partner.name} {self.person_type}]"
 
     @property
     def is_scheduled(self) -> bool:
+        if self._scheduled is not None:
+            return self._scheduled
+
         from events.models import PartnerPersonSchedule
 
         if PartnerPersonSchedule.objects.filter(partner_person_id=self.id).count():
@@ -84,8 +116,15 @@ class PartnerPerson(BaseModel):
 
         return False
 
+    @is_scheduled.setter
+    def is_scheduled(self, value: bool) -> None:
+        self._scheduled = value
+
     @property
     def state(self) -> str:
+        if self._state_label is not None:
+            return self._state_label
+
         if not self.is_active:
             return "archived"
 
@@ -94,6 +133,10 @@ class PartnerPerson(BaseModel):
 
         return "active"
 
+    @state.setter
+    def state(self, value: str) -> None:
+        self._state_label = value
+
     @classmethod
     @property
     def search_vector(cls) -> List[str]:
@@ -174,3 +217,135 @@ class PromoOptIn(BaseModel):
 
     def __str__(self) -> str:
         return f"{self.person.name}'s promo opt in for {self.partner.name}'s events"
+
+
+class ReconciliationRun(BaseModel):
+    """
+    A weekly reconciliation, payments made up to ``watermark`` are settled
+    per partner so a run that stops part way can be picked up again
+    """
+
+    watermark = models.DateTimeField(null=False, blank=False)
+    total_balance = models.FloatField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"Reconciliation up to {self.watermark}"
+
+
+class ReconciliationEntry(BaseModel):
+    run = models.ForeignKey(
+        ReconciliationRun,
+        on_delete=models.CASCADE,
+        null=False,
+        blank=False,
+        related_name="entries",
+    )
+    partner = models.ForeignKey(
+        Partner, on_delete=models.CASCADE, null=False, blank=False
+    )
+    revenue = models.FloatField(null=False, blank=False, default=0.0)
+    sms_cost = models.FloatField(null=False, blank=False, default=0.0)
+    balance = models.FloatField(null=False, blank=False, default=0.0)
+    payments = models.IntegerField(null=False, blank=False, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["run", "partner"], name="reconciliation_entry_run_partner"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.partner.name}'s reconciliation of {self.balance}"
+
+
+class LedgerEntry(BaseModel):
+    """
+    Append only record of money credited to or debited from a partner,
+    ``amount`` is signed and ``balance`` is the partner's balance after it
+    """
+
+    partner = models.ForeignKey(
+        Partner,
+        on_delete=models.CASCADE,
+        null=False,
+        blank=False,
+        related_name="ledger_entries",
+    )
+    sequence = models.BigIntegerField(null=False, blank=False)
+    entry_type = models.CharField(
+        max_length=255, choices=LedgerEntryType.choices, null=False, blank=False
+    )
+    amount = models.FloatField(null=False, blank=False)
+    balance = models.FloatField(null=False, blank=False)
+    reference = models.CharField(max_length=255, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["partner", "sequence"], name="ledger_entry_partner_sequence"
+            ),
+            models.UniqueConstraint(
+                fields=["partner", "entry_type", "reference"],
+                condition=models.Q(reference__isnull=False),
+                name="ledger_entry_reference",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.partner.name} {self.entry_type} of {self.amount}"
+
+
+class LedgerTotals(BaseModel):
+    revenue = models.FloatField(null=False, blank=False, default=0.0)
+    commission = models.FloatField(null=False, blank=False, default=0.0)
+    expenses = models.FloatField(null=False, blank=False, default=0.0)
+    payouts = models.FloatField(null=False, blank=False, default=0.0)
+    balance = models.FloatField(null=False, blank=False, default=0.0)
+    # sequence of the last entry included in the totals
+    sequence = models.BigIntegerField(null=False, blank=False, default=0)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def net(self) -> float:
+        return self.revenue - self.commission
+
+
+class PartnerBalance(LedgerTotals):
+    """
+    Running totals of a partner's ledger, updated with each entry
+    """
+
+    partner = models.OneToOneField(
+        Partner,
+        on_delete=models.CASCADE,
+        null=False,
+        blank=False,
+        related_name="ledger_balance",
+    )
+
+    def __str__(self) -> str:
+        return f"{self.partner.name}'s balance of {self.balance}"
+
+
+class LedgerSnapshot(LedgerTotals):
+    partner = models.ForeignKey(
+        Partner,
+        on_delete=models.CASCADE,
+        null=False,
+        blank=False,
+        related_name="ledger_snapshots",
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["partner", "-sequence"], name="ledger_snapshot_sequence"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.partner.name}'s balance of {self.balance} @ {self.sequence}"
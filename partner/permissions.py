@@ -5,10 +5,9 @@ from rest_framework.request import Request
 
 from core.error_codes import ErrorCodes
 from core.exceptions import HttpErrorException
-from eticketing_api import settings
+from partner.auth import get_auth_context
 from partner.constants import PersonType
-from partner.models import Partner, PartnerPerson
-from partner.utils import decode_access_token, get_user_from_access_token
+from partner.models import PartnerPerson, Person
 
 ACCESS_DENIED_EXCEPTION = HttpErrorException(
     status_code=403,
@@ -31,11 +30,7 @@ NO_MEMBERSHIP_EXCEPTION = HttpErrorException(
 
 
 def check_self(request: Request, pk: Union[str, int]) -> bool:
-    token_key = settings.AUTH_HEADER
-    if token_key not in request.META:
-        raise ACCESS_DENIED_EXCEPTION
-
-    user_data = decode_access_token(request.META[token_key])
+    user_data = get_auth_context(request).claims
 
     if user_data["user_id"] != pk:
         raise NON_SELF_EXCEPTION
@@ -44,11 +39,7 @@ def check_self(request: Request, pk: Union[str, int]) -> bool:
 
 
 def check_self_no_partnership(request: Request, pk: Union[str, int]) -> bool:
-    token_key = settings.AUTH_HEADER
-    if token_key not in request.META:
-        raise ACCESS_DENIED_EXCEPTION
-
-    user = get_user_from_access_token(request.META[token_key])
+    user = get_auth_context(request).user
 
     if str(user.id) != pk:
         raise NON_SELF_EXCEPTION
@@ -56,56 +47,34 @@ def check_self_no_partnership(request: Request, pk: Union[str, int]) -> bool:
     return True
 
 
-def get_request_user_id(request: Request) -> str:
-    token_key = settings.AUTH_HEADER
-    if token_key not in request.META:
-        raise ACCESS_DENIED_EXCEPTION
+def get_request_user(request: Request) -> Person:
+    return get_auth_context(request).user
 
-    user_data = decode_access_token(request.META[token_key])
 
-    return user_data["user_id"]
+def get_request_user_id(request: Request) -> str:
+    return get_auth_context(request).claims["user_id"]
 
 
 def get_request_partner_id(request: Request) -> str:
-    token_key = settings.AUTH_HEADER
-    if token_key not in request.META:
-        raise ACCESS_DENIED_EXCEPTION
-
-    user_data = decode_access_token(request.META[token_key])
-
-    return user_data["partner"]
+    return get_auth_context(request).claims["partner"]
 
 
 def get_request_person(request: Request) -> PartnerPerson:
-    user_id = get_request_user_id(request)
-    partner_id = get_request_partner_id(request)
-
-    try:
-        person: PartnerPerson = PartnerPerson.objects.get(
-            person_id=user_id, partner_id=partner_id
-        )
-        if not person.is_active:
-            raise ACCESS_DENIED_EXCEPTION
-        return person
-    except PartnerPerson.DoesNotExist:
+    context = get_auth_context(request)
+    partner_id = context.claims["partner"]
+    person = context.membership
+    if person is None or str(person.partner_id) != partner_id:
         raise NO_MEMBERSHIP_EXCEPTION
+    if not person.is_active:
+        raise ACCESS_DENIED_EXCEPTION
+    return person
 
 
 def get_request_person_id(request: Request) -> str:
-    user_id = get_request_user_id(request)
-    partner_id = get_request_partner_id(request)
-
-    try:
-        person: PartnerPerson = PartnerPerson.objects.get(
-            person_id=user_id, partner_id=partner_id
-        )
-        if not person.is_active:
-            raise ACCESS_DENIED_EXCEPTION
-        return str(person.person_id)
-    except PartnerPerson.DoesNotExist:
-        if not Partner.objects.filter(**{"owner_id": user_id, "pk": partner_id}):
-            raise NO_MEMBERSHIP_EXCEPTION
-        return user_id
+    user_data = get_auth_context(request).claims
+    if not user_data["active"]:
+        raise ACCESS_DENIED_EXCEPTION
+    return user_data["user_id"]
 
 
 def get_request_partner_person_id(request: Request) -> str:
@@ -113,29 +82,19 @@ def get_request_partner_person_id(request: Request) -> str:
     NOTE: This should only be used with permissions guarded
         endpoints
     """
-    user_id = get_request_person_id(request)
-    partner_id = get_request_partner_id(request)
-    return str(PartnerPerson.objects.get(person_id=user_id, partner_id=partner_id).id)
+    user_data = get_auth_context(request).claims
+    if not user_data["partner_person"]:
+        raise NO_MEMBERSHIP_EXCEPTION
+    if not user_data["active"]:
+        raise ACCESS_DENIED_EXCEPTION
+    return user_data["partner_person"]
 
 
 def check_permissions(request: Request, person_type: PersonType) -> bool:
-    token_key = settings.AUTH_HEADER
-    if token_key not in request.META:
-        raise ACCESS_DENIED_EXCEPTION
+    user_data = get_auth_context(request).claims
 
-    user_data = decode_access_token(request.META[token_key])
-
-    try:
-        partner_person: PartnerPerson = PartnerPerson.objects.get(
-            person_id=user_data["user_id"]
-        )
-        if not partner_person.is_active:
-            raise ACCESS_DENIED_EXCEPTION
-    except PartnerPerson.DoesNotExist:
-        try:
-            Partner.objects.get(owner_id=user_data["user_id"])
-        except Partner.DoesNotExist:
-            raise NO_PARTNERSHIP_EXCEPTION
+    if not user_data["active"]:
+        raise ACCESS_DENIED_EXCEPTION
 
     if user_data["membership"] != person_type.value:
         raise ACCESS_DENIED_EXCEPTION
@@ -185,10 +144,4 @@ class LoggedInPermission(BasePermission):
     message = "You need to be authenticated to perform this action"
 
     def has_permission(self, request: Request, view: Any) -> bool:
-        token_key = settings.AUTH_HEADER
-        if token_key not in request.META:
-            raise ACCESS_DENIED_EXCEPTION
-
-        user = get_user_from_access_token(request.META[token_key])
-
-        return user is not None
+        return get_request_user(request) is not None
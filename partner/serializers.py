@@ -145,6 +145,11 @@ class PartnerPersonReadSerializer(InDBBaseSerializer, PartnerPersonBaseSerialize
 
 class TokenSerializer(serializers.Serializer):
     token = serializers.CharField(max_length=1024)
+    refresh = serializers.CharField(max_length=1024, required=False)
+
+
+class RefreshTokenSerializer(serializers.Serializer):
+    refresh = serializers.CharField(max_length=1024)
 
 
 class PasswordResetPayloadSerializer(serializers.Serializer):
@@ -165,12 +170,37 @@ class RevenuesSerializer(serializers.Serializer):
     revenue = serializers.FloatField()
     expenses = serializers.FloatField()
     net = serializers.FloatField()
+    balance = serializers.FloatField()
 
 
 class RedemtionRateSerializer(serializers.Serializer):
     rate = serializers.FloatField()
 
 
+class DashboardEventSerializer(serializers.Serializer):
+    id = serializers.CharField(max_length=255)
+    name = serializers.CharField(max_length=256)
+    event_date = serializers.CharField(max_length=255)
+    tickets = serializers.IntegerField()
+    redeemed = serializers.IntegerField()
+    sales = serializers.FloatField()
+    redemption_rate = serializers.FloatField()
+
+
+class DashboardSalesAtDateSerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    revenue = serializers.FloatField()
+    date = serializers.CharField(max_length=255)
+
+
+class DashboardSerializer(serializers.Serializer):
+    sales = serializers.IntegerField()
+    revenues = RevenuesSerializer()
+    rate = serializers.FloatField()
+    ranked_events = DashboardEventSerializer(many=True)
+    sales_per_day = DashboardSalesAtDateSerializer(many=True)
+
+
 class PartnerSMSPackageUpdateSerializer(
     BaseSerializer, PartnerSMSPackageBaseSerializer
 ):
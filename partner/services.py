@@ -1,21 +1,39 @@
+import json
+import uuid
+from datetime import date, datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
 from typing import Any, Dict, List, Optional, Tuple, Union
 
+import redis
+from django.db import connection, transaction
+from django.db.models import Case, Count, Exists, F, FloatField, OuterRef, Q, Sum, When
+from django.db.models.functions import Coalesce, TruncDay
 from django.db.models.query import QuerySet
 from rest_framework.request import Request
 
 from core.error_codes import ErrorCodes
 from core.exceptions import HttpErrorException, ObjectNotFoundException
+from core.outbox import enqueue
+from core.redis import redis_client
 from core.services import CRUDService
 from eticketing_api import settings
-from events.models import Event
-from notifications.tasks import send_email
+from events.models import Event, ReminderOptIn, TicketSalesRollup, TicketType
+from notifications.tasks import send_email, send_sms, send_sms_batch
+from owners.models import Owner
+from partner.auth import token_revocations
+from partner.constants import LedgerEntryType
+from partner.ledger import partner_ledger
 from partner.models import (
+    LedgerEntry,
     Partner,
     PartnerPerson,
     PartnerPromotion,
     PartnerSMS,
     Person,
     PromoOptIn,
+    ReconciliationEntry,
+    ReconciliationRun,
 )
 from partner.serializers import (
     PartnerPersonCreateSerializer,
@@ -39,6 +57,9 @@ from partner.utils import (
     random_password,
     verify_otp,
 )
+from payments.constants import CONFIRMED_PAYMENT_STATES
+from payments.models import Payment
+from payments.tasks import send_partner_payouts
 from tickets.models import Ticket
 
 
@@ -95,7 +116,8 @@ class PersonService(
 
     def reset_password(self, user: Person) -> str:
         otp, token = create_otp(user)
-        send_email.apply_async(
+        enqueue(
+            send_email,
             args=(
                 user.id,
                 "Ticketzone Account Support",
@@ -137,28 +159,81 @@ class PersonService(
 
         return create_access_token(user)
 
-    def get_or_create(self, person_data: Dict[str, Any]) -> Person:
-        if phone := person_data.get("phone_number"):
-            if person := Person.objects.filter(phone_number=phone).first():
-                person.email = person_data.get("email") or person.email
-                person.save()
-                return person
-        if "hashed_password" not in person_data:
-            person_data["hashed_password"] = random_password()
-        person = self.create(obj_data=person_data, serializer=PersonCreateSerializer)
-        send_email.apply_async(
+    def upsert_by_phone(self, person_data: Dict[str, Any]) -> Tuple[Person, bool]:
+        """
+        Update the email of the person with the given phone number or create
+        them, returns the person and whether they were created. Passwords
+        are only hashed when nobody has the phone number yet
+        """
+        table = Person._meta.db_table
+        columns = "id, name, email, phone_number"
+        email = person_data.get("email") or ""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table}
+                SET email = COALESCE(NULLIF(%s, ''), email), updated_at = %s
+                WHERE phone_number = %s
+                RETURNING {columns}, false
+                """,
+                [email, date.today(), person_data["phone_number"]],
+            )
+            row = cursor.fetchone()
+            if not row:
+                if "hashed_password" not in person_data:
+                    person_data["hashed_password"] = random_password()
+                cursor.execute(
+                    f"""
+                    INSERT INTO {table} (id, created_at, updated_at, name, email,
+                        phone_number, hashed_password)
+                    VALUES (%s, %s, %s, %s, COALESCE(NULLIF(%s, ''), '0'), %s, %s)
+                    ON CONFLICT (phone_number) DO UPDATE
+                    SET email = COALESCE(NULLIF(EXCLUDED.email, '0'), {table}.email)
+                    RETURNING {columns}, xmax = 0
+                    """,
+                    [
+                        uuid.uuid4(),
+                        datetime.now(),
+                        date.today(),
+                        person_data["name"],
+                        email,
+                        person_data["phone_number"],
+                        hash_password(person_data["hashed_password"]),
+                    ],
+                )
+                row = cursor.fetchone()
+
+        person_id, name, email, phone_number, created = row
+        person = Person(id=person_id, name=name, email=email, phone_number=phone_number)
+        # the row wasn't read whole, keep the instance from saving over it
+        person._state.adding = False
+        if created:
+            self.send_account_created_email(person, person_data["hashed_password"])
+        return person, created
+
+    def send_account_created_email(self, person: Person, password: str) -> None:
+        enqueue(
+            send_email,
             args=(
                 person.id,
                 settings.POST_PARTNER_PERSON_CREATE_EMAIL_TITLE,
                 settings.POST_PARTNER_PERSON_CREATE_EMAIL.format(
                     person.name,
                     person.phone_number,
-                    person_data["hashed_password"],
+                    password,
                 ),
             ),
             queue=settings.CELERY_NOTIFICATIONS_QUEUE,
         )
 
+    def get_or_create(self, person_data: Dict[str, Any]) -> Person:
+        if person_data.get("phone_number"):
+            return self.upsert_by_phone(person_data)[0]
+        if "hashed_password" not in person_data:
+            person_data["hashed_password"] = random_password()
+        person = self.create(obj_data=person_data, serializer=PersonCreateSerializer)
+        self.send_account_created_email(person, person_data["hashed_password"])
+
         return person
 
 
@@ -177,7 +252,8 @@ class PartnerService(CRUDService[Partner, PartnerSerializer, PartnerUpdateSerial
 
     def send_verification_email(self, partner: Partner) -> str:
         otp, token = create_otp(partner.owner)
-        send_email.apply_async(
+        enqueue(
+            send_email,
             args=(
                 str(partner.owner.id),
                 settings.POST_PARTNER_PERSON_CREATE_EMAIL_TITLE,
@@ -197,45 +273,171 @@ class PartnerService(CRUDService[Partner, PartnerSerializer, PartnerUpdateSerial
         return tickets
 
     def get_total_sales_revenue(self, partner_id: str) -> Dict[str, float]:
-        filters = {
-            "ticket_type__event__partner_id": partner_id,
-        }
-        tickets: QuerySet[Ticket] = Ticket.objects.filter(**filters).distinct()
-        partner: Partner = Partner.objects.get(id=partner_id)
-        sales_total = 0.0
-        for ticket in tickets:
-            sales_total += ticket.payment.amount
-
-        expenses = 0.0
-        try:
-            sms: PartnerSMS = PartnerSMS.objects.get(partner_id=partner_id)
-            sms_cost = sms.sms_used * sms.per_sms_rate
-            expenses += sms_cost
-        except PartnerSMS.DoesNotExist:
-            pass
+        balance = partner_ledger.balance(partner_id)
         return {
-            "revenue": sales_total,
-            "net": (100 - partner.comission_rate) / 100 * sales_total,
-            "expenses": expenses,
+            "revenue": balance.revenue,
+            "net": balance.net,
+            "expenses": balance.expenses,
+            "balance": balance.balance,
         }
 
-    def get_ranked_events_by_sales(self, partner_id: str) -> List[Event]:
-        filters = {
-            "partner_id": partner_id,
-        }
-        return sorted(
-            Event.objects.filter(**filters), key=lambda event: (-1 * event.sales)
+    def _event_figures(self, partner_id: str) -> QuerySet[Event]:
+        """
+        The partner's events with their ticket, redemption and sales
+        figures counted in a single grouped query
+        """
+        return Event.objects.filter(partner_id=partner_id).annotate(
+            tickets=Count("tickettype__ticket"),
+            redeemed=Count(
+                "tickettype__ticket", filter=Q(tickettype__ticket__redeemed=True)
+            ),
+            ticket_sales=Coalesce(
+                Sum("tickettype__ticket__payment__amount"),
+                0.0,
+                output_field=FloatField(),
+            ),
         )
 
+    def _redemption_rate(self, events: List[Dict[str, Any]]) -> float:
+        rates = [
+            (event["redeemed"] / event["tickets"]) * 100 if event["tickets"] else 0
+            for event in events
+        ]
+        return sum(rates) / len(rates) if rates else 0
+
+    def get_ranked_events_by_sales(self, partner_id: str) -> List[Event]:
+        events = list(self._event_figures(partner_id).order_by("-ticket_sales"))
+        for event in events:
+            event.sales = event.ticket_sales
+        return events
+
     def get_total_redemtion_rate(self, partner_id: str) -> float:
-        filters = {
-            "partner_id": partner_id,
+        return self._redemption_rate(
+            list(self._event_figures(partner_id).values("tickets", "redeemed"))
+        )
+
+    def get_dashboard(self, partner_id: str) -> Dict[str, Any]:
+        """
+        Every figure of the partner dashboard from three aggregate queries,
+        cached for a short while as dashboards are reloaded often
+        """
+        key = f"{settings.PARTNER_DASHBOARD_KEY}:{partner_id}"
+        try:
+            if cached := redis_client.get(key):
+                return json.loads(cached)
+        except redis.RedisError:
+            pass
+
+        events = list(
+            self._event_figures(partner_id)
+            .order_by("-ticket_sales")
+            .values("id", "name", "event_date", "tickets", "redeemed", "ticket_sales")
+        )
+        for event in events:
+            event["sales"] = event.pop("ticket_sales")
+            event["redemption_rate"] = self._redemption_rate([event])
+        sales_per_day = (
+            TicketSalesRollup.objects.filter(
+                partner_id=partner_id,
+                bucket__gte=datetime.today() - timedelta(days=7),
+            )
+            .annotate(date=TruncDay("bucket"))
+            .values("date")
+            .annotate(count=Sum("tickets"), revenue=Sum("revenue"))
+            .order_by("-date")
+        )
+        dashboard = {
+            "sales": sum(event["tickets"] for event in events),
+            "revenues": self.get_total_sales_revenue(partner_id),
+            "rate": self._redemption_rate(events),
+            "ranked_events": events,
+            "sales_per_day": list(sales_per_day),
         }
-        events: QuerySet[Event] = Event.objects.filter(**filters)
+        # dates and ids are sent as strings either way
+        dashboard = json.loads(json.dumps(dashboard, default=str))
         try:
-            return sum([event.redemption_rate for event in events]) / len(events)
-        except ZeroDivisionError:
-            return 0
+            redis_client.set(
+                key,
+                json.dumps(dashboard),
+                ex=settings.PARTNER_DASHBOARD_CACHE_SECONDS,
+            )
+        except redis.RedisError:
+            pass
+        return dashboard
+
+    def send_reminders(self, batch_size: int = settings.SMS_BATCH_SIZE) -> int:
+        """
+        Remind people who opted in of their events in the next 24 hours.
+        Recipients of every partner with sms left come from one query over
+        tickets, opt-ins and sms packages, each partner's quota is taken in
+        one update and messages are handed to the sms task in batches.
+        Returns the number of reminders sent
+        """
+        today = date.today()
+        recipients = (
+            Ticket.objects.filter(
+                ticket_type__event__event_date__gte=today,
+                ticket_type__event__event_date__lte=today + timedelta(days=1),
+                ticket_type__event__partner__sms_package__verified=True,
+                ticket_type__event__partner__sms_package__sms_used__lt=F(
+                    "ticket_type__event__partner__sms_package__sms_limit"
+                ),
+            )
+            .filter(
+                Exists(
+                    ReminderOptIn.objects.filter(
+                        person_id=OuterRef("payment__person_id"),
+                        event_id=OuterRef("ticket_type__event_id"),
+                    )
+                )
+            )
+            .values_list(
+                "ticket_type__event__partner_id",
+                "payment__person_id",
+                "payment__person__name",
+                "ticket_type__event_id",
+                "ticket_type__event__name",
+            )
+            .distinct()
+            .order_by("ticket_type__event__partner_id")
+        )
+
+        sent = 0
+        for partner_id, partner_recipients in groupby(
+            recipients.iterator(chunk_size=2000), key=itemgetter(0)
+        ):
+            messages = [
+                [str(person_id), settings.REMINDER_SMS.format(name, event_name)]
+                for _, person_id, name, _, event_name in partner_recipients
+            ]
+            sent += self._send_partner_reminders(str(partner_id), messages, batch_size)
+        return sent
+
+    def _send_partner_reminders(
+        self, partner_id: str, messages: List[List[str]], batch_size: int
+    ) -> int:
+        with transaction.atomic():
+            package = (
+                PartnerSMS.objects.select_for_update()
+                .filter(partner_id=partner_id)
+                .values("sms_limit", "sms_used")
+                .get()
+            )
+            messages = messages[: max(package["sms_limit"] - package["sms_used"], 0)]
+            if not messages:
+                return 0
+            PartnerSMS.objects.filter(partner_id=partner_id).update(
+                sms_used=F("sms_used") + len(messages)
+            )
+            partner_ledger.record_sms(partner_id, len(messages))
+            for start in range(0, len(messages), batch_size):
+                end = start + batch_size
+                enqueue(
+                    send_sms_batch,
+                    args=(messages[start:end],),
+                    queue=settings.CELERY_NOTIFICATIONS_QUEUE,
+                )
+        return len(messages)
 
     def add_promo_opt_in(self, partner_id: str, person_id: str) -> None:
         try:
@@ -254,26 +456,144 @@ class PartnerService(CRUDService[Partner, PartnerSerializer, PartnerUpdateSerial
     def promo_optin_count(self, partner_id: str) -> int:
         return PromoOptIn.objects.filter(partner_id=partner_id).count()
 
-    def balance(self, partner_id: str) -> float:
-        ticket_filter = {
-            "ticket_type__event__partner_id": partner_id,
-            "payment__reconciled": False,
-        }
-        tickets: QuerySet[Ticket] = Ticket.objects.filter(**ticket_filter).distinct(
-            "payment"
+    def _settle_payments(
+        self, partner_id: str, watermark: Optional[datetime] = None
+    ) -> Tuple[float, int]:
+        """
+        Mark the partner's confirmed, unreconciled payments made up to
+        ``watermark`` as reconciled in one statement, returns their total
+        and count. A payment only flips once so partners settled side by
+        side never count a payment twice
+        """
+        watermark = watermark or datetime.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH settled AS (
+                    UPDATE {Payment._meta.db_table} payment
+                    SET reconciled = true
+                    WHERE payment.reconciled = false
+                        AND payment.created_at <= %s
+                        AND payment.state = ANY(%s)
+                        AND payment.id IN (
+                            SELECT ticket.payment_id
+                            FROM {Ticket._meta.db_table} ticket
+                            JOIN {TicketType._meta.db_table} ticket_type
+                                ON ticket_type.id = ticket.ticket_type_id
+                            JOIN {Event._meta.db_table} event
+                                ON event.id = ticket_type.event_id
+                            WHERE event.partner_id = %s
+                        )
+                    RETURNING payment.amount
+                )
+                SELECT COALESCE(SUM(amount), 0), COUNT(*) FROM settled
+                """,
+                [watermark, CONFIRMED_PAYMENT_STATES, partner_id],
+            )
+            revenue, payments = cursor.fetchone()
+        return float(revenue), payments
+
+    def _sms_cost(self, run: ReconciliationRun, partner_id: str) -> float:
+        """
+        The partner's sms spend booked since the previous run's watermark
+        """
+        spend = LedgerEntry.objects.filter(
+            partner_id=partner_id,
+            entry_type=LedgerEntryType.SMS.value,
+            created_at__lte=run.watermark,
         )
-        total_revenue = 0.0
-        for ticket in tickets:
-            total_revenue += ticket.payment.amount
-            ticket.payment.reconciled = True
-            ticket.payment.save()
-        try:
-            sms: PartnerSMS = PartnerSMS.objects.get(partner_id=partner_id)
-            sms_cost = sms.sms_used * sms.per_sms_rate
-            total_revenue -= sms_cost
-        except PartnerSMS.DoesNotExist:
-            pass
-        return total_revenue
+        previous = (
+            ReconciliationRun.objects.filter(watermark__lt=run.watermark)
+            .order_by("-watermark")
+            .values_list("watermark", flat=True)
+            .first()
+        )
+        if previous:
+            spend = spend.filter(created_at__gt=previous)
+        return -(spend.aggregate(total=Sum("amount"))["total"] or 0.0)
+
+    def reconcile(self, run: ReconciliationRun, partner_id: str) -> ReconciliationEntry:
+        """
+        Settle the partner's payments for ``run`` and record the result,
+        a partner that already has an entry for the run is left as is so
+        a retried or resumed run doesn't settle it twice
+        """
+        with transaction.atomic():
+            # serialises workers handed the same partner
+            Partner.objects.select_for_update().filter(id=partner_id).first()
+            if entry := ReconciliationEntry.objects.filter(
+                run=run, partner_id=partner_id
+            ).first():
+                return entry
+            revenue, payments = self._settle_payments(partner_id, run.watermark)
+            sms_cost = self._sms_cost(run, partner_id)
+            entry = ReconciliationEntry.objects.create(
+                run=run,
+                partner_id=partner_id,
+                revenue=revenue,
+                sms_cost=sms_cost,
+                balance=revenue - sms_cost,
+                payments=payments,
+            )
+            owner = Person.objects.only("name").get(owner__id=partner_id)
+            enqueue(
+                send_sms,
+                args=(
+                    str(owner.id),
+                    settings.POST_RECONCILIATION_MESSAGE.format(
+                        owner.name, entry.balance
+                    ),
+                ),
+                queue=settings.CELERY_NOTIFICATIONS_QUEUE,
+            )
+            return entry
+
+    def complete_reconciliation(self, run_id: str) -> float:
+        """
+        Total the run's entries, partners in credit count at their
+        commission, send the owners their share and queue the partners'
+        payouts. Completing a run twice doesn't repeat either
+        """
+        with transaction.atomic():
+            run: ReconciliationRun = ReconciliationRun.objects.select_for_update().get(
+                id=run_id
+            )
+            if run.completed_at:
+                return run.total_balance or 0.0
+            total_balance = (
+                run.entries.aggregate(
+                    total=Sum(
+                        Case(
+                            When(
+                                balance__gt=0,
+                                then=F("balance")
+                                * (F("partner__comission_rate") / 100),
+                            ),
+                            default=F("balance"),
+                        )
+                    )
+                )["total"]
+                or 0.0
+            )
+            for owner in Owner.objects.all():
+                # owners aren't people on the platform, sms go to a person
+                person, _ = person_service.upsert_by_phone(
+                    {"name": owner.name, "phone_number": owner.phone_number}
+                )
+                enqueue(
+                    send_sms,
+                    args=(
+                        str(person.id),
+                        f"Your weekly leverage for {date.today()} "
+                        f"is {total_balance*(owner.stake/100)}",
+                    ),
+                    queue=settings.CELERY_NOTIFICATIONS_QUEUE,
+                )
+            run.total_balance = total_balance
+            run.completed_at = datetime.now()
+            run.save()
+            enqueue(send_partner_payouts, args=(str(run.id),))
+        return total_balance
 
 
 partner_service = PartnerService(Partner)
@@ -294,6 +614,12 @@ class PartnerPersonService(
             del obj_in["person"]
 
     def on_pre_update(self, obj_in: dict, obj: PartnerPerson) -> None:
+        if (
+            obj_in.get("is_active", obj.is_active) != obj.is_active
+            or obj_in.get("person_type", obj.person_type) != obj.person_type
+        ):
+            # tokens carry the membership's role and active status
+            token_revocations.revoke(str(obj.person_id))
         if person := obj_in.get("person", None):
             person_service.update(
                 obj_data=person,
@@ -304,7 +630,8 @@ class PartnerPersonService(
 
     def on_post_create(self, obj: PartnerPerson, obj_in: Dict[str, Any]) -> None:
         if person := obj_in.get("person", None):
-            send_email.apply_async(
+            enqueue(
+                send_email,
                 args=(
                     obj.person_id,
                     settings.POST_PARTNER_PERSON_CREATE_EMAIL_TITLE,
@@ -317,24 +644,41 @@ class PartnerPersonService(
                 queue=settings.CELERY_NOTIFICATIONS_QUEUE,
             )
 
+    def get(self, *args: Any, **kwargs: Any) -> Optional[PartnerPerson]:
+        try:
+            return (
+                PartnerPerson.objects.with_state()
+                .select_related("person")
+                .get(*args, **kwargs)
+            )
+        except PartnerPerson.DoesNotExist:
+            return None
+
+    def get_all(
+        self, *, filters: Optional[Dict[str, Any]] = None
+    ) -> QuerySet[PartnerPerson]:
+        return super().get_all(filters=filters).with_state().select_related("person")
+
     def modify_query(
         self,
         query: QuerySet,
         order_fields: Optional[List] = None,
         filters: Optional[dict] = None,
     ) -> QuerySet:
+        # scheduled people come first, then archived ones
         if order_fields:
             if "state" in order_fields:
-                order_fields.append("partnerpersonschedule")
+                order_fields.append("-is_scheduled")
                 order_fields.append("is_active")
                 del order_fields[order_fields.index("state")]
             if "-state" in order_fields:
-                order_fields.append("-partnerpersonschedule")
+                order_fields.append("is_scheduled")
                 order_fields.append("-is_active")
                 del order_fields[order_fields.index("-state")]
-        return query
+        return query.with_state().select_related("person")
 
     def on_pre_delete(self, obj: PartnerPerson) -> None:
+        token_revocations.revoke(str(obj.person_id))
         Person.objects.filter(id=obj.person_id).delete()
 
 
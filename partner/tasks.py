@@ -1,56 +1,28 @@
-from datetime import date, timedelta
+from datetime import date, datetime
 from typing import Sequence
 
-from celery import shared_task
+from celery import chord, shared_task
+from django.db import transaction
 from django.db.models.query import QuerySet
 
+from core.outbox import enqueue
 from eticketing_api import settings
-from events.models import ReminderOptIn, Ticket
 from notifications.tasks import send_sms
-from owners.models import Owner
-from partner.models import Partner, PartnerPromotion, PartnerSMS, PromoOptIn
+from partner.ledger import partner_ledger
+from partner.models import (
+    Partner,
+    PartnerPromotion,
+    PartnerSMS,
+    PromoOptIn,
+    ReconciliationEntry,
+    ReconciliationRun,
+)
 from partner.services import partner_service
 
 
 @shared_task(name="send_out_reminders")
-def send_out_reminders() -> None:
-
-    next_day = date.today() + timedelta(days=1)
-
-    ticket_filters = {
-        "ticket_type__event__event_date__lte": next_day,
-        "ticket_type__event__event_date__gte": date.today(),
-    }
-
-    tickets: QuerySet[Ticket] = Ticket.objects.filter(**ticket_filters).distinct(
-        "payment__person_id"
-    )
-
-    for ticket in tickets:
-        reminderoptin_filters = {
-            "person_id": ticket.payment.person_id,
-            "event_id": ticket.ticket_type.event.id,
-        }
-        reminder_set = ReminderOptIn.objects.filter(**reminderoptin_filters).count()
-        try:
-            event_partner_sms: PartnerSMS = PartnerSMS.objects.get(
-                partner_id=ticket.ticket_type.event.partner.id
-            )
-        except PartnerSMS.DoesNotExist:
-            continue
-
-        if reminder_set and event_partner_sms.sms_left:
-            send_sms.apply_async(
-                args=(
-                    ticket.payment.person_id,
-                    settings.REMINDER_SMS.format(
-                        ticket.payment.person.name, ticket.ticket_type.event.name
-                    ),
-                ),
-                queue=settings.CELERY_NOTIFICATIONS_QUEUE,
-            )
-            event_partner_sms.sms_used += 1
-            event_partner_sms.save()
+def send_out_reminders() -> int:
+    return partner_service.send_reminders()
 
 
 @shared_task(name="send_out_promos")
@@ -72,49 +44,64 @@ def send_out_promos() -> None:
             except PartnerSMS.DoesNotExist:
                 break
             if event_partner_sms.sms_left:
-                send_sms.apply_async(
-                    args=(
-                        promo_optin.person_id,
-                        promo.message,
-                    ),
-                    queue=settings.CELERY_NOTIFICATIONS_QUEUE,
-                )
-                event_partner_sms.sms_used += 1
-                event_partner_sms.save()
+                with transaction.atomic():
+                    enqueue(
+                        send_sms,
+                        args=(
+                            promo_optin.person_id,
+                            promo.message,
+                        ),
+                        queue=settings.CELERY_NOTIFICATIONS_QUEUE,
+                    )
+                    event_partner_sms.sms_used += 1
+                    event_partner_sms.save()
+                    partner_ledger.record_sms(str(event_partner_sms.partner_id))
 
             promo.last_run = date.today()
             promo.save()
 
 
 @shared_task(name="reconcile_payments")
-def reconcile_payments() -> None:
-    partners: QuerySet[Partner] = Partner.objects.all()
-
-    total_balance = 0.0
-    for partner in partners:
-        partner_balance = partner_service.balance(str(partner.id))
-        send_sms.apply_async(
-            args=(
-                partner.owner.phone_number,
-                settings.POST_RECONCILIATION_MESSAGE.format(
-                    partner.owner.name, partner_balance
-                ),
-            ),
-            queue=settings.CELERY_NOTIFICATIONS_QUEUE,
-        )
-        if partner_balance > 0:
-            # TODO: Add payment provider send to partner
-            total_balance += partner_balance * (partner.comission_rate / 100)
-        else:
-            total_balance += partner_balance
-
-    owners: QuerySet[Owner] = Owner.objects.all()
-    for owner in owners:
-        send_sms.apply_async(
-            args=(
-                owner.phone_number,
-                f"Your weekly leverage for {date.today()} "
-                f"is {total_balance*(owner.stake/100)}",
-            ),
-            queue=settings.CELERY_NOTIFICATIONS_QUEUE,
-        )
+def reconcile_payments() -> str:
+    """
+    Settle every partner's payments made up to the run's watermark, one
+    task per partner, then total the run for the owners. An unfinished
+    run is resumed with its watermark and only the partners it hasn't
+    settled yet
+    """
+    run = (
+        ReconciliationRun.objects.filter(completed_at__isnull=True)
+        .order_by("created_at")
+        .first()
+    )
+    if run is None:
+        run = ReconciliationRun.objects.create(watermark=datetime.now())
+    partner_ids = Partner.objects.exclude(
+        id__in=ReconciliationEntry.objects.filter(run=run).values("partner_id")
+    ).values_list("id", flat=True)
+
+    settle = [
+        reconcile_partner.si(str(run.id), str(partner_id))
+        for partner_id in partner_ids.iterator()
+    ]
+    if settle:
+        chord(settle)(complete_reconciliation.si(str(run.id)))
+    else:
+        complete_reconciliation(str(run.id))
+    return str(run.id)
+
+
+@shared_task(name="reconcile_partner")
+def reconcile_partner(run_id: str, partner_id: str) -> float:
+    run = ReconciliationRun.objects.get(id=run_id)
+    return partner_service.reconcile(run, partner_id).balance
+
+
+@shared_task(name="complete_reconciliation")
+def complete_reconciliation(run_id: str) -> float:
+    return partner_service.complete_reconciliation(run_id)
+
+
+@shared_task(name="snapshot_partner_ledger")
+def snapshot_partner_ledger() -> int:
+    return partner_ledger.snapshot()
@@ -1,28 +1,75 @@
-from datetime import date, timedelta
-from typing import Any, Optional
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, List, Optional
 from unittest import mock
 from unittest.mock import Mock
 
+from celery import Signature
+from django.db import connection
 from django.test import Client, TestCase
-from rest_framework.test import APIClient
-
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.error_codes import ErrorCodes
+from core.exceptions import HttpErrorException
+from core.models import OutboxMessage
+from core.outbox import relay_outbox
+from core.redis import redis_client
 from core.utils import random_string
 from eticketing_api import settings
 from events.fixtures import event_fixtures
-from events.models import Person, Ticket
+from events.models import Event, Person, Ticket
+from notifications.tasks import send_sms
 from owners.fixtures import owner_fixtures
-from partner.constants import PersonType
+from partner.constants import LedgerEntryType, PersonType
 from partner.fixtures import partner_fixtures
-from partner.models import Partner, PartnerPerson, PartnerSMS
-from partner.services import partner_service, person_service
+from partner.hashing import PasswordHasher, crypt_context, password_hasher
+from partner.ledger import partner_ledger
+from partner.models import Partner, PartnerPerson, PartnerSMS, ReconciliationRun
+from partner.permissions import (
+    check_permissions,
+    get_request_partner_id,
+    get_request_partner_person_id,
+    get_request_person,
+    get_request_person_id,
+    get_request_user_id,
+)
+from partner.serializers import (
+    PartnerPersonReadSerializer,
+    PartnerPersonUpdateSerializer,
+)
+from partner.services import partner_person_service, partner_service, person_service
 from partner.tasks import reconcile_payments, send_out_promos, send_out_reminders
-from partner.utils import random_password, verify_otp, verify_password
+from partner.utils import (
+    create_access_token,
+    get_request_membership_or_ownership,
+    random_password,
+    verify_otp,
+    verify_password,
+    verify_person_password,
+)
+from payments.constants import PaymentStates
 from payments.fixtures import payment_fixtures
+from payments.models import Payment
+from payments.services import payment_service
 from tickets.fixtures import ticket_fixtures
 
 API_VER = settings.API_VERSION_STRING
 
 
+def create_paid_ticket(event: Event) -> Ticket:
+    ticket: Ticket = ticket_fixtures.create_ticket_obj(event=event)
+    Payment.objects.filter(id=ticket.payment_id).update(state=PaymentStates.PAID.value)
+    return ticket
+
+
+def eager_chord(header: List[Signature]) -> Callable[[Signature], Any]:
+    def run(body: Signature) -> Any:
+        return body.apply(args=([task.apply().get() for task in header],)).get()
+
+    return run
+
+
 class PartnerTestCase(TestCase):
     @mock.patch("partner.fixtures.partner_fixtures.random_password")
     def setUp(self, mock_random_password: Any) -> None:
@@ -140,14 +187,16 @@ class PartnerTestCase(TestCase):
         returned_partner = res.json()
         assert "verification_token" in returned_partner
 
+        relay_outbox()
         mock_send_email.assert_called_with(
-            args=(
+            args=[
                 res.json()["owner"]["id"],
                 settings.POST_PARTNER_PERSON_CREATE_EMAIL_TITLE,
                 settings.POST_PARTNER_PERSON_CREATE_EMAIL.format(
                     res.json()["owner"]["name"], otp
                 ),
-            ),
+            ],
+            kwargs={},
             queue=settings.CELERY_NOTIFICATIONS_QUEUE,
         )
 
@@ -251,8 +300,9 @@ class PartnerTestCase(TestCase):
         assert res.status_code == 200
         assert "person" in res.json()
 
+        relay_outbox()
         mock_send_email.assert_called_with(
-            args=(
+            args=[
                 res.json()["person"]["id"],
                 settings.POST_PARTNER_PERSON_CREATE_EMAIL_TITLE,
                 settings.POST_PARTNER_PERSON_CREATE_EMAIL.format(
@@ -260,7 +310,8 @@ class PartnerTestCase(TestCase):
                     res.json()["person"]["phone_number"],
                     partner_person_data["person"]["hashed_password"],
                 ),
-            ),
+            ],
+            kwargs={},
             queue=settings.CELERY_NOTIFICATIONS_QUEUE,
         )
 
@@ -382,6 +433,39 @@ class PartnerTestCase(TestCase):
         returned_states = [person["state"] for person in read_data["results"]]
         assert sorted(returned_states) == returned_states
 
+    def test_partner_person_state__single_query(self) -> None:
+        people = [
+            partner_fixtures.create_partner_person(
+                person_type=PersonType.TICKETING_AGENT, partner=self.owner.partner
+            )
+            for _ in range(3)
+        ]
+        event = event_fixtures.create_event_object(self.owner.person)
+        event_fixtures.create_partner_person_schedule(
+            event_id=str(event.id), partner_person_id=str(people[0].id)
+        )
+        PartnerPerson.objects.filter(id=people[1].id).update(is_active=False)
+
+        with self.assertNumQueries(1):
+            data = PartnerPersonReadSerializer(
+                partner_person_service.get_filtered(
+                    filters={
+                        "partner_id": str(self.owner.partner_id),
+                        "person_type": PersonType.TICKETING_AGENT.value,
+                    }
+                ),
+                many=True,
+            ).data
+        states = {person["id"]: person["state"] for person in data}
+        assert states[str(people[0].id)] == "scheduled"
+        assert states[str(people[1].id)] == "archived"
+        assert states[str(people[2].id)] == "active"
+
+        scheduled = partner_person_service.get_filtered(
+            filters={"partner_id": str(self.owner.partner_id), "state": "scheduled"}
+        )
+        assert [person.id for person in scheduled] == [people[0].id]
+
     def test_partner_person_export(self) -> None:
         partner_person = partner_fixtures.create_partner_person(
             person_type=PersonType.TICKETING_AGENT, partner=self.owner.partner
@@ -431,8 +515,11 @@ class PartnerTestCase(TestCase):
             PartnerPerson.objects.get(id=partner_person.id)
 
     def test_deactivated_user_raises_access_denied(self) -> None:
-        self.owner.is_active = False
-        self.owner.save()
+        partner_person_service.update(
+            obj_data={"is_active": False},
+            serializer=PartnerPersonUpdateSerializer,
+            obj_id=str(self.owner.id),
+        )
 
         partner_person = partner_fixtures.create_partner_person(
             person_type=PersonType.TICKETING_AGENT
@@ -445,7 +532,9 @@ class PartnerTestCase(TestCase):
         self.owner.is_active = True
         self.owner.save()
 
-        assert res.status_code == 403
+        # the deactivated owner's token was revoked
+        assert res.status_code == 401
+        assert "REVOKED_TOKEN" in res.json()["detail"]
 
     def test_partner_sales(self) -> None:
         event = event_fixtures.create_event_object(owner=self.owner.person)
@@ -502,6 +591,38 @@ class PartnerTestCase(TestCase):
         assert res.status_code == 200
         assert res.json()[0]["id"] == str(event.id)
 
+    def test_partner_dashboard(self) -> None:
+        event = event_fixtures.create_event_object(owner=self.owner.person)
+        ticket_type = event_fixtures.create_ticket_type_obj(event=event)
+        payment = payment_fixtures.create_payment_object(self.owner.person)
+        ticket = ticket_fixtures.create_ticket_obj(ticket_type, payment)
+        ticket.redeemed = True
+        ticket.save()
+        ticket_fixtures.create_ticket_obj(ticket_type, payment)
+        empty_event = event_fixtures.create_event_object(owner=self.owner.person)
+        partner_id = str(event.partner_id)
+        redis_client.delete(f"{settings.PARTNER_DASHBOARD_KEY}:{partner_id}")
+
+        with self.assertNumQueries(3):
+            dashboard = partner_service.get_dashboard(partner_id)
+        # cached
+        with self.assertNumQueries(0):
+            assert partner_service.get_dashboard(partner_id) == dashboard
+
+        assert dashboard["sales"] == 2
+        assert dashboard["rate"] == 25.0
+        assert [ranked["id"] for ranked in dashboard["ranked_events"]] == [
+            str(event.id),
+            str(empty_event.id),
+        ]
+        assert dashboard["ranked_events"][0]["redemption_rate"] == 50.0
+        assert dashboard["ranked_events"][0]["sales"] == payment.amount * 2
+
+        res = self.authed_client.get(f"/{API_VER}/partner/dashboard/")
+        assert res.status_code == 200
+        assert res.json()["sales"] == 2
+        assert "balance" in res.json()["revenues"]
+
     def test_list_ticket_types_with_sales(self) -> None:
         event = event_fixtures.create_event_object(owner=self.owner.person)
         ticket_type = event_fixtures.create_ticket_type_obj(event=event)
@@ -522,10 +643,10 @@ class PartnerTestCase(TestCase):
         assert res.status_code == 200
         assert res.json()["done"]
 
-    @mock.patch("notifications.tasks.send_sms.apply_async")
+    @mock.patch("notifications.tasks.send_sms_batch.apply_async")
     def test_send_out_reminders(self, mock_send_sms: Any) -> None:
         partner = partner_fixtures.create_partner_obj()
-        partner_fixtures.create_partner_sms_obj(partner=partner)
+        sms = partner_fixtures.create_partner_sms_obj(partner=partner)
         event = event_fixtures.create_event_object(owner=partner.owner)
         person: Person = partner_fixtures.create_person_obj()
         ticket: Ticket = ticket_fixtures.create_ticket_obj(event=event, person=person)
@@ -535,18 +656,47 @@ class PartnerTestCase(TestCase):
         )
 
         send_out_reminders()
+        relay_outbox()
 
         mock_send_sms.assert_called_once_with(
-            args=(
-                ticket.payment.person_id,
-                settings.REMINDER_SMS.format(
-                    ticket.payment.person.name, ticket.ticket_type.event.name
-                ),
-            ),
+            args=[
+                [
+                    [
+                        str(ticket.payment.person_id),
+                        settings.REMINDER_SMS.format(
+                            ticket.payment.person.name, ticket.ticket_type.event.name
+                        ),
+                    ]
+                ]
+            ],
+            kwargs={},
             queue=mock.ANY,
         )
+        sms.refresh_from_db()
+        assert sms.sms_used == 1
 
-    @mock.patch("notifications.tasks.send_sms.apply_async")
+    @mock.patch("notifications.tasks.send_sms_batch.apply_async")
+    def test_send_out_reminders__capped_at_sms_left(self, mock_send_sms: Any) -> None:
+        partner = partner_fixtures.create_partner_obj()
+        sms = partner_fixtures.create_partner_sms_obj(partner=partner)
+        sms.sms_used = sms.sms_limit - 1
+        sms.save()
+        event = event_fixtures.create_event_object(owner=partner.owner)
+        for _ in range(2):
+            ticket: Ticket = ticket_fixtures.create_ticket_obj(event=event)
+            partner_fixtures.create_reminder_optin_object(
+                person=ticket.payment.person, event=event
+            )
+
+        assert send_out_reminders() == 1
+        relay_outbox()
+
+        [call] = mock_send_sms.call_args_list
+        assert len(call.kwargs["args"][0]) == 1
+        sms.refresh_from_db()
+        assert sms.sms_used == sms.sms_limit
+
+    @mock.patch("notifications.tasks.send_sms_batch.apply_async")
     def test_send_out_reminders__no_optin(self, mock_send_sms: Any) -> None:
         partner = partner_fixtures.create_partner_obj()
         partner_fixtures.create_partner_sms_obj(partner=partner)
@@ -557,7 +707,7 @@ class PartnerTestCase(TestCase):
 
         assert not mock_send_sms.called
 
-    @mock.patch("notifications.tasks.send_sms.apply_async")
+    @mock.patch("notifications.tasks.send_sms_batch.apply_async")
     def test_send_out_reminders__no_sms_package(self, mock_send_sms: Any) -> None:
         partner = partner_fixtures.create_partner_obj()
         event = event_fixtures.create_event_object(owner=partner.owner)
@@ -568,7 +718,7 @@ class PartnerTestCase(TestCase):
 
         assert not mock_send_sms.called
 
-    @mock.patch("notifications.tasks.send_sms.apply_async")
+    @mock.patch("notifications.tasks.send_sms_batch.apply_async")
     def test_send_out_reminders__no_verified_sms_package(
         self, mock_send_sms: Any
     ) -> None:
@@ -595,9 +745,11 @@ class PartnerTestCase(TestCase):
         sms_pre_use = sms.sms_limit - sms.sms_used
 
         send_out_promos()
+        relay_outbox()
 
         mock_send_sms.assert_called_once_with(
-            args=(optin.person.id, promo.message),
+            args=[str(optin.person.id), promo.message],
+            kwargs={},
             queue=mock.ANY,
         )
 
@@ -775,55 +927,147 @@ class PartnerTestCase(TestCase):
         partner = partner_fixtures.create_partner_obj()
         partner_fixtures.create_partner_sms_obj(partner=partner)
         event = event_fixtures.create_event_object(partner.owner)
-        t1 = ticket_fixtures.create_ticket_obj(event=event)
-        t2 = ticket_fixtures.create_ticket_obj(event=event)
+        t1 = create_paid_ticket(event)
+        t2 = create_paid_ticket(event)
+        run = ReconciliationRun.objects.create(watermark=datetime.now())
 
-        assert partner_service.balance(str(partner.id)) == (
-            t1.payment.amount + t2.payment.amount
-        )
+        entry = partner_service.reconcile(run, str(partner.id))
+
+        assert entry.revenue == t1.payment.amount + t2.payment.amount
+        assert entry.payments == 2
 
+    @mock.patch("partner.tasks.chord", new=eager_chord)
+    @mock.patch("payments.tasks.send_partner_payouts.apply_async", new=Mock())
     @mock.patch("notifications.tasks.send_sms.apply_async")
     def test_reconciliation(self, mock_send_sms: Any) -> None:
         partner = partner_fixtures.create_partner_obj()
         partner_fixtures.create_partner_sms_obj(partner=partner)
         event = event_fixtures.create_event_object(partner.owner)
-        t1 = ticket_fixtures.create_ticket_obj(event=event)
-        t2 = ticket_fixtures.create_ticket_obj(event=event)
+        t1 = create_paid_ticket(event)
+        t2 = create_paid_ticket(event)
         owner = owner_fixtures.create_owner_obj()
 
         totals = t1.payment.amount + t2.payment.amount
         totals -= self.send_out_promo_util(partner)
 
         reconcile_payments()
+        relay_outbox()
 
         calls = [
             mock.call(
-                args=(
-                    partner.owner.phone_number,
+                args=[
+                    str(partner.owner.id),
                     settings.POST_RECONCILIATION_MESSAGE.format(
                         partner.owner.name, totals
                     ),
-                ),
+                ],
+                kwargs={},
                 queue=mock.ANY,
             ),
             mock.call(
-                args=(
-                    owner.phone_number,
+                args=[
+                    str(Person.objects.get(phone_number=owner.phone_number).id),
                     f"Your weekly leverage for {date.today()} "
                     f"is {(totals*(partner.comission_rate/100))*(owner.stake/100)}",
-                ),
+                ],
+                kwargs={},
                 queue=mock.ANY,
             ),
         ]
 
         mock_send_sms.assert_has_calls(calls, any_order=True)
 
+    def test_reconciliation_method__sms_cost_per_run(self) -> None:
+        partner = partner_fixtures.create_partner_obj()
+        sms = partner_fixtures.create_partner_sms_obj(partner=partner)
+        partner_ledger.record_sms(str(partner.id), 2)
+        first = ReconciliationRun.objects.create(watermark=datetime.now())
+        second = ReconciliationRun.objects.create(watermark=datetime.now())
+
+        assert partner_service.reconcile(first, str(partner.id)).sms_cost == (
+            2 * sms.per_sms_rate
+        )
+        assert partner_service.reconcile(second, str(partner.id)).sms_cost == 0
+
+    def test_reconciliation_method__unpaid_left_unsettled(self) -> None:
+        partner = partner_fixtures.create_partner_obj()
+        event = event_fixtures.create_event_object(partner.owner)
+        paid = create_paid_ticket(event)
+        pending = ticket_fixtures.create_ticket_obj(event=event)
+        run = ReconciliationRun.objects.create(watermark=datetime.now())
+
+        entry = partner_service.reconcile(run, str(partner.id))
+
+        assert (entry.revenue, entry.payments) == (paid.payment.amount, 1)
+        pending.payment.refresh_from_db()
+        assert not pending.payment.reconciled
+
+    def test_reconciliation_method__watermark(self) -> None:
+        partner = partner_fixtures.create_partner_obj()
+        event = event_fixtures.create_event_object(partner.owner)
+        settled = create_paid_ticket(event)
+        watermark = datetime.now()
+        later = create_paid_ticket(event)
+        runs = [ReconciliationRun.objects.create(watermark=watermark) for _ in "ab"]
+
+        entries = [partner_service.reconcile(run, str(partner.id)) for run in runs]
+
+        assert [entry.revenue for entry in entries] == [settled.payment.amount, 0]
+        later.payment.refresh_from_db()
+        assert not later.payment.reconciled
+
+    @mock.patch("partner.tasks.chord", new=eager_chord)
+    @mock.patch("payments.tasks.send_partner_payouts.apply_async", new=Mock())
+    @mock.patch("notifications.tasks.send_sms.apply_async")
+    def test_reconciliation__resumes_run(self, mock_send_sms: Any) -> None:
+        settled_partner = partner_fixtures.create_partner_obj()
+        partner = partner_fixtures.create_partner_obj()
+        settled_ticket = create_paid_ticket(
+            event_fixtures.create_event_object(settled_partner.owner)
+        )
+        ticket = create_paid_ticket(event_fixtures.create_event_object(partner.owner))
+        run = ReconciliationRun.objects.create(watermark=datetime.now())
+        partner_service.reconcile(run, str(settled_partner.id))
+        relay_outbox()
+        mock_send_sms.reset_mock()
+
+        assert reconcile_payments() == str(run.id)
+        relay_outbox()
+
+        run.refresh_from_db()
+        assert run.completed_at
+        assert run.entries.get(partner=partner).payments == 1
+        assert run.entries.get(partner=settled_partner).payments == 1
+        ticket.payment.refresh_from_db()
+        assert ticket.payment.reconciled
+        sent_to = [call.kwargs["args"][0] for call in mock_send_sms.call_args_list]
+        assert str(partner.owner.id) in sent_to
+        assert str(settled_partner.owner.id) not in sent_to
+        assert settled_ticket.payment.amount + ticket.payment.amount == sum(
+            run.entries.values_list("revenue", flat=True)
+        )
+
+    def test_complete_reconciliation__once(self) -> None:
+        owner = owner_fixtures.create_owner_obj()
+        run = ReconciliationRun.objects.create(watermark=datetime.now())
+
+        partner_service.complete_reconciliation(str(run.id))
+        partner_service.complete_reconciliation(str(run.id))
+
+        [message] = OutboxMessage.objects.filter(task=send_sms.name)
+        # send_sms looks the recipient up as a person
+        person = Person.objects.get(pk=message.args[0])
+        assert person.phone_number == owner.phone_number
+
     def test_get_partner_revenue(self) -> None:
         partner = partner_fixtures.create_partner_obj()
         event = event_fixtures.create_event_object(owner=partner.owner)
         ticket_type = event_fixtures.create_ticket_type_obj(event=event)
         payment = payment_fixtures.create_payment_object(partner.owner)
         ticket_fixtures.create_ticket_obj(ticket_type, payment)
+        payment_service.transition(
+            str(payment.id), PaymentStates.PAID.value, source="test"
+        )
 
         res = self.unauthed_client.get(
             f"/{API_VER}/partner/revenue/",
@@ -835,12 +1079,26 @@ class PartnerTestCase(TestCase):
         assert "revenue" in res.json()
         assert "net" in res.json()
         revenues = res.json()
+        # partners are credited with what was paid for the tickets
+        commission = payment.amount * (partner.comission_rate / 100)
         assert revenues["revenue"] == payment.amount
         assert revenues["expenses"] == 0
-        assert revenues["net"] == payment.amount * (
-            (100 - partner.comission_rate) / 100
+        assert revenues["net"] == payment.amount - commission
+        assert revenues["balance"] == revenues["net"]
+
+    def test_get_partner_revenue__unpaid(self) -> None:
+        partner = partner_fixtures.create_partner_obj()
+        event = event_fixtures.create_event_object(owner=partner.owner)
+        ticket_fixtures.create_ticket_obj(event=event)
+
+        res = self.unauthed_client.get(
+            f"/{API_VER}/partner/revenue/",
+            HTTP_AUTHORIZATION=partner_fixtures.get_partner_owner_auth(partner),
         )
 
+        assert res.status_code == 200
+        assert res.json()["revenue"] == 0
+
     @mock.patch("partner.utils.random_password")
     @mock.patch("notifications.tasks.send_email.apply_async")
     def test_create_verify_otp(
@@ -860,6 +1118,7 @@ class PartnerTestCase(TestCase):
         verification = verify_otp(token, random_password())
 
         assert not verification[0]
+        relay_outbox()
         mock_send_email.assert_called()
 
     @mock.patch("partner.utils.random_password")
@@ -881,6 +1140,7 @@ class PartnerTestCase(TestCase):
 
         assert res.status_code == 200
         assert res.json()["secret"]
+        relay_outbox()
         mock_send_email.assert_called()
         reset_secret = res.json()["secret"]
 
@@ -913,3 +1173,256 @@ class PartnerTestCase(TestCase):
         )
 
         assert res.status_code == 400
+
+
+class PartnerLedgerTestCase(TestCase):
+    def setUp(self) -> None:
+        self.partner = partner_fixtures.create_partner_obj()
+        self.sms = partner_fixtures.create_partner_sms_obj(partner=self.partner)
+        self.event = event_fixtures.create_event_object(self.partner.owner)
+
+    def test_record_sales(self) -> None:
+        ticket = ticket_fixtures.create_ticket_obj(event=self.event)
+        ticket_fixtures.create_ticket_obj(
+            ticket_type=ticket.ticket_type, payment=ticket.payment
+        )
+
+        assert partner_ledger.record_sales([str(ticket.payment.id)]) == 2
+        assert partner_ledger.record_sales([str(ticket.payment.id)]) == 0
+
+        # credited with what was paid, not the list price
+        revenue = ticket.payment.amount
+        balance = partner_ledger.balance(str(self.partner.id))
+        assert balance.revenue == revenue
+        assert balance.commission == revenue * (self.partner.comission_rate / 100)
+        assert balance.balance == balance.net
+        assert balance.sequence == 2
+
+    def test_record_sales__split_between_partners(self) -> None:
+        other = partner_fixtures.create_partner_obj()
+        payment = payment_fixtures.create_payment_object(amount=20.0)
+        ticket_fixtures.create_ticket_obj(
+            event_fixtures.create_ticket_type_obj(event=self.event, price=300),
+            payment,
+        )
+        ticket_fixtures.create_ticket_obj(
+            event_fixtures.create_ticket_type_obj(
+                event=event_fixtures.create_event_object(other.owner), price=100
+            ),
+            payment,
+        )
+
+        partner_ledger.record_sales([str(payment.id)])
+
+        assert partner_ledger.balance(str(self.partner.id)).revenue == 15.0
+        assert partner_ledger.balance(str(other.id)).revenue == 5.0
+
+    def test_payment_confirmation_credits_partner(self) -> None:
+        ticket = ticket_fixtures.create_ticket_obj(event=self.event)
+
+        payment_service.transition(
+            str(ticket.payment.id), PaymentStates.PAID.value, source="test"
+        )
+
+        entries = self.partner.ledger_entries.order_by("sequence")
+        assert [entry.entry_type for entry in entries] == [
+            LedgerEntryType.SALE,
+            LedgerEntryType.COMMISSION,
+        ]
+        assert (
+            entries[1].balance == partner_ledger.balance(str(self.partner.id)).balance
+        )
+
+    def test_replay__from_snapshot(self) -> None:
+        ticket = ticket_fixtures.create_ticket_obj(event=self.event)
+        partner_ledger.record_sales([str(ticket.payment.id)])
+        partner_ledger.record_sms(str(self.partner.id), 2)
+
+        assert partner_ledger.snapshot() == 1
+        assert partner_ledger.snapshot() == 0
+
+        partner_ledger.record_payout(str(self.partner.id), 1.0, "payout-1")
+        partner_ledger.record_sms(str(self.partner.id))
+
+        balance = partner_ledger.balance(str(self.partner.id))
+        replayed = partner_ledger.replay(str(self.partner.id))
+        assert balance.expenses == self.sms.per_sms_rate * 3
+        assert balance.payouts == 1.0
+        assert replayed.balance == balance.balance
+        assert replayed.expenses == balance.expenses
+        assert replayed.sequence == balance.sequence == 5
+
+
+class AuthContextTestCase(TestCase):
+    def setUp(self) -> None:
+        self.partner = partner_fixtures.create_partner_obj()
+        self.member = partner_fixtures.create_partner_person(partner=self.partner)
+
+    def get_request(self, token: str) -> Request:
+        return Request(APIRequestFactory().get("/", HTTP_AUTHORIZATION=token))
+
+    def test_member_request__single_query(self) -> None:
+        request = self.get_request(
+            partner_fixtures.create_auth_token(self.member.person)
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            assert check_permissions(request, PersonType.PARTNER_MEMBER)
+            assert get_request_user_id(request) == str(self.member.person_id)
+            assert get_request_partner_id(request) == str(self.partner.id)
+            assert get_request_person(request) == self.member
+            assert get_request_partner_person_id(request) == str(self.member.id)
+            assert get_request_membership_or_ownership(request) == (
+                str(self.partner.id),
+                PersonType.PARTNER_MEMBER.value,
+            )
+        assert len(queries) == 1
+
+    def test_owner_request(self) -> None:
+        request = self.get_request(
+            partner_fixtures.get_partner_owner_auth(self.partner)
+        )
+
+        assert check_permissions(request, PersonType.OWNER)
+        assert get_request_person_id(request) == str(self.partner.owner_id)
+        assert get_request_membership_or_ownership(request) == (
+            str(self.partner.id),
+            PersonType.OWNER.value,
+        )
+        with self.assertRaises(HttpErrorException):
+            check_permissions(request, PersonType.PARTNER_MEMBER)
+
+    def test_inactive_member__denied(self) -> None:
+        PartnerPerson.objects.filter(id=self.member.id).update(is_active=False)
+        request = self.get_request(
+            partner_fixtures.create_auth_token(self.member.person)
+        )
+
+        with self.assertNumQueries(0):
+            with self.assertRaises(HttpErrorException) as denied:
+                check_permissions(request, PersonType.PARTNER_MEMBER)
+        assert denied.exception.code == ErrorCodes.ACCESS_DENIED
+
+    def test_deactivated_member__revoked(self) -> None:
+        token = partner_fixtures.create_auth_token(self.member.person)
+        partner_person_service.update(
+            obj_data={"is_active": False},
+            serializer=PartnerPersonUpdateSerializer,
+            obj_id=str(self.member.id),
+        )
+
+        with self.assertRaises(HttpErrorException) as revoked:
+            check_permissions(self.get_request(token), PersonType.PARTNER_MEMBER)
+        assert revoked.exception.code == ErrorCodes.REVOKED_TOKEN
+
+        # tokens issued afterwards carry the inactive status instead
+        request = self.get_request(
+            partner_fixtures.create_auth_token(self.member.person)
+        )
+        with self.assertRaises(HttpErrorException) as denied:
+            check_permissions(request, PersonType.PARTNER_MEMBER)
+        assert denied.exception.code == ErrorCodes.ACCESS_DENIED
+
+    def test_member_permissions__no_queries(self) -> None:
+        request = self.get_request(
+            partner_fixtures.create_auth_token(self.member.person)
+        )
+
+        with self.assertNumQueries(0):
+            assert check_permissions(request, PersonType.PARTNER_MEMBER)
+            assert get_request_partner_person_id(request) == str(self.member.id)
+
+    def test_expired_token(self) -> None:
+        request = self.get_request(
+            create_access_token(self.member.person, timedelta(minutes=-1))
+        )
+
+        with self.assertRaises(HttpErrorException) as expired:
+            check_permissions(request, PersonType.PARTNER_MEMBER)
+        assert expired.exception.status_code == 401
+        assert expired.exception.code == ErrorCodes.EXPIRED_ACCESS_TOKEN
+
+    def test_refresh_login(self) -> None:
+        member = partner_fixtures.create_partner_person(
+            person=partner_fixtures.create_person_obj(password="1234"),
+            partner=self.partner,
+        )
+        client = APIClient()
+        res = client.post(
+            f"/{API_VER}/partner/login/",
+            {"phone_number": member.person.phone_number, "password": "1234"},
+            format="json",
+        )
+        refresh = res.json()["refresh"]
+
+        with self.assertRaises(HttpErrorException):
+            check_permissions(self.get_request(refresh), PersonType.PARTNER_MEMBER)
+
+        res = client.post(
+            f"/{API_VER}/partner/login/refresh/", {"refresh": refresh}, format="json"
+        )
+        assert res.status_code == 200
+        request = self.get_request(res.json()["token"])
+        assert check_permissions(request, PersonType.PARTNER_MEMBER)
+
+        partner_person_service.remove(obj_id=str(member.id))
+        res = client.post(
+            f"/{API_VER}/partner/login/refresh/", {"refresh": refresh}, format="json"
+        )
+        assert res.status_code == 401
+
+    def test_broken_token(self) -> None:
+        request = self.get_request("not-a-token")
+
+        with self.assertRaises(HttpErrorException) as broken:
+            get_request_user_id(request)
+        assert broken.exception.status_code == 403
+        assert broken.exception.code == ErrorCodes.UNPROCESSABLE_TOKEN
+
+    def test_middleware__attaches_context(self) -> None:
+        client = APIClient()
+        token = partner_fixtures.create_auth_token(self.member.person)
+        response = client.post(
+            f"/{API_VER}/partner/promo/optin/{self.partner.id}/",
+            HTTP_AUTHORIZATION=token,
+        )
+
+        assert response.wsgi_request.auth_context.token == token
+        assert response.wsgi_request.auth_context.user == self.member.person
+
+
+class PasswordHasherTestCase(TestCase):
+    def test_pool__hash_and_verify(self) -> None:
+        hasher = PasswordHasher(rounds=4, workers=1, max_queue=2)
+
+        hashed = hasher.hash("1234")
+
+        assert hashed.startswith("$2b$04$")
+        assert hasher.verify("1234", hashed)
+        assert not hasher.verify("4321", hashed)
+        stats = hasher.stats()
+        assert stats["completed"] == 3
+        assert stats["pending"] == 0
+
+    def test_pool__full_queue_refused(self) -> None:
+        hasher = PasswordHasher(rounds=4, workers=1, max_queue=1)
+        hasher._pending = 1
+
+        with self.assertRaises(HttpErrorException) as busy:
+            hasher.hash("1234")
+        assert busy.exception.status_code == 503
+        assert hasher.stats()["rejected"] == 1
+
+    def test_login__upgrades_hash(self) -> None:
+        owner = partner_fixtures.create_partner_person(person_type=PersonType.OWNER)
+        Person.objects.filter(id=owner.person_id).update(
+            hashed_password=crypt_context(4).hash("1234")
+        )
+        person = Person.objects.get(id=owner.person_id)
+
+        with mock.patch.object(password_hasher, "rounds", 5):
+            assert verify_person_password(person, "1234")
+            assert not verify_person_password(person, "4321")
+
+        person.refresh_from_db()
+        assert person.hashed_password.startswith("$2b$05$")
@@ -14,6 +14,7 @@ router.register(r"promo", viewset=views.PartnerPromotionViewset, basename="promo
 
 urlpatterns = [
     path("login/", view=views.login, name="login"),
+    path("login/refresh/", view=views.refresh_login, name="refresh-login"),
     path(
         "events/redemtion-rate/",
         view=views.partner_redemtion_rate,
@@ -22,6 +23,7 @@ urlpatterns = [
     path("sales/", view=views.partner_sales, name="sales"),
     path("revenue/", view=views.partner_sales_revenue, name="revenue"),
     path("events/ranked/", view=views.partner_ranked_events, name="ranked-events"),
+    path("dashboard/", view=views.partner_dashboard, name="dashboard"),
     path(
         "events/tickets/<str:event_id>/",
         view=views.partner_event_ticket_with_sales,
@@ -1,26 +1,32 @@
 import random
 import re
+import time
 from datetime import datetime, timedelta
 from typing import Any, Dict, Tuple, Union
 
 import phonenumbers
 from cryptography.fernet import Fernet, InvalidToken
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from jose import ExpiredSignatureError, JWTError, jwt
 from phonenumbers import NumberParseException, carrier
 from phonenumbers.phonenumberutil import number_type
 from rest_framework.request import Request
 
 from core.error_codes import ErrorCodes
 from core.exceptions import HttpErrorException
+from eticketing_api import settings
 from eticketing_api.settings import SECRET_KEY
+from partner.auth import (
+    ACCESS_TOKEN,
+    ALGORITHM,
+    REFRESH_TOKEN,
+    AuthContext,
+    get_auth_context,
+    token_revocations,
+)
 from partner.constants import PersonType
+from partner.hashing import password_hasher
 from partner.models import Partner, PartnerPerson, Person
 
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 fernet = Fernet(SECRET_KEY.encode("utf-8"))
 
 
@@ -30,11 +36,25 @@ def random_password() -> str:
 
 
 def hash_password(plaintext_password: str) -> str:
-    return pwd_context.hash(plaintext_password)
+    return password_hasher.hash(plaintext_password)
 
 
 def verify_password(plaintext: str, hashed: str) -> bool:
-    return pwd_context.verify(plaintext, hashed)
+    return password_hasher.verify(plaintext, hashed)
+
+
+def verify_person_password(person: Person, plaintext: str) -> bool:
+    """
+    Verify a person's password, rehashing it with the current cost when
+    it was hashed with a lower one
+    """
+    verified, upgraded = password_hasher.verify_and_update(
+        plaintext, person.hashed_password
+    )
+    if verified and upgraded:
+        Person.objects.filter(id=person.id).update(hashed_password=upgraded)
+        person.hashed_password = upgraded
+    return verified
 
 
 def get_membership_or_ownership(user: Person) -> Tuple[str, str]:
@@ -61,6 +81,14 @@ def create_access_token(
     partner = Partner.objects.get(id=membership[0])
     if not partner.verified:
         raise HttpErrorException(status_code=412, code=ErrorCodes.PARTNER_NOT_FOUND)
+    partner_person = (
+        PartnerPerson.objects.filter(person_id=user.id)
+        .values_list("id", "is_active")
+        .first()
+    )
+    expire = datetime.utcnow() + (
+        expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
     to_encode = {
         "phone_number": user.phone_number,
         "name": user.name,
@@ -68,13 +96,54 @@ def create_access_token(
         "user_id": str(user.id),
         "partner": membership[0],
         "membership": membership[1],
+        "partner_person": str(partner_person[0]) if partner_person else None,
+        # owners without a membership row can't be deactivated
+        "active": partner_person[1] if partner_person else True,
+        "type": ACCESS_TOKEN,
+        "iat": time.time(),
+        "exp": expire,
+        "expiry": expire.strftime("%H:%M:%S %d-%b-%Y"),
     }
-    expire = datetime.utcnow() + timedelta(minutes=1440)
-    to_encode.update({"expiry": expire.strftime("%H:%M:%S %d-%b-%Y")})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def create_refresh_token(user: Person) -> str:
+    to_encode = {
+        "user_id": str(user.id),
+        "type": REFRESH_TOKEN,
+        "iat": time.time(),
+        "exp": datetime.utcnow()
+        + timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES),
+    }
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def refresh_access_token(refresh_token: str) -> Tuple[str, str]:
+    """
+    New access and refresh tokens for a refresh token that wasn't revoked,
+    the access token's claims are read afresh from the membership
+    """
+    invalid_refresh_token_exception = HttpErrorException(
+        status_code=400, code=ErrorCodes.INVALID_REFRESH_TOKEN
+    )
+    try:
+        payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except ExpiredSignatureError:
+        raise HttpErrorException(status_code=401, code=ErrorCodes.EXPIRED_REFRESH_TOKEN)
+    except JWTError:
+        raise invalid_refresh_token_exception
+    if payload.get("type") != REFRESH_TOKEN or "user_id" not in payload:
+        raise invalid_refresh_token_exception
+    if token_revocations.is_revoked(payload["user_id"], payload.get("iat", 0)):
+        raise HttpErrorException(status_code=401, code=ErrorCodes.REVOKED_TOKEN)
+
+    user = Person.objects.filter(pk=payload["user_id"]).first()
+    if not user:
+        raise invalid_refresh_token_exception
+    return (create_access_token(user), create_refresh_token(user))
+
+
 def create_access_token_lite(
     user: Person, expires_delta: Union[timedelta, None] = None
 ) -> str:
@@ -92,77 +161,16 @@ def create_access_token_lite(
 
 
 def decode_access_token(token: str) -> Dict[str, Any]:
-    broken_token_exception = HttpErrorException(
-        status_code=403,
-        code=ErrorCodes.UNPROCESSABLE_TOKEN,
-    )
-    non_existant_membership_exception = HttpErrorException(
-        status_code=404, code=ErrorCodes.INVALID_CREDENTIALS
-    )
-    multiple_user_members_exception = HttpErrorException(
-        status_code=500, code=ErrorCodes.MULTIPLE_USERS_SAME_PHONENUMBER
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        phone_number: str = payload.get("phone_number", None)
-        if (
-            phone_number is None
-            or "user_id" not in payload
-            or "partner" not in payload
-            or "membership" not in payload
-        ):
-            raise broken_token_exception
-        try:
-            Person.objects.get(phone_number=phone_number)
-        except Person.DoesNotExist:
-            raise non_existant_membership_exception
-        except Person.MultipleObjectsReturned:
-            raise multiple_user_members_exception
-        return payload
-    except JWTError:
-        raise broken_token_exception
+    return AuthContext(token).claims
 
 
 def get_user_from_access_token(token: str) -> Person:
-    broken_token_exception = HttpErrorException(
-        status_code=404,
-        code=ErrorCodes.UNPROCESSABLE_TOKEN,
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("user_id", None)
-        if not user_id:
-            raise broken_token_exception
-        user = Person.objects.get(pk=user_id)
-        if not user:
-            raise broken_token_exception
-    except JWTError:
-        raise broken_token_exception
-    return user
+    return AuthContext(token).user
 
 
 def get_request_membership_or_ownership(request: Request) -> Tuple[str, str]:
-    non_existant_partneship_exception = HttpErrorException(
-        status_code=404, code=ErrorCodes.NO_PARTNERSHIP
-    )
-
-    from partner.permissions import get_request_user_id
-
-    user_id = get_request_user_id(request)
-
-    try:
-        partner = Partner.objects.get(owner_id=user_id)  # type: ignore
-        membership = PersonType.OWNER.value
-    except Partner.DoesNotExist:
-        try:
-            person: PartnerPerson = PartnerPerson.objects.get(
-                person=user_id  # type: ignore
-            )
-            membership = person.person_type
-            partner = person.partner
-        except PartnerPerson.DoesNotExist:
-            raise non_existant_partneship_exception
-    return (str(partner.id), membership)
+    user_data = get_auth_context(request).claims
+    return (user_data["partner"], user_data["membership"])
 
 
 def validate_phonenumber(number: str) -> bool:
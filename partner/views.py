@@ -29,8 +29,10 @@ from partner.permissions import (
     PartnerOwnerPermissions,
     check_self,
     get_request_partner_id,
+    get_request_user,
 )
 from partner.serializers import (
+    DashboardSerializer,
     PartnerBaseSerializer,
     PartnerCreateSerializer,
     PartnerPersonBaseSerializer,
@@ -54,6 +56,7 @@ from partner.serializers import (
     PersonSerializer,
     PersonUpdateSerializer,
     RedemtionRateSerializer,
+    RefreshTokenSerializer,
     RevenuesSerializer,
     SalesSerializer,
     TokenSerializer,
@@ -70,8 +73,9 @@ from partner.services import (
 from partner.utils import (
     create_access_token,
     create_access_token_lite,
-    get_user_from_access_token,
-    verify_password,
+    create_refresh_token,
+    refresh_access_token,
+    verify_person_password,
 )
 
 paginator = PageNumberPagination()
@@ -85,12 +89,11 @@ paginator.page_size = 15
 def login(request: Request) -> Response:
     token_key = settings.AUTH_HEADER
     user_group = person_service.get_user_by_phonenumber(request)
-    if verify_password(
-        str(user_group[1].data["password"]), user_group[0].hashed_password
-    ):
+    if verify_person_password(user_group[0], str(user_group[1].data["password"])):
         request.session[token_key] = create_access_token(user_group[0])
         data = {
             "token": request.session[token_key],
+            "refresh": create_refresh_token(user_group[0]),
         }
         return Response(
             data, status=status.HTTP_200_OK, content_type="application/json"
@@ -99,6 +102,18 @@ def login(request: Request) -> Response:
         raise HttpErrorException(status_code=404, code=ErrorCodes.INVALID_CREDENTIALS)
 
 
+@swagger_auto_schema(
+    method="post", request_body=RefreshTokenSerializer, responses={200: TokenSerializer}
+)
+@api_view(["POST"])
+def refresh_login(request: Request) -> Response:
+    payload = RefreshTokenSerializer(data=request.data)
+    payload.is_valid(raise_exception=True)
+    token, refresh = refresh_access_token(payload.validated_data["refresh"])
+    request.session[settings.AUTH_HEADER] = token
+    return Response(TokenSerializer({"token": token, "refresh": refresh}).data)
+
+
 @swagger_auto_schema(
     method="post",
     request_body=UserPasswordResetSerializer,
@@ -160,6 +175,15 @@ def partner_ranked_events(request: Request) -> Response:
     return Response(EventWithSales(events, many=True).data)
 
 
+@swagger_auto_schema(method="get", responses={200: DashboardSerializer})
+@api_view(["GET"])
+@permission_classes([PartnerMembershipPermissions])
+def partner_dashboard(request: Request) -> Response:
+    partner_id = get_request_partner_id(request)
+    dashboard = partner_service.get_dashboard(partner_id)
+    return Response(DashboardSerializer(dashboard).data)
+
+
 @swagger_auto_schema(method="get", responses={200: TicketTypeWithSales(many=True)})
 @api_view(["GET"])
 @permission_classes([PartnerMembershipPermissions])
@@ -175,8 +199,7 @@ def partner_event_ticket_with_sales(request: Request, event_id: str) -> Response
 @api_view(["POST"])
 @permission_classes([LoggedInPermission])
 def partner_promo_optin(request: Request, partner_id: str) -> Response:
-    token_key = settings.AUTH_HEADER
-    person_id = get_user_from_access_token(request.META[token_key]).id
+    person_id = get_request_user(request).id
     partner_service.add_promo_opt_in(partner_id, str(person_id))
     return Response({"done": True})
 
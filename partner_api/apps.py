@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class PartnerApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "partner_api"
+
+    def ready(self) -> None:
+        # drop cached partners when they or their credentials change
+        from partner_api.auth import signals  # noqa: F401
@@ -0,0 +1,63 @@
+import time
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from eticketing_api import settings
+from partner.models import Partner
+
+
+class PartnerCache:
+    """
+    Partners verified for an access key, kept in process for ``ttl``
+    seconds so polling integrators are authenticated without database
+    work. Entries are dropped when their partner or credentials change in
+    this process, other processes see the change once the entry expires.
+    """
+
+    def __init__(self, ttl: float, max_size: int) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: Dict[str, Tuple[Partner, float]] = {}
+        self._lock = Lock()
+
+    def get(self, access_key: str) -> Optional[Partner]:
+        with self._lock:
+            entry = self._entries.get(access_key)
+            if entry is None:
+                return None
+            partner, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[access_key]
+                return None
+            return partner
+
+    def set(self, access_key: str, partner: Partner) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                for key, (_, expires_at) in list(self._entries.items()):
+                    if expires_at <= now:
+                        del self._entries[key]
+            if len(self._entries) >= self.max_size:
+                # entries are kept in insertion order, drop the oldest
+                del self._entries[next(iter(self._entries))]
+            self._entries[access_key] = (partner, now + self.ttl)
+
+    def invalidate_key(self, access_key: str) -> None:
+        with self._lock:
+            self._entries.pop(access_key, None)
+
+    def invalidate_partner(self, partner_id: str) -> None:
+        with self._lock:
+            for key, (partner, _) in list(self._entries.items()):
+                if str(partner.id) == partner_id:
+                    del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+partner_cache = PartnerCache(
+    ttl=settings.PARTNER_API_CACHE_SECONDS, max_size=settings.PARTNER_API_CACHE_SIZE
+)
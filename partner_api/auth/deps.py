@@ -4,7 +4,9 @@ from jwt import DecodeError
 from core.error_codes import ErrorCodes
 from core.exceptions import HttpErrorExceptionFA as HttpErrorException
 from partner.models import Partner
+from partner_api.auth.cache import partner_cache
 from partner_api.auth.utils import decode_token
+from partner_api.models import ApiCredentials
 
 
 def current_partner(*, access_token: str = Header(...)) -> Partner:
@@ -13,8 +15,19 @@ def current_partner(*, access_token: str = Header(...)) -> Partner:
     except DecodeError:
         raise HttpErrorException(status_code=400, code=ErrorCodes.INVALID_ACCESS_TOKEN)
 
-    partner = Partner.objects.filter(id=token_details["partner_id"]).first()
-    if not partner:
-        raise HttpErrorException(status_code=400, code=ErrorCodes.PARTNER_NOT_FOUND)
+    access_key = token_details["access_key"]
+    partner = partner_cache.get(access_key)
+    if partner is None:
+        api_creds = (
+            ApiCredentials.objects.select_related("partner")
+            .filter(id=access_key)
+            .first()
+        )
+        if not api_creds:
+            raise HttpErrorException(status_code=400, code=ErrorCodes.PARTNER_NOT_FOUND)
+        partner = api_creds.partner
+        partner_cache.set(access_key, partner)
 
+    if str(partner.id) != token_details["partner_id"]:
+        raise HttpErrorException(status_code=400, code=ErrorCodes.PARTNER_NOT_FOUND)
     return partner
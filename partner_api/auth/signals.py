@@ -0,0 +1,20 @@
+from typing import Any
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from partner.models import Partner
+from partner_api.auth.cache import partner_cache
+from partner_api.models import ApiCredentials
+
+
+@receiver([post_save, post_delete], sender=Partner)
+def invalidate_partner(sender: Any, instance: Partner, **kwargs: Any) -> None:
+    partner_cache.invalidate_partner(str(instance.id))
+
+
+@receiver([post_save, post_delete], sender=ApiCredentials)
+def invalidate_credentials(
+    sender: Any, instance: ApiCredentials, **kwargs: Any
+) -> None:
+    partner_cache.invalidate_key(str(instance.id))
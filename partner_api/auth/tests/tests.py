@@ -1,12 +1,16 @@
 import hashlib
 import hmac
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from django.test import TransactionTestCase
 from fastapi.testclient import TestClient
 
+from core.exceptions import HttpErrorExceptionFA as HttpErrorException
 from eticketing_api.asgi import app
+from partner_api.auth.deps import current_partner
 from partner_api.auth.tests.fixtures import create_partner_api_credentials_obj
+from partner_api.auth.utils import create_auth_token
+from partner_api.models import ApiAuthToken
 
 API_BASE_URL = "/v1/auth"
 
@@ -57,3 +61,37 @@ class AuthTestCase(TransactionTestCase):
         assert refresh_res.status_code == 200
         assert "access_token" in refresh_res.text
         assert "refresh_token" in refresh_res.text
+
+    def test_create_auth_token__reuses_valid_token(self) -> None:
+        api_creds = create_partner_api_credentials_obj()
+
+        first = create_auth_token(api_creds=api_creds)
+        second = create_auth_token(api_creds=api_creds)
+
+        assert first == second
+        assert ApiAuthToken.objects.filter(partner=api_creds.partner).count() == 1
+
+        ApiAuthToken.objects.filter(partner=api_creds.partner).update(
+            expiry=datetime.now() + timedelta(minutes=1)
+        )
+        renewed = create_auth_token(api_creds=api_creds)
+        assert renewed["access_token"] != first["access_token"]
+        assert ApiAuthToken.objects.filter(partner=api_creds.partner).count() == 1
+
+    def test_current_partner__cached(self) -> None:
+        api_creds = create_partner_api_credentials_obj()
+        access_token = create_auth_token(api_creds=api_creds)["access_token"]
+
+        with self.assertNumQueries(1):
+            assert current_partner(access_token=access_token) == api_creds.partner
+        with self.assertNumQueries(0):
+            assert current_partner(access_token=access_token) == api_creds.partner
+
+        api_creds.partner.name = "renamed"
+        api_creds.partner.save()
+        with self.assertNumQueries(1):
+            assert current_partner(access_token=access_token).name == "renamed"
+
+        api_creds.delete()
+        with self.assertRaises(HttpErrorException):
+            current_partner(access_token=access_token)
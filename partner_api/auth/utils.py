@@ -1,12 +1,18 @@
 import hashlib
 import hmac
+from datetime import datetime, timedelta
 from typing import TypedDict
 
 import jwt
 
 from eticketing_api import settings
 from partner_api.auth.serializers import LoginCredentialsSerializer
-from partner_api.models import ApiAuthToken, ApiCredentials
+from partner_api.models import (
+    ApiAuthToken,
+    ApiCredentials,
+    default_refresh_token_expiry,
+    default_token_expiry,
+)
 
 ALGORITHM = "HS256"
 
@@ -43,11 +49,21 @@ def get_auth_signature(
 
 
 def create_auth_token(*, api_creds: ApiCredentials) -> TokenResponse:
-    token_obj = ApiAuthToken.objects.filter(partner_id=api_creds.partner.id).first()
-    if token_obj:
-        token_obj.delete()
+    """
+    Tokens of the partner's issued token while enough of it is left,
+    otherwise the issued token is renewed in place
+    """
+    reuse_until = datetime.now() + timedelta(
+        minutes=settings.PARTNER_API_TOKEN_REUSE_MINUTES
+    )
+    token_obj, created = ApiAuthToken.objects.get_or_create(
+        partner_id=api_creds.partner_id
+    )
+    if not created and token_obj.expiry < reuse_until:
+        token_obj.expiry = default_token_expiry()
+        token_obj.refresh_expiry = default_refresh_token_expiry()
+        token_obj.save(update_fields=["expiry", "refresh_expiry", "updated_at"])
 
-    token_obj = ApiAuthToken(partner=api_creds.partner)
     return {
         "access_token": create_token(api_creds=api_creds, token=token_obj),
         "refresh_token": create_token(
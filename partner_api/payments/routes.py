@@ -1,8 +1,9 @@
-from typing import Any
+from typing import Any, Optional
 
-from fastapi import Depends
+from fastapi import Depends, Header
 from fastapi.routing import APIRouter
 
+from core.idempotency import IDEMPOTENCY_HEADER, idempotent_response
 from partner.models import Partner
 from partner_api.auth.deps import current_partner
 from partner_api.payments.serializers import (
@@ -17,8 +18,19 @@ router = APIRouter()
 
 
 @router.post("/", response_model=PaymentSerializer)
-def create_payment_from_intent(*, payment_in: PaymentCreateSerializer) -> Any:
-    return payments_service.create_payment_from_intent(payment_in)
+def create_payment_from_intent(
+    *,
+    payment_in: PaymentCreateSerializer,
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER),
+) -> Any:
+    return idempotent_response(
+        "partner_api.payments.create",
+        idempotency_key,
+        payment_in,
+        lambda: PaymentSerializer.from_orm(
+            payments_service.create_payment_from_intent(payment_in)
+        ),
+    )
 
 
 @router.get("/intent/{intent_id}/", response_model=PaymentIntentSerializer)
@@ -1,3 +1,4 @@
+import uuid
 from typing import Any
 from unittest import mock
 from unittest.mock import Mock
@@ -5,6 +6,8 @@ from unittest.mock import Mock
 from django.test import TransactionTestCase
 from fastapi.testclient import TestClient
 
+from core.idempotency import IDEMPOTENCY_HEADER, REPLAYED_HEADER
+from core.outbox import relay_outbox
 from eticketing_api import settings
 from eticketing_api.asgi import app
 from events.fixtures.event_fixtures import create_event_object, create_ticket_type_obj
@@ -12,7 +15,7 @@ from partner.fixtures.partner_fixtures import create_partner_obj, person_fixture
 from partner_api.auth.tests.fixtures import create_partner_api_credentials_obj
 from partner_api.auth.utils import create_auth_token
 from payments.constants import PaymentProviders
-from payments.intergrations.ipay import iPayMPesa
+from payments.models import Payment
 
 API_BASE_URL = "/v1/payments"
 
@@ -55,9 +58,9 @@ class PaymentTestCase(TransactionTestCase):
             assert (tt["id"], tt["amount"]) in returned_tts
 
     @mock.patch("notifications.tasks.send_email.apply_async")
-    @mock.patch.object(iPayMPesa, "c2b_receive")
+    @mock.patch("payments.services.initiate_payment.apply_async")
     def test_create_payment__from_intent(
-        self, mock_c2b_recieve: Mock, *args: Any
+        self, mock_initiate_payment: Mock, *args: Any
     ) -> None:
         event = create_event_object(owner=self.partner.owner)
         ticket_types = [
@@ -86,12 +89,13 @@ class PaymentTestCase(TransactionTestCase):
 
         res = self.fa_client.post(f"{API_BASE_URL}/", json=payment_data)
         assert res.status_code == 200
-        mock_c2b_recieve.assert_called()
+        relay_outbox()
+        mock_initiate_payment.assert_called()
 
     @mock.patch("notifications.tasks.send_email.apply_async")
-    @mock.patch.object(iPayMPesa, "c2b_receive")
+    @mock.patch("payments.services.initiate_payment.apply_async")
     def test_create_payment__from_intent__with_new_person_details(
-        self, mock_c2b_recieve: Mock, *args: Any
+        self, mock_initiate_payment: Mock, *args: Any
     ) -> None:
         event = create_event_object(owner=self.partner.owner)
         ticket_types = [
@@ -123,7 +127,43 @@ class PaymentTestCase(TransactionTestCase):
         res = self.fa_client.post(f"{API_BASE_URL}/", json=payment_data)
         assert res.status_code == 200
         assert res.json()["person"]["phone_number"] == new_person_data["phone_number"]
-        mock_c2b_recieve.assert_called()
+        relay_outbox()
+        mock_initiate_payment.assert_called()
+
+    @mock.patch("notifications.tasks.send_email.apply_async")
+    @mock.patch("payments.services.initiate_payment.apply_async")
+    def test_create_payment__from_intent__idempotent(
+        self, mock_initiate_payment: Mock, *args: Any
+    ) -> None:
+        event = create_event_object(owner=self.partner.owner)
+        ticket_type = create_ticket_type_obj(event=event)
+        intent = {
+            "person": person_fixture(),
+            "ticket_types": [{"id": str(ticket_type.id), "amount": 1}],
+            "callback_url": "http://127.0.0.1:8000/payments",
+        }
+        intent_res = self.fa_client.post(f"{API_BASE_URL}/intent/", json=intent)
+        payment_data = {
+            "intent_id": intent_res.json()["id"],
+            "made_through": PaymentProviders.MPESA.value,
+        }
+        headers = {IDEMPOTENCY_HEADER: str(uuid.uuid4())}
+
+        res = self.fa_client.post(
+            f"{API_BASE_URL}/", json=payment_data, headers=headers
+        )
+        replay = self.fa_client.post(
+            f"{API_BASE_URL}/", json=payment_data, headers=headers
+        )
+
+        assert res.status_code == 200
+        assert replay.json() == res.json()
+        assert replay.headers[REPLAYED_HEADER] == "true"
+        assert (
+            Payment.objects.filter(person__email=intent["person"]["email"]).count() == 1
+        )
+        relay_outbox()
+        mock_initiate_payment.assert_called_once()
 
     def test_read_intent(self) -> None:
         event = create_event_object(owner=self.partner.owner)
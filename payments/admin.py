@@ -1,6 +1,14 @@
 from django.contrib import admin
 
-from .models import B2BTransactionLogs, Payment, PaymentMethod, PaymentTransactionLogs
+from .models import (
+    B2BTransactionLogs,
+    Payment,
+    PaymentMethod,
+    PaymentStateTransition,
+    PaymentTransactionLogs,
+    Payout,
+    PayoutBatch,
+)
 
 
 class PaymentAdminConfig(admin.ModelAdmin):
@@ -20,6 +28,7 @@ class PaymentAdminConfig(admin.ModelAdmin):
         "made_through",
         "transaction_id",
     ]
+    list_filter = ("state", "refund_due")
 
 
 class PaymentMethodAdminConfig(admin.ModelAdmin):
@@ -45,7 +54,27 @@ class PaymentLogsAdminConfig(admin.ModelAdmin):
     list_filter = ("state",)
 
 
+class PaymentStateTransitionAdminConfig(admin.ModelAdmin):
+    search_fields = ["payment__number", "payment__person__phone_number"]
+    list_filter = ("to_state", "source")
+    readonly_fields = ["payment", "from_state", "to_state", "source"]
+
+
+class PayoutBatchAdminConfig(admin.ModelAdmin):
+    list_display = ("run", "made_through", "completed_at")
+    readonly_fields = ["run", "made_through", "completed_at"]
+
+
+class PayoutAdminConfig(admin.ModelAdmin):
+    search_fields = ["partner__name", "partner__owner__phone_number"]
+    list_filter = ("state", "batch")
+    readonly_fields = ["batch", "partner", "amount", "attempts", "sent_at"]
+
+
 admin.site.register(Payment, PaymentAdminConfig)
 admin.site.register(PaymentMethod, PaymentMethodAdminConfig)
 admin.site.register(PaymentTransactionLogs, PaymentLogsAdminConfig)
+admin.site.register(PaymentStateTransition, PaymentStateTransitionAdminConfig)
 admin.site.register(B2BTransactionLogs, B2BLogsAdminConfig)
+admin.site.register(PayoutBatch, PayoutBatchAdminConfig)
+admin.site.register(Payout, PayoutAdminConfig)
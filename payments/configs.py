@@ -1,14 +1,44 @@
-from typing import Dict
-
+from core.redis import redis_client
+from eticketing_api import settings
 from payments.constants import PaymentProviders
-from payments.interfaces import PaymentProviderType
-from payments.intergrations.ipay import iPayCard, iPayMPesa
+from payments.intergrations.ipay import ipay_client, iPayCard, iPayMPesa
+from payments.routing import ProcessorRegistry, ProviderHealth, Route
 
 active_payment_processor_mpesa = iPayMPesa()
 active_payment_processor_card = iPayCard()
-payment_processor_map: Dict[str, PaymentProviderType] = {
-    PaymentProviders.MPESA.value: active_payment_processor_mpesa,
-    PaymentProviders.BANK.value: active_payment_processor_card,
-}
+
+# processors are tried in the order they are registered for a method, an
+# alternative aggregator for a method is registered after the preferred one.
+# iPay is the only aggregator so far, a method whose route is unhealthy is
+# refused, apart from the odd probe checkout, until it recovers
+payment_processor_registry = ProcessorRegistry(
+    ProviderHealth(
+        redis_client,
+        settings.PAYMENT_HEALTH_KEY,
+        window=settings.PAYMENT_HEALTH_WINDOW_SECONDS,
+    ),
+    max_error_rate=settings.PAYMENT_ROUTE_MAX_ERROR_RATE,
+    max_p95_ms=settings.PAYMENT_ROUTE_MAX_P95_MS,
+    min_calls=settings.PAYMENT_ROUTE_MIN_CALLS,
+    probe_interval=settings.PAYMENT_ROUTE_PROBE_SECONDS,
+)
+payment_processor_registry.register(
+    Route(
+        name="ipay_mpesa",
+        method=PaymentProviders.MPESA.value,
+        processor=active_payment_processor_mpesa,
+        client=ipay_client,
+        endpoints=("initiate", "mpesa_push"),
+    )
+)
+payment_processor_registry.register(
+    Route(
+        name="ipay_card",
+        method=PaymentProviders.BANK.value,
+        processor=active_payment_processor_card,
+        client=ipay_client,
+        endpoints=("initiate",),
+    )
+)
 
 callback_url = "/payments/callback/"
@@ -3,10 +3,22 @@ from typing import List, Tuple
 
 
 class PaymentStates(Enum):
+    INITIATING = "INITIATING"
     PENDING = "PENDING"
     PAID = "PAID"
     UNDERPAID = "UNDERPAID"
     OVERPAID = "OVERPAID"
+    FAILED = "FAILED"
+    VOIDED = "VOIDED"
+
+
+class PayoutStates(Enum):
+    PENDING = "PENDING"
+    # handed to the provider, a payout left here has an unknown outcome and
+    # is never resent automatically
+    SENDING = "SENDING"
+    SENT = "SENT"
+    FAILED = "FAILED"
 
 
 class PaymentProviders(Enum):
@@ -24,4 +36,74 @@ class PaymentTransactionState(Enum):
     SUCCEEDED = "SUCCEEDED"
 
 
+class iPayCallbackStatus(Enum):
+    SUCCESS = "aei7p7yrx4ae34"
+    PENDING = "bdi6p2yy76etrs"
+    FAILED = "fe2707etr5s4wq"
+    USED = "cr5i3pgy9867e1"
+    LESS = "dtfi4p7yty45wq"
+    MORE = "eq3i7p5yt7645e"
+
+
 CONFIRMED_PAYMENT_STATES = [PaymentStates.PAID.value, PaymentStates.OVERPAID.value]
+# states in which the provider has taken the buyer's money
+FUNDED_PAYMENT_STATES = CONFIRMED_PAYMENT_STATES + [PaymentStates.UNDERPAID.value]
+# states of payments still holding inventory without having paid for it
+STALE_PAYMENT_STATES = [
+    PaymentStates.INITIATING.value,
+    PaymentStates.PENDING.value,
+    PaymentStates.FAILED.value,
+]
+
+# payment state each final iPay callback status moves a payment to
+IPAY_CALLBACK_STATES = {
+    iPayCallbackStatus.SUCCESS.value: PaymentStates.PAID.value,
+    iPayCallbackStatus.LESS.value: PaymentStates.UNDERPAID.value,
+    iPayCallbackStatus.MORE.value: PaymentStates.OVERPAID.value,
+    iPayCallbackStatus.FAILED.value: PaymentStates.FAILED.value,
+    iPayCallbackStatus.USED.value: PaymentStates.FAILED.value,
+}
+
+# states a payment may move to from each state, anything else is ignored
+PAYMENT_STATE_TRANSITIONS = {
+    PaymentStates.INITIATING.value: [
+        PaymentStates.PENDING.value,
+        PaymentStates.PAID.value,
+        PaymentStates.UNDERPAID.value,
+        PaymentStates.OVERPAID.value,
+        PaymentStates.FAILED.value,
+        PaymentStates.VOIDED.value,
+    ],
+    PaymentStates.PENDING.value: [
+        PaymentStates.INITIATING.value,
+        PaymentStates.PAID.value,
+        PaymentStates.UNDERPAID.value,
+        PaymentStates.OVERPAID.value,
+        PaymentStates.FAILED.value,
+        PaymentStates.VOIDED.value,
+    ],
+    PaymentStates.FAILED.value: [
+        PaymentStates.PENDING.value,
+        PaymentStates.PAID.value,
+        PaymentStates.UNDERPAID.value,
+        PaymentStates.OVERPAID.value,
+        PaymentStates.VOIDED.value,
+    ],
+    PaymentStates.UNDERPAID.value: [
+        PaymentStates.PAID.value,
+        PaymentStates.OVERPAID.value,
+        PaymentStates.VOIDED.value,
+    ],
+    PaymentStates.PAID.value: [],
+    PaymentStates.OVERPAID.value: [],
+    # paid after the sweeper gave up on it, its tickets are reinstated
+    # while they are still in stock
+    PaymentStates.VOIDED.value: [
+        PaymentStates.PAID.value,
+        PaymentStates.OVERPAID.value,
+    ],
+}
+
+# payout states a payout run picks up, a payout is only resent after the
+# provider declined it
+RESENDABLE_PAYOUT_STATES = [PayoutStates.PENDING.value, PayoutStates.FAILED.value]
@@ -0,0 +1,137 @@
+import hashlib
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from core.utils import random_string
+
+
+class iPayStubServer:
+    """
+    Local stand in for the iPay API, signs its responses with ``signing_key``
+    and answers the first ``fail_next`` requests with ``fail_status``.
+
+        with iPayStubServer(signing_key) as stub:
+            client = ProviderClient(base_url=stub.url, ...)
+    """
+
+    def __init__(
+        self,
+        signing_key: str,
+        push_status: int = 1,
+        search_status: str = "",
+        transfer_status: int = 1,
+    ) -> None:
+        self.signing_key = signing_key.encode()
+        self.push_status = push_status
+        self.search_status = search_status
+        self.transfer_status = transfer_status
+        self.fail_next = 0
+        self.fail_status = 503
+        self.requests: List[Dict[str, Any]] = []
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        assert self._server, "stub server isn't running"
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _sign(self, value: str) -> str:
+        return hmac.new(self.signing_key, value.encode(), hashlib.sha256).hexdigest()
+
+    def initiate_response(self, form: Dict[str, str]) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "account": form.get("oid", ""),
+            "amount": form.get("amount", ""),
+            "oid": form.get("oid", ""),
+            "sid": random_string(12),
+            "payment_channels": [
+                {"name": "MPESA", "paybill": "510800"},
+                {"name": "AIRTEL", "paybill": "510800"},
+            ],
+        }
+        data["hash"] = self._sign(
+            "{}{}{}{}{}{}{}{}".format(
+                data["account"],
+                data["amount"],
+                data["oid"],
+                data["sid"],
+                data["payment_channels"][0]["name"],
+                data["payment_channels"][0]["paybill"],
+                data["payment_channels"][1]["name"],
+                data["payment_channels"][1]["paybill"],
+            )
+        )
+        return {"status": 1, "data": data}
+
+    def push_response(self, form: Dict[str, str]) -> Dict[str, Any]:
+        return {"status": self.push_status, "text": "stk push sent"}
+
+    def search_response(self, form: Dict[str, str]) -> Dict[str, Any]:
+        if not self.search_status:
+            return {"status": 0, "text": "transaction not found"}
+        return {
+            "status": 1,
+            "data": {"oid": form.get("oid"), "status": self.search_status},
+        }
+
+    def transfer_response(self, form: Dict[str, str]) -> Dict[str, Any]:
+        return {"status": self.transfer_status, "text": form.get("reference")}
+
+    def _handler(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                body = parse_qs(self.rfile.read(length).decode())
+                form = {key: values[0] for key, values in body.items()}
+                stub.requests.append({"path": self.path, "form": form})
+
+                if stub.fail_next > 0:
+                    stub.fail_next -= 1
+                    self._respond(stub.fail_status, {"error": "stub failure"})
+                elif self.path.startswith("/b2b/"):
+                    self._respond(200, stub.transfer_response(form))
+                elif self.path.endswith("/transaction/search"):
+                    self._respond(200, stub.search_response(form))
+                elif self.path.endswith("/push/mpesa"):
+                    self._respond(200, stub.push_response(form))
+                elif self.path.endswith("/transact"):
+                    self._respond(200, stub.initiate_response(form))
+                else:
+                    self._respond(404, {"error": "not found"})
+
+            def _respond(self, status: int, payload: Dict[str, Any]) -> None:
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        return Handler
+
+    def start(self) -> "iPayStubServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "iPayStubServer":
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
@@ -3,7 +3,8 @@ from typing import Any, Dict, List, Optional
 from events.tests import event_fixtures
 from partner.fixtures import partner_fixtures
 from partner.models import Person
-from payments.constants import PaymentProviders
+from payments.configs import active_payment_processor_mpesa
+from payments.constants import PaymentProviders, iPayCallbackStatus
 from payments.models import Payment, PaymentMethod
 
 
@@ -63,3 +64,20 @@ def create_payment_method_obj(
     name: str = PaymentProviders.MPESA.value, poster: Optional[str] = None
 ) -> PaymentMethod:
     return PaymentMethod.objects.create(name=name, poster=poster)
+
+
+def payment_callback_fixture(
+    payment: Payment,
+    status: iPayCallbackStatus = iPayCallbackStatus.SUCCESS,
+    transaction_id: Optional[str] = None,
+) -> Dict[str, str]:
+    data = {
+        "id": payment.number,
+        "ivm": str(payment.id),
+        "status": status.value,
+        "txncd": transaction_id or f"TXN{payment.number}",
+        "mc": f"{payment.amount}",
+        "msisdn_id": payment.person.name,
+    }
+    data["hsh"] = active_payment_processor_mpesa.get_callback_hash(data)
+    return data
@@ -22,9 +22,12 @@ class PaymentProviderType(ABC):
     def b2c_send(self, *, amount: int, partner: Partner) -> PaymentStates:
         pass
 
-    # partner disbursment
+    # partner disbursment, ``reference`` identifies the transfer to the
+    # provider. Raises requests errors when the outcome isn't known
     @abstractmethod
-    def b2b_send(self, *, amount: int, partner: Partner) -> PaymentStates:
+    def b2b_send(
+        self, *, amount: float, partner: Partner, reference: str
+    ) -> PaymentStates:
         pass
 
     # partner purchase/ wallet funding
@@ -35,3 +38,7 @@ class PaymentProviderType(ABC):
     @abstractmethod
     def search(self, *, transaction_id: str) -> Optional[Payment]:
         pass
+
+    def get_transaction_state(self, *, payment: Payment) -> Optional[str]:
+        # providers that can't be queried leave the payment to its callback
+        return None
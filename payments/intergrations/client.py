@@ -0,0 +1,247 @@
+import random
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Upper bounds, in milliseconds, of the latency histogram buckets
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+RETRYABLE_STATUS_CODES = (502, 503, 504)
+
+# called with the endpoint, duration in milliseconds and error of each call
+Observer = Callable[[str, float, Optional[str]], None]
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of calling a provider that has been failing
+    """
+
+
+class Endpoint(NamedTuple):
+    path: str
+    timeout: Tuple[float, float]
+    # overrides the client's retries, 0 for calls that move money since a
+    # gateway error doesn't tell whether the provider acted on them
+    retries: Optional[int] = None
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: Tuple[int, ...] = LATENCY_BUCKETS_MS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.errors: Dict[str, int] = {}
+        self.total = 0
+        self.sum_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, duration_ms: float, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.counts[bisect_left(self.buckets, duration_ms)] += 1
+            self.total += 1
+            self.sum_ms += duration_ms
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            labels = [f"le_{bucket}" for bucket in self.buckets] + ["le_inf"]
+            return {
+                "count": self.total,
+                "sum_ms": round(self.sum_ms, 3),
+                "buckets": dict(zip(labels, self.counts)),
+                "errors": dict(self.errors),
+            }
+
+
+class RateLimiter:
+    """
+    Token bucket allowing ``rate`` calls a second with bursts of up to
+    ``burst`` calls, shared by the threads of a process
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures and fails calls
+    fast for ``reset_timeout`` seconds, then lets a single trial call
+    through to decide whether to close again
+    """
+
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = self.CLOSED
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if (
+                self._state == self.OPEN
+                and time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError("provider circuit is open")
+            # let one trial call through per reset_timeout
+            self._state = self.HALF_OPEN
+            self.opened_at = time.monotonic()
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._state = self.CLOSED
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class ProviderClient:
+    """
+    Keep-alive HTTP client shared by the calls made to a payment provider.
+
+    Only connection errors and gateway errors are retried, a read timeout
+    might mean the provider acted on the request so a payment prompt is
+    never resent because a response was slow. Endpoints given their own
+    circuit in ``breakers`` don't trip the others, the rest share
+    ``breaker``.
+    """
+
+    def __init__(
+        self,
+        *,
+        name: str,
+        base_url: str,
+        endpoints: Dict[str, Endpoint],
+        retries: int = 2,
+        backoff: float = 0.2,
+        max_backoff: float = 2.0,
+        pool_size: int = 10,
+        breaker: Optional[CircuitBreaker] = None,
+        breakers: Optional[Dict[str, CircuitBreaker]] = None,
+        rate_limits: Optional[Dict[str, RateLimiter]] = None,
+    ) -> None:
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.endpoints = endpoints
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.breakers = breakers or {}
+        self.rate_limits = rate_limits or {}
+        self.observers: List[Observer] = []
+        self.metrics = {endpoint: LatencyHistogram() for endpoint in endpoints}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def breaker_for(self, endpoint_name: str) -> CircuitBreaker:
+        return self.breakers.get(endpoint_name, self.breaker)
+
+    def _sleep_before_retry(self, attempt: int) -> None:
+        # full jitter keeps workers that failed together from retrying together
+        cap = min(self.max_backoff, self.backoff * 2**attempt)
+        time.sleep(random.uniform(0, cap))
+
+    def _observe(
+        self, endpoint_name: str, started: float, error: Optional[str] = None
+    ) -> None:
+        duration_ms = (time.monotonic() - started) * 1000
+        self.metrics[endpoint_name].observe(duration_ms, error)
+        for observer in self.observers:
+            try:
+                observer(endpoint_name, duration_ms, error)
+            except Exception:
+                # metrics never fail a provider call
+                pass
+
+    def post(self, endpoint_name: str, **kwargs: Any) -> requests.Response:
+        endpoint = self.endpoints[endpoint_name]
+        retries = self.retries if endpoint.retries is None else endpoint.retries
+        rate_limit = self.rate_limits.get(endpoint_name)
+        url = f"{self.base_url}{endpoint.path}"
+        breaker = self.breaker_for(endpoint_name)
+        breaker.before_call()
+
+        attempt = 0
+        while True:
+            if rate_limit:
+                rate_limit.acquire()
+            started = time.monotonic()
+            try:
+                res = self.session.post(url, timeout=endpoint.timeout, **kwargs)
+            except requests.RequestException as exc:
+                self._observe(endpoint_name, started, type(exc).__name__)
+                # the provider never saw requests that failed to connect,
+                # it might have acted on those that timed out reading
+                if isinstance(exc, requests.ConnectionError) and attempt < retries:
+                    self._sleep_before_retry(attempt)
+                    attempt += 1
+                    continue
+                breaker.record_failure()
+                raise
+
+            error = f"HTTP_{res.status_code}" if res.status_code >= 500 else None
+            self._observe(endpoint_name, started, error)
+            if res.status_code in RETRYABLE_STATUS_CODES and attempt < retries:
+                self._sleep_before_retry(attempt)
+                attempt += 1
+                continue
+            if error:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            return res
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "provider": self.name,
+            "circuit": self.breaker.state,
+            "endpoints": {
+                name: {**histogram.snapshot(), "circuit": self.breaker_for(name).state}
+                for name, histogram in self.metrics.items()
+            },
+        }
@@ -1,19 +1,77 @@
 import hashlib
 import hmac
 import os
-from typing import Optional
+from typing import Dict, Optional
 
 import requests
 
+from eticketing_api import settings
 from partner.models import Partner
-from payments.constants import PaymentProviders, PaymentStates, PaymentTransactionState
+from payments.constants import (
+    IPAY_CALLBACK_STATES,
+    PaymentProviders,
+    PaymentStates,
+    PaymentTransactionState,
+)
 from payments.interfaces import PaymentProviderType
+from payments.intergrations.client import (
+    CircuitBreaker,
+    Endpoint,
+    ProviderClient,
+    RateLimiter,
+)
 from payments.models import Payment, PaymentTransactionLogs
 from payments.serilaizers import PaymentUpdateSerializer
 
+# callback fields covered by the signature in the callback's ``hsh`` field
+CALLBACK_HASH_FIELDS = ("id", "ivm", "status", "txncd", "mc")
+
+payout_breaker = CircuitBreaker(
+    failure_threshold=settings.PAYMENT_CIRCUIT_FAILURES,
+    reset_timeout=settings.PAYMENT_CIRCUIT_RESET_SECONDS,
+)
+ipay_client = ProviderClient(
+    name="ipay",
+    base_url=settings.IPAY_BASE_URL,
+    endpoints={
+        "initiate": Endpoint(
+            "/payments/v2/transact", settings.PAYMENT_PROVIDER_TIMEOUT
+        ),
+        "mpesa_push": Endpoint(
+            "/payments/v2/transact/push/mpesa", settings.PAYMENT_PUSH_TIMEOUT
+        ),
+        "search": Endpoint(
+            "/payments/v2/transaction/search", settings.PAYMENT_PROVIDER_TIMEOUT
+        ),
+        "b2b_mpesa": Endpoint(
+            "/b2b/v1/external/mpesa", settings.PAYMENT_PROVIDER_TIMEOUT, retries=0
+        ),
+        "b2b_bank": Endpoint(
+            "/b2b/v1/external/bank", settings.PAYMENT_PROVIDER_TIMEOUT, retries=0
+        ),
+    },
+    retries=settings.PAYMENT_PROVIDER_RETRIES,
+    breaker=CircuitBreaker(
+        failure_threshold=settings.PAYMENT_CIRCUIT_FAILURES,
+        reset_timeout=settings.PAYMENT_CIRCUIT_RESET_SECONDS,
+    ),
+    # a failing payout run doesn't close checkouts, nor do checkouts payouts
+    breakers={endpoint: payout_breaker for endpoint in ("b2b_mpesa", "b2b_bank")},
+    rate_limits={
+        endpoint: RateLimiter(
+            settings.PAYOUT_RATE_PER_SECOND, burst=settings.PAYOUT_RATE_BURST
+        )
+        for endpoint in ("b2b_mpesa", "b2b_bank")
+    },
+)
+
 
 class SharedMethods:
-    INITIATOR_URL = "https://apis.ipayafrica.com/payments/v2/transact"
+    def __init__(
+        self, client: ProviderClient = ipay_client, signing_key: Optional[str] = None
+    ) -> None:
+        self.client = client
+        self.signing_key = (signing_key or settings.IPAY_PROVIDER_KEY).encode()
 
     def get_dict_hash(self, dict_: dict) -> str:
         value_string = ""
@@ -26,7 +84,7 @@ class SharedMethods:
                 value_string += value
 
         hash_obj = hmac.new(
-            key=os.environ["iPAY_PROVIDER_KEY"].encode(),
+            key=self.signing_key,
             msg=value_string.encode(),
             digestmod=hashlib.sha256,
         )
@@ -34,7 +92,7 @@ class SharedMethods:
 
     def get_string_hash(self, string: str) -> str:
         hash_obj = hmac.new(
-            key=os.environ["iPAY_PROVIDER_KEY"].encode(),
+            key=self.signing_key,
             msg=string.encode(),
             digestmod=hashlib.sha256,
         )
@@ -80,6 +138,48 @@ class SharedMethods:
             values_string
         )
 
+    def get_callback_hash(self, data: Dict[str, str]) -> str:
+        return self.get_string_hash(
+            "".join(str(data.get(field, "")) for field in CALLBACK_HASH_FIELDS)
+        )
+
+    def validate_callback(self, data: Dict[str, str]) -> bool:
+        return hmac.compare_digest(
+            str(data.get("hsh", "")), self.get_callback_hash(data)
+        )
+
+    def get_transaction_state(self, *, payment: Payment) -> Optional[str]:
+        """
+        Ask the provider how the payment ended, None when it can't tell
+        """
+        payload = {"oid": payment.number, "vid": os.environ["iPAY_PROVIDER_ID"]}
+        payload["hash"] = self.get_dict_hash(payload)
+        try:
+            res = self.client.post("search", data=payload)
+            if res.status_code >= 300:
+                return None
+            return IPAY_CALLBACK_STATES.get(res.json()["data"]["status"])
+        except (requests.RequestException, KeyError, TypeError, ValueError):
+            return None
+
+    def send_transfer(self, endpoint: str, payload: Dict[str, str]) -> PaymentStates:
+        """
+        Send a disbursement, a server error leaves the outcome unknown so
+        it is raised rather than reported as failed
+        """
+        payload["vid"] = os.environ["iPAY_PROVIDER_ID"]
+        payload["hash"] = self.get_dict_hash(payload)
+        res = self.client.post(endpoint, data=payload)
+        if res.status_code >= 500:
+            res.raise_for_status()
+        if res.status_code >= 300:
+            return PaymentStates.FAILED
+        try:
+            sent = int(res.json()["status"]) == 1
+        except (KeyError, TypeError, ValueError):
+            raise requests.HTTPError("unreadable transfer response", response=res)
+        return PaymentStates.PAID if sent else PaymentStates.FAILED
+
     def get_resp_sid(self, resp_data: dict) -> str:
         return resp_data["data"]["sid"]
 
@@ -95,7 +195,7 @@ class SharedMethods:
 
     def initiate_transaction(self, payment: Payment) -> Optional[str]:
         payload = self.construct_initiator_payload(payment=payment)
-        res = requests.post(self.INITIATOR_URL, data=payload)
+        res = self.client.post("initiate", data=payload)
         if res.status_code >= 300:
             PaymentTransactionLogs(payment=payment, message=str(res.json())).save()
             return None
@@ -109,8 +209,6 @@ class SharedMethods:
 
 
 class iPayMPesa(SharedMethods, PaymentProviderType):
-    MOBILE_MONEY_URL = "https://apis.ipayafrica.com/payments/v2/transact/push/mpesa"
-
     def create_payment_payload(self, transation_id: str, phone: str) -> dict:
         payload = {
             "phone": phone,
@@ -128,6 +226,7 @@ class iPayMPesa(SharedMethods, PaymentProviderType):
                 obj_data={"state": PaymentStates.PAID.value},
                 serializer=PaymentUpdateSerializer,
                 obj_id=str(payment.id),
+                source="provider",
             )
             return
 
@@ -135,7 +234,7 @@ class iPayMPesa(SharedMethods, PaymentProviderType):
             payload = self.create_payment_payload(
                 transation_id=transaction_id, phone=payment.person.phone_number
             )
-            res = requests.post(self.MOBILE_MONEY_URL, data=payload)
+            res = self.client.post("mpesa_push", data=payload)
 
             if int(res.json()["status"]):
                 payment_state = (
@@ -147,6 +246,7 @@ class iPayMPesa(SharedMethods, PaymentProviderType):
                     obj_data={"state": payment_state},
                     serializer=PaymentUpdateSerializer,
                     obj_id=str(payment.id),
+                    source="provider",
                 )
                 PaymentTransactionLogs.objects.create(
                     payment=payment,
@@ -158,6 +258,7 @@ class iPayMPesa(SharedMethods, PaymentProviderType):
                     obj_data={"state": PaymentStates.PENDING.value},
                     serializer=PaymentUpdateSerializer,
                     obj_id=str(payment.id),
+                    source="provider",
                 )
                 PaymentTransactionLogs.objects.create(
                     payment=payment, message=str(res.json())
@@ -170,8 +271,18 @@ class iPayMPesa(SharedMethods, PaymentProviderType):
         pass
 
     # partner disbursment
-    def b2b_send(self, *, amount: int, partner: Partner) -> PaymentStates:
-        pass
+    def b2b_send(
+        self, *, amount: float, partner: Partner, reference: str
+    ) -> PaymentStates:
+        return self.send_transfer(
+            "b2b_mpesa",
+            {
+                "reference": reference,
+                "phone": partner.owner.phone_number,
+                "amount": f"{amount:.2f}",
+                "narration": f"{partner.name} payout",
+            },
+        )
 
     def b2b_recieve(self, *, amount: float, partner: Partner) -> PaymentStates:
         payment: Payment = self.create_partner_owner_payment(
@@ -189,15 +300,32 @@ class iPayCard(SharedMethods, PaymentProviderType):
         return True
 
     def c2b_receive(self, *, payment: Payment) -> None:
-        payment.state = PaymentStates.PAID.value
-        payment.save()
+        from payments.services import payment_service
+
+        payment_service.transition(
+            str(payment.id), PaymentStates.PAID.value, source="provider"
+        )
+        payment.refresh_from_db(fields=["state", "verified"])
 
     def b2c_send(self, *, amount: int, partner: Partner) -> PaymentStates:
         pass
 
     # partner disbursment
-    def b2b_send(self, *, amount: int, partner: Partner) -> PaymentStates:
-        pass
+    def b2b_send(
+        self, *, amount: float, partner: Partner, reference: str
+    ) -> PaymentStates:
+        if not (partner.bank_code and partner.bank_account_number):
+            return PaymentStates.FAILED
+        return self.send_transfer(
+            "b2b_bank",
+            {
+                "reference": reference,
+                "bank_code": partner.bank_code,
+                "account": partner.bank_account_number,
+                "amount": f"{amount:.2f}",
+                "narration": f"{partner.name} payout",
+            },
+        )
 
     def b2b_recieve(self, *, amount: float, partner: Partner) -> PaymentStates:
         pass
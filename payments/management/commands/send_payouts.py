@@ -0,0 +1,30 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from partner.models import ReconciliationRun
+from payments.payouts import payout_runner
+
+
+class Command(BaseCommand):
+    help = "Pay partners the balances of a completed reconciliation run"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--run",
+            help="reconciliation run to pay out, the latest completed run by default",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        runs = ReconciliationRun.objects.filter(completed_at__isnull=False)
+        if options["run"]:
+            runs = runs.filter(id=options["run"])
+        run = runs.order_by("-completed_at").first()
+        if run is None:
+            raise CommandError("No completed reconciliation run to pay out")
+
+        batch = payout_runner.create_batch(str(run.id))
+        outcomes = payout_runner.run(str(batch.id))
+        for state, count in sorted(outcomes.items()):
+            self.stdout.write(f"{state}: {count}")
+        self.stdout.write(self.style.SUCCESS(f"Ran payouts of {run}"))
@@ -0,0 +1,46 @@
+from datetime import timedelta
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from eticketing_api import settings
+from events.models import Event
+from payments.services import payment_service
+
+
+class Command(BaseCommand):
+    help = "Void expired unpaid payments and put their tickets back on sale"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--minutes",
+            type=int,
+            default=settings.PAYMENT_PENDING_EXPIRY_MINUTES,
+            help="void payments left unpaid for longer than this",
+        )
+        parser.add_argument(
+            "--check-provider",
+            action="store_true",
+            default=settings.PAYMENT_SWEEP_CHECK_PROVIDER,
+            help="ask the provider for each payment's state before voiding it",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        report = payment_service.sweep_expired(
+            expiry=timedelta(minutes=options["minutes"]),
+            check_provider=options["check_provider"],
+        )
+        events = {
+            str(event_id): name
+            for event_id, name in Event.objects.filter(
+                id__in=report["reclaimed"].keys()
+            ).values_list("id", "name")
+        }
+        for event_id, tickets in report["reclaimed"].items():
+            self.stdout.write(f"{events.get(event_id, event_id)}: {tickets} tickets")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Voided {report['voided']} payments,"
+                f" confirmed {report['confirmed']} with the provider"
+            )
+        )
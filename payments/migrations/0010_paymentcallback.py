@@ -0,0 +1,45 @@
+# Generated by Django 4.1.7 on 2026-10-19 18:01
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0009_b2btransactionlogs"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentCallback",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateField(auto_now=True)),
+                ("transaction_id", models.CharField(max_length=256, unique=True)),
+                ("payment_number", models.CharField(max_length=255)),
+                ("status", models.CharField(max_length=255)),
+                ("amount", models.FloatField(blank=True, null=True)),
+                ("payload", models.JSONField(default=dict)),
+                ("processed", models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="paymentcallback",
+            index=models.Index(
+                condition=models.Q(("processed", False)),
+                fields=["created_at"],
+                name="payment_callback_unprocessed",
+            ),
+        ),
+    ]
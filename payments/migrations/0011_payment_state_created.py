@@ -0,0 +1,22 @@
+# Generated by Django 4.1.7 on 2026-10-19 18:04
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the payments table stays writable while the index builds
+    atomic = False
+
+    dependencies = [
+        ("payments", "0010_paymentcallback"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="payment",
+            index=models.Index(
+                fields=["state", "created_at"], name="payment_state_created"
+            ),
+        ),
+    ]
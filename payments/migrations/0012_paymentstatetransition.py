@@ -0,0 +1,46 @@
+# Generated by Django 4.1.7 on 2026-10-19 18:16
+
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0011_payment_state_created"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentStateTransition",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateField(auto_now=True)),
+                ("from_state", models.CharField(max_length=255)),
+                ("to_state", models.CharField(max_length=255)),
+                ("source", models.CharField(max_length=255)),
+                (
+                    "payment",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="transitions",
+                        to="payments.payment",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
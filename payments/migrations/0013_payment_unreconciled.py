@@ -0,0 +1,24 @@
+# Generated by Django 4.1.7 on 2026-10-19 21:12
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the payments table stays writable while the index builds
+    atomic = False
+
+    dependencies = [
+        ("payments", "0012_paymentstatetransition"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("reconciled", False)),
+                fields=["created_at"],
+                name="payment_unreconciled",
+            ),
+        ),
+    ]
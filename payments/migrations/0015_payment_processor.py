@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-19 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0014_payoutbatch_payout"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="processor",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-19 21:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0015_payment_processor"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="refund_due",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="paymentcallback",
+            name="rejected",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -3,7 +3,12 @@ from django.db import models
 from core.models import BaseModel
 from core.utils import generate_payment_number
 from partner.models import Person
-from payments.constants import PaymentProviders, PaymentStates, PaymentTransactionState
+from payments.constants import (
+    PaymentProviders,
+    PaymentStates,
+    PaymentTransactionState,
+    PayoutStates,
+)
 
 
 class Payment(BaseModel):
@@ -21,6 +26,8 @@ class Payment(BaseModel):
     made_through = models.CharField(
         max_length=255, null=False, blank=False, default=PaymentProviders.MPESA.value
     )
+    # name of the processor route the payment was sent through
+    processor = models.CharField(max_length=255, null=True, blank=True)
     # mapping from payment provider ids to internal relations
     transaction_id = models.CharField(max_length=256, null=True, blank=True)
     state = models.CharField(
@@ -28,6 +35,18 @@ class Payment(BaseModel):
     )
     verified = models.BooleanField(null=False, blank=False, default=False)
     reconciled = models.BooleanField(null=False, blank=False, default=False)
+    # money was received that no tickets could be issued for
+    refund_due = models.BooleanField(null=False, blank=False, default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["state", "created_at"], name="payment_state_created"),
+            models.Index(
+                fields=["created_at"],
+                name="payment_unreconciled",
+                condition=models.Q(reconciled=False),
+            ),
+        ]
 
     def __str__(self) -> str:
         return (
@@ -73,3 +92,95 @@ class B2BTransactionLogs(BaseModel):
         default=PaymentTransactionState.FAILED.value,
     )
     message = models.CharField(max_length=2048, null=False, blank=False)
+
+
+class PaymentStateTransition(BaseModel):
+    payment = models.ForeignKey(
+        Payment, on_delete=models.CASCADE, related_name="transitions"
+    )
+    from_state = models.CharField(max_length=255, null=False, blank=False)
+    to_state = models.CharField(max_length=255, null=False, blank=False)
+    # what moved the payment e.g. callback, sweeper, provider
+    source = models.CharField(max_length=255, null=False, blank=False)
+
+    def __str__(self) -> str:
+        return f"{self.payment_id} {self.from_state} -> {self.to_state}"
+
+
+class PaymentCallback(BaseModel):
+    """
+    Raw provider callback, stored as received and applied to its payment
+    by the callback worker
+    """
+
+    transaction_id = models.CharField(max_length=256, unique=True)
+    payment_number = models.CharField(max_length=255, null=False, blank=False)
+    status = models.CharField(max_length=255, null=False, blank=False)
+    amount = models.FloatField(null=True, blank=True)
+    payload = models.JSONField(default=dict)
+    processed = models.BooleanField(null=False, blank=False, default=False)
+    # consumed without moving the payment although the buyer was charged
+    rejected = models.BooleanField(null=False, blank=False, default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["created_at"],
+                condition=models.Q(processed=False),
+                name="payment_callback_unprocessed",
+            )
+        ]
+
+
+class PayoutBatch(BaseModel):
+    """
+    Disbursements of a reconciliation run's balances to partners
+    """
+
+    from partner.models import ReconciliationRun
+
+    run = models.OneToOneField(
+        ReconciliationRun,
+        on_delete=models.CASCADE,
+        null=False,
+        blank=False,
+        related_name="payout_batch",
+    )
+    made_through = models.CharField(
+        max_length=255, null=False, blank=False, default=PaymentProviders.MPESA.value
+    )
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"Payouts of {self.run}"
+
+
+class Payout(BaseModel):
+    from partner.models import Partner
+
+    batch = models.ForeignKey(
+        PayoutBatch,
+        on_delete=models.CASCADE,
+        null=False,
+        blank=False,
+        related_name="payouts",
+    )
+    partner = models.ForeignKey(
+        Partner, on_delete=models.DO_NOTHING, null=False, blank=False
+    )
+    amount = models.FloatField(null=False, blank=False)
+    state = models.CharField(
+        max_length=255, null=False, blank=False, default=PayoutStates.PENDING.value
+    )
+    attempts = models.IntegerField(null=False, blank=False, default=0)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["batch", "partner"], name="payout_batch_partner"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.state} payout of {self.amount} to {self.partner.name}"
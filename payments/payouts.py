@@ -0,0 +1,163 @@
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List
+
+import requests
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from eticketing_api import settings
+from partner.ledger import partner_ledger
+from partner.models import PartnerBalance
+from payments.configs import payment_processor_registry
+from payments.constants import (
+    RESENDABLE_PAYOUT_STATES,
+    PaymentStates,
+    PaymentTransactionState,
+    PayoutStates,
+)
+from payments.interfaces import PaymentProviderType
+from payments.models import B2BTransactionLogs, Payout, PayoutBatch
+
+
+class PayoutRunner:
+    """
+    Pays partners their ledger balances once a reconciliation run completes.
+
+    Each payout is checkpointed as SENDING before it is handed to the
+    provider and as SENT, with its ledger debit, once the provider takes
+    it, so a rerun only picks up payouts the provider declined or never
+    received. Transfers are sent from a bounded thread pool, the provider
+    client rate limits them, while the database is only touched from the
+    calling thread.
+    """
+
+    def __init__(self, workers: int, max_attempts: int) -> None:
+        self.workers = workers
+        self.max_attempts = max_attempts
+
+    def create_batch(
+        self, run_id: str, made_through: str = settings.PAYOUT_PROVIDER
+    ) -> PayoutBatch:
+        """
+        Build the run's batch, partners in credit are paid their ledger
+        balance, which is already net of commission, sms spend and earlier
+        payouts, less what earlier batches may still send them. Building a
+        batch twice returns the first one
+        """
+        with transaction.atomic():
+            batch, created = PayoutBatch.objects.get_or_create(
+                run_id=run_id, defaults={"made_through": made_through}
+            )
+            if created:
+                # only debited from the ledger once sent
+                unsent = dict(
+                    Payout.objects.exclude(state=PayoutStates.SENT.value)
+                    .filter(
+                        Q(state=PayoutStates.SENDING.value)
+                        | Q(attempts__lt=self.max_attempts)
+                    )
+                    .values("partner_id")
+                    .annotate(amount=Sum("amount"))
+                    .values_list("partner_id", "amount")
+                )
+                balances = PartnerBalance.objects.filter(balance__gt=0).values_list(
+                    "partner_id", "balance"
+                )
+                payouts = []
+                for partner_id, balance in balances.iterator():
+                    amount = round(balance - unsent.get(partner_id, 0.0), 2)
+                    if amount > 0:
+                        payouts.append(
+                            Payout(batch=batch, partner_id=partner_id, amount=amount)
+                        )
+                Payout.objects.bulk_create(payouts, batch_size=1000)
+        return batch
+
+    def _claim(self, batch: PayoutBatch) -> List[Payout]:
+        with transaction.atomic():
+            payouts = list(
+                batch.payouts.select_for_update(skip_locked=True, of=("self",))
+                .select_related("partner__owner")
+                .filter(
+                    state__in=RESENDABLE_PAYOUT_STATES,
+                    attempts__lt=self.max_attempts,
+                )
+            )
+            Payout.objects.filter(id__in=[payout.id for payout in payouts]).update(
+                state=PayoutStates.SENDING.value, attempts=F("attempts") + 1
+            )
+        return payouts
+
+    def _send(self, processor: PaymentProviderType, payout: Payout) -> PaymentStates:
+        return processor.b2b_send(
+            amount=payout.amount, partner=payout.partner, reference=str(payout.id)
+        )
+
+    def _record(self, payout: Payout, sent: "Future[PaymentStates]") -> str:
+        try:
+            state = sent.result()
+        except requests.ConnectionError as exc:
+            # the provider never got the transfer, leave it for the rerun
+            B2BTransactionLogs.objects.create(partner=payout.partner, message=str(exc))
+            Payout.objects.filter(id=payout.id).update(state=PayoutStates.PENDING.value)
+            return PayoutStates.PENDING.value
+        except requests.RequestException as exc:
+            B2BTransactionLogs.objects.create(
+                partner=payout.partner,
+                message=f"payout {payout.id} outcome unknown: {exc}"[:2048],
+            )
+            return PayoutStates.SENDING.value
+
+        if state != PaymentStates.PAID:
+            B2BTransactionLogs.objects.create(
+                partner=payout.partner, message=f"payout {payout.id} declined"
+            )
+            Payout.objects.filter(id=payout.id).update(state=PayoutStates.FAILED.value)
+            return PayoutStates.FAILED.value
+
+        with transaction.atomic():
+            Payout.objects.filter(id=payout.id).update(
+                state=PayoutStates.SENT.value, sent_at=datetime.now()
+            )
+            partner_ledger.record_payout(
+                str(payout.partner_id), payout.amount, str(payout.id)
+            )
+            B2BTransactionLogs.objects.create(
+                partner=payout.partner,
+                state=PaymentTransactionState.SUCCEEDED.value,
+                message=f"payout {payout.id} of {payout.amount} sent",
+            )
+        return PayoutStates.SENT.value
+
+    def run(self, batch_id: str) -> Dict[str, int]:
+        """
+        Send the batch's unpaid payouts, returns how many ended in each
+        state. Safe to rerun, a batch is complete once every payout was
+        sent or ran out of attempts
+        """
+        batch = PayoutBatch.objects.get(id=batch_id)
+        processor = payment_processor_registry.get(batch.made_through).processor  # type: ignore
+        payouts = self._claim(batch)
+
+        outcomes: Counter = Counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            sending = {
+                pool.submit(self._send, processor, payout): payout for payout in payouts
+            }
+            for sent in as_completed(sending):
+                outcomes[self._record(sending[sent], sent)] += 1
+
+        if not batch.payouts.filter(
+            state__in=RESENDABLE_PAYOUT_STATES, attempts__lt=self.max_attempts
+        ).exists():
+            PayoutBatch.objects.filter(id=batch.id, completed_at__isnull=True).update(
+                completed_at=datetime.now()
+            )
+        return dict(outcomes)
+
+
+payout_runner = PayoutRunner(
+    workers=settings.PAYOUT_WORKERS, max_attempts=settings.PAYOUT_MAX_ATTEMPTS
+)
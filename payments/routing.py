@@ -0,0 +1,238 @@
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import redis
+
+from core.error_codes import ErrorCodes
+from core.exceptions import HttpErrorException
+from payments.interfaces import PaymentProviderType
+from payments.intergrations.client import (
+    LATENCY_BUCKETS_MS,
+    CircuitBreaker,
+    ProviderClient,
+)
+
+# from the healthiest to the least healthy
+CIRCUIT_STATES = (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)
+
+
+class Route(NamedTuple):
+    """
+    A processor able to take payments made through ``method``, healthy
+    while the provider endpoints it calls are
+    """
+
+    name: str
+    method: str
+    processor: PaymentProviderType
+    client: ProviderClient
+    endpoints: Tuple[str, ...]
+
+
+class ProviderHealth:
+    """
+    Rolling call counts, errors and latency buckets of provider endpoints
+    kept in redis, so the web processes routing checkouts see the calls
+    made from the workers. Calls are counted in ``bucket`` second slots
+    and the last ``window`` seconds of slots are read back.
+    """
+
+    def __init__(
+        self, client: redis.Redis, key: str, window: int = 300, bucket: int = 10
+    ) -> None:
+        self.client = client
+        self.key = key
+        self.window = window
+        self.bucket = bucket
+
+    def _slot_key(self, provider: str, endpoint: str, slot: int) -> str:
+        return f"{self.key}:{provider}:{endpoint}:{slot}"
+
+    def _last_key(self, provider: str, endpoint: str) -> str:
+        return f"{self.key}:{provider}:{endpoint}:last"
+
+    def observe(
+        self, provider: str, endpoint: str, duration_ms: float, error: Optional[str]
+    ) -> None:
+        slot = int(time.time()) // self.bucket
+        key = self._slot_key(provider, endpoint, slot)
+        latency_bucket = bisect_left(LATENCY_BUCKETS_MS, duration_ms)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hincrby(key, "count", 1)
+        pipe.hincrby(key, f"le_{latency_bucket}", 1)
+        if error:
+            pipe.hincrby(key, "errors", 1)
+        pipe.expire(key, self.window + self.bucket)
+        pipe.set(self._last_key(provider, endpoint), error or "", ex=self.window)
+        pipe.execute()
+
+    def claim_probe(self, name: str, interval: int) -> bool:
+        """
+        Whether this process may send the one probe ``name`` is allowed
+        every ``interval`` seconds
+        """
+        return bool(
+            self.client.set(f"{self.key}:probe:{name}", 1, nx=True, ex=interval)
+        )
+
+    def snapshot(self, provider: str, endpoint: str) -> Dict[str, Any]:
+        """
+        Calls, error rate and approximate 95th percentile latency over the
+        window, the percentile is the upper bound of its latency bucket.
+        ``last_ok`` is whether the latest call succeeded, None without calls
+        """
+        last_slot = int(time.time()) // self.bucket
+        slots = range(last_slot - self.window // self.bucket + 1, last_slot + 1)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(self._last_key(provider, endpoint))
+        for slot in slots:
+            pipe.hgetall(self._slot_key(provider, endpoint, slot))
+        last, *stored_slots = pipe.execute()
+        counts: Dict[str, int] = {}
+        for stored in stored_slots:
+            for field, value in stored.items():
+                counts[field] = counts.get(field, 0) + int(value)
+
+        calls = counts.get("count", 0)
+        p95_ms: Optional[int] = None
+        seen = 0
+        for index in range(len(LATENCY_BUCKETS_MS) + 1):
+            seen += counts.get(f"le_{index}", 0)
+            if calls and seen >= calls * 0.95:
+                # calls slower than the last bucket are counted at its bound
+                p95_ms = LATENCY_BUCKETS_MS[min(index, len(LATENCY_BUCKETS_MS) - 1)]
+                break
+        return {
+            "calls": calls,
+            "error_rate": counts.get("errors", 0) / calls if calls else 0.0,
+            "p95_ms": p95_ms,
+            "last_ok": None if last is None else not last,
+        }
+
+
+class ProcessorRegistry:
+    """
+    Processors registered per payment method in order of preference.
+    Checkouts are routed to the first one that is healthy: its circuit
+    isn't open and, once it has made ``min_calls`` calls in the health
+    window, its error rate and 95th percentile latency are within limits.
+    A method with no healthy processor is refused instead of leaving
+    buyers waiting on a failing rail, except for one probe checkout every
+    ``probe_interval`` seconds sent down its preferred processor. Once the
+    latest call there has succeeded checkouts flow again without waiting
+    for the errors to leave the window.
+    """
+
+    def __init__(
+        self,
+        health: ProviderHealth,
+        max_error_rate: float = 0.25,
+        max_p95_ms: float = 5000,
+        min_calls: int = 10,
+        probe_interval: int = 5,
+    ) -> None:
+        self.health = health
+        self.max_error_rate = max_error_rate
+        self.max_p95_ms = max_p95_ms
+        self.min_calls = min_calls
+        self.probe_interval = probe_interval
+        self.routes: Dict[str, List[Route]] = {}
+        self._observed: List[ProviderClient] = []
+
+    def register(self, route: Route) -> Route:
+        self.routes.setdefault(route.method, []).append(route)
+        if route.client not in self._observed:
+            self._observed.append(route.client)
+            provider = route.client.name
+            route.client.observers.append(
+                lambda endpoint, duration_ms, error: self.health.observe(
+                    provider, endpoint, duration_ms, error
+                )
+            )
+        return route
+
+    def __contains__(self, method: str) -> bool:
+        return method in self.routes
+
+    def get(self, method: str, name: Optional[str] = None) -> Optional[Route]:
+        """
+        The route a payment was made through, the preferred route of its
+        method for payments made before routing was recorded
+        """
+        routes = self.routes.get(method, [])
+        for route in routes:
+            if route.name == name:
+                return route
+        return routes[0] if routes else None
+
+    def route_health(self, route: Route) -> Dict[str, Any]:
+        # the route's circuit is the least healthy of its endpoints'
+        circuit = max(
+            (route.client.breaker_for(endpoint).state for endpoint in route.endpoints),
+            key=CIRCUIT_STATES.index,
+            default=CircuitBreaker.CLOSED,
+        )
+        endpoints: Dict[str, Any] = {}
+        healthy = circuit != CircuitBreaker.OPEN
+        for endpoint in route.endpoints:
+            try:
+                stats = self.health.snapshot(route.client.name, endpoint)
+            except redis.RedisError:
+                # without shared stats only the local circuit is known
+                continue
+            endpoints[endpoint] = stats
+            if stats["calls"] >= self.min_calls and (
+                stats["error_rate"] > self.max_error_rate
+                or (stats["p95_ms"] or 0) > self.max_p95_ms
+            ):
+                healthy = False
+        outcomes = [
+            stats["last_ok"]
+            for stats in endpoints.values()
+            if stats["last_ok"] is not None
+        ]
+        return {
+            "name": route.name,
+            "method": route.method,
+            "provider": route.client.name,
+            "healthy": healthy,
+            "circuit": circuit,
+            # the latest calls succeeded although the window still says otherwise
+            "recovering": bool(outcomes) and all(outcomes),
+            "endpoints": endpoints,
+        }
+
+    def route(self, method: str) -> Route:
+        routes = self.routes.get(method)
+        if not routes:
+            raise HttpErrorException(
+                status_code=503, code=ErrorCodes.PROVIDER_NOT_SUPPORTED
+            )
+        unhealthy = []
+        for route in routes:
+            health = self.route_health(route)
+            if health["healthy"]:
+                return route
+            unhealthy.append((route, health))
+        # without probes nothing would be sent down a failed rail, so its
+        # health could only come back once the errors aged out of the window
+        for route, health in unhealthy:
+            if health["circuit"] == CircuitBreaker.OPEN:
+                continue
+            if health["recovering"] or self._claim_probe(route):
+                return route
+        raise HttpErrorException(status_code=503, code=ErrorCodes.PROVIDER_UNAVAILABLE)
+
+    def _claim_probe(self, route: Route) -> bool:
+        try:
+            return self.health.claim_probe(route.name, self.probe_interval)
+        except redis.RedisError:
+            return False
+
+    def report(self) -> List[Dict[str, Any]]:
+        return [
+            self.route_health(route)
+            for routes in self.routes.values()
+            for route in routes
+        ]
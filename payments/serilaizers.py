@@ -32,7 +32,7 @@ class PaymentCreateSerializer(serializers.Serializer):
     made_through = serializers.CharField(max_length=255)
     person = PersonSerializer()
     ticket_types = serializers.ListField(child=TicketTypeSerializer())
-    promo = serializers.CharField(max_length=255, required=False)
+    promo = serializers.CharField(max_length=255, required=False, allow_null=True)
 
 
 class PaymentUpdateSerializer(BaseSerializer, PaymentBaseSerializer):
@@ -40,7 +40,8 @@ class PaymentUpdateSerializer(BaseSerializer, PaymentBaseSerializer):
 
 
 class PaymentReadSerializer(InDBBaseSerializer, PaymentBaseSerializer):
-    pass
+    number = serializers.CharField(max_length=255)
+    state = serializers.CharField(max_length=255)
 
 
 class PaymentMethodSerialzier(serializers.Serializer):
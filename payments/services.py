@@ -1,86 +1,131 @@
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from functools import reduce
 from http import HTTPStatus
-from typing import Any, Dict, List, Optional
+from operator import or_
+from typing import Any, Dict, List, Optional, Tuple, Type, Union
 
 from django.db import transaction
-from django.db.models.query import QuerySet
+from django.db.models import Case, F, IntegerField, Q, When
 
 from core.error_codes import ErrorCodes
-from core.exceptions import HttpErrorException
+from core.exceptions import (
+    HttpErrorException,
+    ObjectInvalidException,
+    ObjectNotFoundException,
+)
+from core.outbox import enqueue
 from core.services import CRUDService
 from eticketing_api import settings
 from events.models import Ticket, TicketType
 from events.services import event_promo_service
-from notifications.tasks import send_ticket_email
+from notifications.tasks import send_payment_tickets
+from partner.ledger import partner_ledger
 from partner.models import PartnerSMS
 from partner.services import partner_service, partner_sms_service, person_service
-from payments.configs import payment_processor_map
-from payments.constants import CONFIRMED_PAYMENT_STATES
-from payments.models import Payment, PaymentMethod
+from payments.configs import active_payment_processor_mpesa, payment_processor_registry
+from payments.constants import (
+    CONFIRMED_PAYMENT_STATES,
+    FUNDED_PAYMENT_STATES,
+    IPAY_CALLBACK_STATES,
+    PAYMENT_STATE_TRANSITIONS,
+    STALE_PAYMENT_STATES,
+    PaymentStates,
+    PaymentTransactionState,
+)
+from payments.models import (
+    Payment,
+    PaymentCallback,
+    PaymentMethod,
+    PaymentStateTransition,
+    PaymentTransactionLogs,
+)
 from payments.serilaizers import (
     PaymentCreateSerializerInner,
     PaymentMethodWriteSerializer,
     PaymentUpdateSerializer,
     SMSPaymentCreateSerializerInner,
 )
-from tickets.serializers import TicketCreateSerializer
+from payments.tasks import initiate_payment
 from tickets.services import ticket_service
+from tickets.utils import compute_ticket_hash
 
 
 class PaymentService(
     CRUDService[Payment, PaymentCreateSerializerInner, PaymentUpdateSerializer]
 ):
-    def validate_ticket_types_and_person(
-        self, obj_data: Dict[str, Any]
-    ) -> Dict[str, Any]:
-        amount = 0
-        event_id: Optional[str] = ""
-        ticket_type_objs: List[TicketType] = []
-        if ticket_types := obj_data.get("ticket_types", None):
-            for ticket_type in ticket_types:
-                if ticket_type_obj := TicketType.objects.filter(
-                    id=ticket_type["id"], active=True
-                ).first():
-                    amount += round((ticket_type_obj.price * ticket_type["amount"]), 2)
-                    if event_id == "":
-                        event_id = str(ticket_type_obj.event_id)
-                    if event_id != str(ticket_type_obj.event_id):
-                        raise HttpErrorException(
-                            status_code=400,
-                            code=ErrorCodes.NOT_SUPPORTED,
-                            extra="Ticket bundling from multiple events is not supported",
-                        )
-                    if ticket_type_obj.amount == 0:
-                        raise HttpErrorException(
-                            status_code=400,
-                            code=ErrorCodes.TICKET_TYPE_SOLD_OUT,
-                            extra=ticket_type_obj.name,
-                        )
-                    if ticket_type_obj.amount < ticket_type["amount"]:
-                        ticket_type_obj.refresh_from_db()
-                        raise HttpErrorException(
-                            status_code=400,
-                            code=ErrorCodes.TICKET_TYPE_INSUFFICIENT,
-                            extra=(
-                                f"The ticket {ticket_type_obj.name} has"
-                                f" only {ticket_type_obj.amount} left"
-                            ),
-                        )
-                    ticket_type_objs.append(ticket_type_obj)
+    def load_ticket_types(
+        self, lines: List[Dict[str, Any]]
+    ) -> Tuple[Dict[str, TicketType], Dict[str, int]]:
+        """
+        Fetch the requested ticket types in one query and check the order
+        can be filled, returns the ticket types and quantities by id
+        """
+        quantities: Dict[str, int] = defaultdict(int)
+        for line in lines:
+            try:
+                ticket_type_id = str(uuid.UUID(str(line["id"])))
+            except ValueError:
+                raise HttpErrorException(
+                    status_code=400,
+                    code=ErrorCodes.INTERGRATION_ERROR,
+                    extra=f"Invalid Ticket Type id {line['id']}",
+                )
+            quantities[ticket_type_id] += int(line["amount"])
 
-                else:
-                    raise HttpErrorException(
-                        status_code=400,
-                        code=ErrorCodes.INTERGRATION_ERROR,
-                        extra=f"Invalid Ticket Type id {ticket_type['id']}",
-                    )
-            obj_data["amount"] = amount
-            obj_data["tt_objs"] = ticket_type_objs
+        ticket_types = {
+            str(ticket_type.id): ticket_type
+            for ticket_type in TicketType.objects.filter(
+                id__in=quantities.keys(), active=True
+            ).select_related("event")
+        }
+        for ticket_type_id, quantity in quantities.items():
+            ticket_type_obj = ticket_types.get(ticket_type_id)
+            if not ticket_type_obj:
+                raise HttpErrorException(
+                    status_code=400,
+                    code=ErrorCodes.INTERGRATION_ERROR,
+                    extra=f"Invalid Ticket Type id {ticket_type_id}",
+                )
+            if ticket_type_obj.amount == 0:
+                raise HttpErrorException(
+                    status_code=400,
+                    code=ErrorCodes.TICKET_TYPE_SOLD_OUT,
+                    extra=ticket_type_obj.name,
+                )
+            if ticket_type_obj.amount < quantity:
+                raise self._insufficient_tickets(ticket_type_obj)
 
-        if person := obj_data.get("person", None):
-            obj_data["person_id"] = str(person_service.get_or_create(person).id)
-            del obj_data["person"]
+        if len({ticket_type.event_id for ticket_type in ticket_types.values()}) > 1:
+            raise HttpErrorException(
+                status_code=400,
+                code=ErrorCodes.NOT_SUPPORTED,
+                extra="Ticket bundling from multiple events is not supported",
+            )
+        return ticket_types, quantities
+
+    def _insufficient_tickets(self, ticket_type: TicketType) -> HttpErrorException:
+        return HttpErrorException(
+            status_code=400,
+            code=ErrorCodes.TICKET_TYPE_INSUFFICIENT,
+            extra=(
+                f"The ticket {ticket_type.name} has" f" only {ticket_type.amount} left"
+            ),
+        )
 
-        if promo := obj_data.get("promo", None):
+    def price_order(
+        self,
+        ticket_types: Dict[str, TicketType],
+        quantities: Dict[str, int],
+        promo: Optional[str] = None,
+    ) -> float:
+        amount = 0
+        for ticket_type_id, quantity in quantities.items():
+            amount += round((ticket_types[ticket_type_id].price * quantity), 2)
+
+        if promo:
+            event_id = next(iter(ticket_types.values())).event_id
             if promo_obj := event_promo_service.get(id=promo, event_id=event_id):
                 amount = (
                     amount
@@ -88,50 +133,473 @@ class PaymentService(
                     if amount
                     else 0
                 )
-                obj_data["amount"] = amount
             else:
                 raise HttpErrorException(
                     status_code=404, code=ErrorCodes.PROMO_NOT_FOUND
                 )
+        return amount
+
+    def validate_ticket_types_and_person(
+        self, obj_data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        if ticket_types := obj_data.get("ticket_types", None):
+            ticket_type_objs, quantities = self.load_ticket_types(ticket_types)
+            obj_data["amount"] = self.price_order(
+                ticket_type_objs, quantities, obj_data.get("promo", None)
+            )
+            obj_data["tt_objs"] = list(ticket_type_objs.values())
+
+        if person := obj_data.get("person", None):
+            obj_data["person_id"] = str(person_service.get_or_create(person).id)
+            del obj_data["person"]
 
         return obj_data
 
+    def issue_tickets(
+        self,
+        payment: Payment,
+        ticket_types: Dict[str, TicketType],
+        quantities: Dict[str, int],
+    ) -> List[Ticket]:
+        """
+        Create a ticket per unit ordered and take them off the ticket types'
+        inventory, to be called inside the transaction creating the payment
+        """
+        tickets = []
+        for ticket_type_id, quantity in quantities.items():
+            for _ in range(quantity):
+                ticket = Ticket(
+                    ticket_type=ticket_types[ticket_type_id], payment=payment
+                )
+                ticket.hash = compute_ticket_hash(ticket)
+                tickets.append(ticket)
+        Ticket.objects.bulk_create(tickets)
+        self._take_inventory(quantities)
+        ticket_service.record_sales(tickets)
+        return tickets
+
+    def _take_inventory(self, quantities: Dict[str, int]) -> None:
+        # the decrement only applies while every type still has enough left
+        decremented = TicketType.objects.filter(
+            reduce(
+                or_,
+                (
+                    Q(id=ticket_type_id, amount__gte=quantity)
+                    for ticket_type_id, quantity in quantities.items()
+                ),
+            )
+        ).update(
+            amount=Case(
+                *[
+                    When(id=ticket_type_id, then=F("amount") - quantity)
+                    for ticket_type_id, quantity in quantities.items()
+                ],
+                output_field=IntegerField(),
+            )
+        )
+        if decremented != len(quantities):
+            short = (
+                TicketType.objects.filter(id__in=quantities.keys())
+                .only("name", "amount")
+                .order_by("amount")
+            )
+            for ticket_type in short:
+                if ticket_type.amount < quantities[str(ticket_type.id)]:
+                    raise self._insufficient_tickets(ticket_type)
+
+    def _reinstate_tickets(self, payment: Payment) -> bool:
+        """
+        Take the tickets of a voided payment that was paid after all back
+        off their ticket types' inventory. Returns False, leaving the
+        inventory as it was, when some of them have been sold on since
+        """
+        tickets = list(
+            Ticket.objects.filter(payment_id=payment.id).only(
+                "id", "created_at", "payment_id", "ticket_type_id"
+            )
+        )
+        quantities = Counter(str(ticket.ticket_type_id) for ticket in tickets)
+        if quantities:
+            try:
+                with transaction.atomic():
+                    self._take_inventory(quantities)
+            except HttpErrorException:
+                return False
+        ticket_service.record_sales(tickets)
+        return True
+
+    def checkout(self, obj_data: Dict[str, Any]) -> Payment:
+        """
+        Price the order, then write the payment, its tickets and the
+        inventory changes in a single transaction. The payment is returned
+        INITIATING, the provider is called from a worker
+        """
+        route = payment_processor_registry.route(obj_data.get("made_through", ""))
+        ticket_types, quantities = self.load_ticket_types(
+            obj_data.get("ticket_types", None) or []
+        )
+        if not quantities:
+            raise HttpErrorException(
+                status_code=400,
+                code=ErrorCodes.INTERGRATION_ERROR,
+                extra="No ticket types were ordered",
+            )
+        person_data = obj_data.get("person", None) or {}
+        if not person_data.get("phone_number") or not person_data.get("name"):
+            raise ObjectInvalidException(
+                "Payment", extra="a person with a name and phone_number is required"
+            )
+        amount = self.price_order(ticket_types, quantities, obj_data.get("promo"))
+        person, _ = person_service.upsert_by_phone(person_data)
+
+        with transaction.atomic():
+            payment = Payment.objects.create(
+                amount=amount,
+                person=person,
+                made_through=obj_data["made_through"],
+                processor=route.name,
+                state=PaymentStates.INITIATING.value,
+            )
+            self.issue_tickets(payment, ticket_types, quantities)
+            self.initiate(payment)
+
+        return payment
+
+    def initiate(self, payment: Payment) -> None:
+        """
+        Ask the provider for the money from a worker once the payment is
+        committed, clients poll the payment for its state meanwhile
+        """
+        enqueue(initiate_payment, args=(str(payment.id),))
+
     def on_post_create(self, obj: Payment, obj_in: Dict[str, Any]) -> None:
-        for ticket_type in obj_in["ticket_types"]:
-            ticket_service.create(
-                obj_data={
-                    "ticket_type_id": str(ticket_type["id"]),
-                    "payment_id": str(obj.id),
-                },
-                serializer=TicketCreateSerializer,
+        route = payment_processor_registry.route(obj.made_through)
+        ticket_types, quantities = self.load_ticket_types(obj_in["ticket_types"])
+        with transaction.atomic():
+            self.issue_tickets(obj, ticket_types, quantities)
+            obj.state = PaymentStates.INITIATING.value
+            obj.processor = route.name
+            obj.save(update_fields=["state", "processor"])
+            self.initiate(obj)
+
+    def update(
+        self,
+        *,
+        obj_data: Dict[str, Any],
+        serializer: Type[PaymentUpdateSerializer],
+        obj_id: Union[str, int],
+        source: str = "update",
+    ) -> Payment:
+        """
+        State changes are applied through ``transition``, other fields are
+        updated as usual
+        """
+        obj_data = obj_data.copy()
+        state = obj_data.pop("state", None)
+        if obj_data:
+            super().update(obj_data=obj_data, serializer=serializer, obj_id=obj_id)
+        if state:
+            self.transition(str(obj_id), state, source=source)
+        payment = Payment.objects.filter(pk=obj_id).first()
+        if not payment:
+            raise ObjectNotFoundException(model="Payment", pk=str(obj_id))
+        return payment
+
+    def transition(self, payment_id: str, state: str, source: str) -> bool:
+        """
+        Move the payment to ``state`` if that is an allowed edge from its
+        current state and record the change. Returns False when the payment
+        stays as it was, repeats and stale updates are therefore harmless.
+        A voided payment whose tickets have been sold on since stays voided
+        and is flagged for a refund
+        """
+        if state not in PAYMENT_STATE_TRANSITIONS:
+            raise ObjectInvalidException("Payment", extra=f"unknown state {state}")
+        with transaction.atomic():
+            payment = Payment.objects.select_for_update().filter(pk=payment_id).first()
+            if not payment:
+                raise ObjectNotFoundException(model="Payment", pk=payment_id)
+            from_state = payment.state
+            if state not in PAYMENT_STATE_TRANSITIONS[from_state]:
+                return False
+            if from_state == PaymentStates.VOIDED.value:
+                if not self._reinstate_tickets(payment):
+                    payment.refund_due = True
+                    payment.save(update_fields=["refund_due", "updated_at"])
+                    return False
+            payment.state = state
+            payment.verified = payment.verified or state in CONFIRMED_PAYMENT_STATES
+            payment.save(update_fields=["state", "verified", "updated_at"])
+            self._record_transitions([(payment, from_state, state)], source)
+        return True
+
+    def _record_transitions(
+        self, transitions: List[Tuple[Payment, str, str]], source: str
+    ) -> None:
+        """
+        Log state changes already written in the current transaction,
+        credit partners with newly confirmed payments and queue one
+        ticket delivery job for each of them
+        """
+        PaymentStateTransition.objects.bulk_create(
+            [
+                PaymentStateTransition(
+                    payment=payment,
+                    from_state=from_state,
+                    to_state=to_state,
+                    source=source,
+                )
+                for payment, from_state, to_state in transitions
+            ]
+        )
+        confirmed = {
+            str(payment.id)
+            for payment, from_state, to_state in transitions
+            if to_state in CONFIRMED_PAYMENT_STATES
+            and from_state not in CONFIRMED_PAYMENT_STATES
+        }
+        partner_ledger.record_sales(confirmed)
+        for payment_id in confirmed:
+            enqueue(
+                send_payment_tickets,
+                args=(payment_id,),
+                queue=settings.CELERY_NOTIFICATIONS_QUEUE,
             )
 
-            # decrement the relevant ticket_types uses
-            # whether or not these exist has already been validated
-            with transaction.atomic():
-                ticket_type_obj = TicketType.objects.select_for_update().get(
-                    id=ticket_type["id"]
+    def ingest_callback(self, data: Dict[str, Any]) -> bool:
+        """
+        Verify and store a provider callback for the callback worker,
+        returns False for a transaction that was already received
+        """
+        if not active_payment_processor_mpesa.validate_callback(data):
+            raise HttpErrorException(
+                status_code=HTTPStatus.FORBIDDEN,
+                code=ErrorCodes.INVALID_CALLBACK_SIGNATURE,
+            )
+        if not data.get("txncd") or not data.get("id"):
+            raise HttpErrorException(
+                status_code=HTTPStatus.BAD_REQUEST,
+                code=ErrorCodes.INTERGRATION_ERROR,
+                extra="The callback has no transaction code or order id",
+            )
+        try:
+            amount: Optional[float] = float(data.get("mc", ""))
+        except ValueError:
+            amount = None
+        callback = PaymentCallback(
+            transaction_id=data["txncd"],
+            payment_number=data["id"],
+            status=data.get("status", ""),
+            amount=amount,
+            payload=dict(data),
+        )
+        PaymentCallback.objects.bulk_create([callback], ignore_conflicts=True)
+        # a repeated transaction keeps the stored row, so this one's id is absent
+        return PaymentCallback.objects.filter(pk=callback.pk).exists()
+
+    def apply_callbacks(self, limit: int = settings.PAYMENT_CALLBACK_BATCH_SIZE) -> int:
+        """
+        Apply a batch of stored callbacks to their payments, returns the
+        number of callbacks consumed. Workers running side by side take
+        different batches, callbacks that aren't an allowed transition for
+        their payment are consumed without effect. Money received for a
+        voided payment whose tickets can't be reinstated is rejected and
+        the payment flagged for a refund
+        """
+        with transaction.atomic():
+            callbacks = list(
+                PaymentCallback.objects.select_for_update(skip_locked=True)
+                .filter(processed=False)
+                .order_by("created_at")[:limit]
+            )
+            if not callbacks:
+                return 0
+            payments = {
+                payment.number: payment
+                for payment in Payment.objects.select_for_update().filter(
+                    number__in={callback.payment_number for callback in callbacks}
                 )
-                ticket_type_obj.amount -= ticket_type["amount"]
-                ticket_type_obj.save()
+            }
 
-            if processor := payment_processor_map.get(obj.made_through, None):
-                processor.c2b_receive(payment=obj)
-            else:
-                raise HttpErrorException(
-                    status_code=503, code=ErrorCodes.PROVIDER_NOT_SUPPORTED
+            changed: Dict[str, Payment] = {}
+            rejected: List[PaymentCallback] = []
+            transitions = []
+            logs = []
+            for callback in callbacks:
+                payment = payments.get(callback.payment_number)
+                state = IPAY_CALLBACK_STATES.get(callback.status)
+                if not payment or not state:
+                    continue
+                voided = payment.state == PaymentStates.VOIDED.value
+                if (
+                    voided
+                    and state in FUNDED_PAYMENT_STATES
+                    and (
+                        state not in PAYMENT_STATE_TRANSITIONS[payment.state]
+                        or not self._reinstate_tickets(payment)
+                    )
+                ):
+                    rejected.append(callback)
+                    payment.refund_due = True
+                    changed[payment.number] = payment
+                    logs.append(
+                        PaymentTransactionLogs(
+                            payment=payment,
+                            message=(
+                                f"{callback.transaction_id} {callback.status}"
+                                " received after the payment was voided, refund due"
+                            ),
+                            state=PaymentTransactionState.FAILED.value,
+                        )
+                    )
+                    continue
+                if state not in PAYMENT_STATE_TRANSITIONS[payment.state]:
+                    continue
+                transitions.append((payment, payment.state, state))
+                payment.state = state
+                payment.transaction_id = callback.transaction_id
+                payment.verified = state in CONFIRMED_PAYMENT_STATES
+                changed[payment.number] = payment
+                logs.append(
+                    PaymentTransactionLogs(
+                        payment=payment,
+                        message=f"{callback.transaction_id} {callback.status}",
+                        state=(
+                            PaymentTransactionState.FAILED.value
+                            if state == PaymentStates.FAILED.value
+                            else PaymentTransactionState.SUCCEEDED.value
+                        ),
+                    )
                 )
 
-    def on_post_update(self, obj: Payment) -> None:
-        if obj.state in CONFIRMED_PAYMENT_STATES:
-            obj.verified = True
-            obj.save()
-            tickets: QuerySet[Ticket] = Ticket.objects.filter(payment_id=obj.id)
-            for ticket in tickets:
-                send_ticket_email.apply_async(
-                    args=(ticket.id,),
-                    queue=settings.CELERY_MAIN_QUEUE,
+            Payment.objects.bulk_update(
+                changed.values(), ["state", "transaction_id", "verified", "refund_due"]
+            )
+            PaymentTransactionLogs.objects.bulk_create(logs)
+            PaymentCallback.objects.filter(
+                id__in=[callback.id for callback in callbacks]
+            ).update(processed=True)
+            PaymentCallback.objects.filter(
+                id__in=[callback.id for callback in rejected]
+            ).update(rejected=True)
+            self._record_transitions(transitions, source="callback")
+        return len(callbacks)
+
+    def sweep_expired(
+        self,
+        expiry: timedelta = timedelta(minutes=settings.PAYMENT_PENDING_EXPIRY_MINUTES),
+        check_provider: bool = settings.PAYMENT_SWEEP_CHECK_PROVIDER,
+        chunk_size: int = settings.PAYMENT_SWEEP_CHUNK_SIZE,
+    ) -> Dict[str, Any]:
+        """
+        Void payments left unpaid past ``expiry`` and put their tickets back
+        on sale, chunk by chunk. With ``check_provider`` the provider is
+        asked first and payments it reports paid are confirmed instead.
+        Returns the payments voided and confirmed and the tickets put back
+        on sale per event
+        """
+        cutoff = datetime.now() - expiry
+        report: Dict[str, Any] = {"voided": 0, "confirmed": 0, "reclaimed": Counter()}
+        while True:
+            candidates = list(
+                Payment.objects.filter(
+                    state__in=STALE_PAYMENT_STATES, created_at__lt=cutoff
+                )
+                .only("id", "number", "made_through", "processor", "state")
+                .order_by("created_at")[:chunk_size]
+            )
+            if not candidates:
+                break
+            resolved: Dict[str, List[str]] = defaultdict(list)
+            if check_provider:
+                for payment in candidates:
+                    route = payment_processor_registry.get(
+                        payment.made_through, payment.processor
+                    )
+                    state = route and route.processor.get_transaction_state(
+                        payment=payment
+                    )
+                    if state and state not in STALE_PAYMENT_STATES:
+                        resolved[state].append(str(payment.id))
+            settled = {
+                payment_id
+                for payment_ids in resolved.values()
+                for payment_id in payment_ids
+            }
+
+            with transaction.atomic():
+                for state, payment_ids in resolved.items():
+                    for payment_id in payment_ids:
+                        report["confirmed"] += self.transition(
+                            payment_id, state, source="provider"
+                        )
+                voided = self._void_payments(
+                    [
+                        payment.id
+                        for payment in candidates
+                        if str(payment.id) not in settled
+                    ]
                 )
+                report["voided"] += len(voided)
+                progressed = bool(voided) or bool(resolved)
+                report["reclaimed"].update(self._release_tickets(voided))
+            # locked candidates would be picked again on the next pass
+            if len(candidates) < chunk_size or not progressed:
+                break
+        report["reclaimed"] = dict(report["reclaimed"])
+        return report
+
+    def _void_payments(self, payment_ids: List[uuid.UUID]) -> List[uuid.UUID]:
+        # payments another worker holds, or that moved on since, are left alone
+        voided = list(
+            Payment.objects.select_for_update(skip_locked=True)
+            .filter(id__in=payment_ids, state__in=STALE_PAYMENT_STATES)
+            .only("id", "state")
+        )
+        Payment.objects.filter(id__in=[payment.id for payment in voided]).update(
+            state=PaymentStates.VOIDED.value
+        )
+        self._record_transitions(
+            [
+                (payment, payment.state, PaymentStates.VOIDED.value)
+                for payment in voided
+            ],
+            source="sweeper",
+        )
+        return [payment.id for payment in voided]
+
+    def _release_tickets(self, payment_ids: List[uuid.UUID]) -> Dict[str, int]:
+        """
+        Put the tickets of voided payments back on their ticket types,
+        returns the tickets released per event
+        """
+        if not payment_ids:
+            return {}
+        tickets = list(
+            Ticket.objects.filter(payment_id__in=payment_ids).only(
+                "id", "created_at", "payment_id", "ticket_type_id"
+            )
+        )
+        released = Counter(str(ticket.ticket_type_id) for ticket in tickets)
+        if not released:
+            return {}
+        TicketType.objects.filter(id__in=released.keys()).update(
+            amount=Case(
+                *[
+                    When(id=ticket_type_id, then=F("amount") + count)
+                    for ticket_type_id, count in released.items()
+                ],
+                output_field=IntegerField(),
+            )
+        )
+        ticket_service.retract_sales(tickets)
+
+        reclaimed: Dict[str, int] = defaultdict(int)
+        for ticket_type_id, event_id in TicketType.objects.filter(
+            id__in=released.keys()
+        ).values_list("id", "event_id"):
+            reclaimed[str(event_id)] += released[str(ticket_type_id)]
+        return reclaimed
 
     def fund_sms_package(
         self, partner_id: str, payment_in: SMSPaymentCreateSerializerInner
@@ -143,12 +611,8 @@ class PaymentService(
             )
         sms_package = partner_sms_service.get_latest_sms_package(partner_id=partner_id)
 
-        if processor := payment_processor_map.get(payment_in.made_through, None):  # type: ignore
-            state = processor.b2b_recieve(amount=payment_in.amount, partner=partner)
-        else:
-            raise HttpErrorException(
-                status_code=503, code=ErrorCodes.PROVIDER_NOT_SUPPORTED
-            )
+        route = payment_processor_registry.route(payment_in.made_through)  # type: ignore
+        state = route.processor.b2b_recieve(amount=payment_in.amount, partner=partner)
 
         if state.value in CONFIRMED_PAYMENT_STATES:
             credited_sms = int(payment_in.amount / sms_package.per_sms_rate)  # type: ignore
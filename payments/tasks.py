@@ -0,0 +1,94 @@
+from typing import Any, Dict
+
+import requests
+from celery import shared_task
+
+from eticketing_api import settings
+from payments.configs import payment_processor_registry
+from payments.constants import PaymentStates
+from payments.models import Payment, PaymentStateTransition, PayoutBatch
+
+
+@shared_task(
+    name="initiate_payment",
+    autoretry_for=(requests.ConnectionError,),
+    retry_backoff=True,
+    max_retries=settings.PAYMENT_INITIATION_RETRIES,
+)
+def initiate_payment(payment_id: str) -> str:
+    # Claim the payment so a redelivered task doesn't prompt the buyer twice
+    claimed = Payment.objects.filter(
+        pk=payment_id, state=PaymentStates.INITIATING.value
+    ).update(state=PaymentStates.PENDING.value)
+    payment = Payment.objects.select_related("person").get(pk=payment_id)
+    if not claimed:
+        return payment.state
+    PaymentStateTransition.objects.create(
+        payment=payment,
+        from_state=PaymentStates.INITIATING.value,
+        to_state=PaymentStates.PENDING.value,
+        source="worker",
+    )
+
+    try:
+        route = payment_processor_registry.get(payment.made_through, payment.processor)
+        route.processor.c2b_receive(payment=payment)  # type: ignore
+    except requests.ConnectionError:
+        # the provider never got the request, hand the payment back so the
+        # retry can claim it
+        if Payment.objects.filter(
+            pk=payment_id, state=PaymentStates.PENDING.value
+        ).update(state=PaymentStates.INITIATING.value):
+            PaymentStateTransition.objects.create(
+                payment=payment,
+                from_state=PaymentStates.PENDING.value,
+                to_state=PaymentStates.INITIATING.value,
+                source="worker",
+            )
+        raise
+    except requests.RequestException:
+        # the buyer may have been prompted already, the callback or the
+        # sweeper settles the payment
+        return PaymentStates.PENDING.value
+    payment.refresh_from_db(fields=["state"])
+    return payment.state
+
+
+@shared_task(name="process_payment_callbacks")
+def process_payment_callbacks() -> int:
+    from payments.services import payment_service
+
+    processed = 0
+    while applied := payment_service.apply_callbacks():
+        processed += applied
+        if applied < settings.PAYMENT_CALLBACK_BATCH_SIZE:
+            break
+    return processed
+
+
+@shared_task(name="sweep_expired_payments")
+def sweep_expired_payments() -> Dict[str, Any]:
+    from payments.services import payment_service
+
+    return payment_service.sweep_expired()
+
+
+@shared_task(name="send_partner_payouts")
+def send_partner_payouts(run_id: str) -> Dict[str, int]:
+    from payments.payouts import payout_runner
+
+    batch = payout_runner.create_batch(run_id)
+    return payout_runner.run(str(batch.id))
+
+
+@shared_task(name="resume_partner_payouts")
+def resume_partner_payouts() -> Dict[str, int]:
+    from payments.payouts import payout_runner
+
+    outcomes: Dict[str, int] = {}
+    for batch_id in PayoutBatch.objects.filter(completed_at__isnull=True).values_list(
+        "id", flat=True
+    ):
+        for state, count in payout_runner.run(str(batch_id)).items():
+            outcomes[state] = outcomes.get(state, 0) + count
+    return outcomes
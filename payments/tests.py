@@ -1,18 +1,64 @@
+import re
+import time
 import uuid
-from typing import Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Optional, Tuple
 from unittest import mock
 from unittest.mock import Mock
 
+import redis
+import requests
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 
+from core.error_codes import ErrorCodes
+from core.exceptions import HttpErrorException, ObjectInvalidException
+from core.idempotency import REPLAYED_HEADER, IdempotencyStore, StoredResponse
+from core.outbox import relay_outbox
+from core.redis import redis_client
+from core.utils import random_string
 from eticketing_api import settings
+from eticketing_api.celery import celery
 from events.fixtures import event_fixtures
-from partner.constants import PersonType
+from events.models import Ticket, TicketType
+from partner.constants import LedgerEntryType, PersonType
 from partner.fixtures import partner_fixtures
-from payments.constants import PaymentProviders, PaymentStates
+from partner.ledger import partner_ledger
+from partner.models import ReconciliationRun
+from payments.configs import payment_processor_registry
+from payments.constants import (
+    PaymentProviders,
+    PaymentStates,
+    PaymentTransactionState,
+    PayoutStates,
+    iPayCallbackStatus,
+)
 from payments.fixtures import payment_fixtures
-from payments.intergrations.ipay import iPayCard, iPayMPesa
+from payments.fixtures.ipay_stub import iPayStubServer
+from payments.intergrations.client import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ProviderClient,
+    RateLimiter,
+)
+from payments.intergrations.ipay import ipay_client, iPayCard, iPayMPesa
+from payments.models import (
+    Payment,
+    PaymentCallback,
+    PaymentStateTransition,
+    PaymentTransactionLogs,
+    Payout,
+)
+from payments.payouts import payout_runner
+from payments.routing import ProcessorRegistry, ProviderHealth, Route
+from payments.serilaizers import PaymentUpdateSerializer
+from payments.services import payment_service
+from payments.tasks import initiate_payment, process_payment_callbacks
+from tickets.models import TicketSalesRollup
 
 API_VER = settings.API_VERSION_STRING
 
@@ -45,6 +91,65 @@ class PaymentTestCase(TestCase):
         assert res.status_code == 200
         assert res.json()["person_id"] == str(self.owner.person.id)
 
+    @mock.patch("payments.services.initiate_payment.apply_async")
+    def test_create_payment__initiated_through_outbox(
+        self, mock_initiate: Mock, *args: Optional[Any]
+    ) -> None:
+        payment_data = payment_fixtures.payment_create_fixture(person=self.owner.person)
+
+        res = self.client.post(
+            f"/{API_VER}/payments/", data=payment_data, format="json"
+        )
+
+        assert res.status_code == 200
+        assert res.json()["state"] == PaymentStates.INITIATING.value
+        assert Payment.objects.get(id=res.json()["id"]).processor == "ipay_mpesa"
+        mock_initiate.assert_not_called()
+        assert relay_outbox() == 1
+        mock_initiate.assert_called_once()
+        assert mock_initiate.call_args.kwargs["args"] == [res.json()["id"]]
+
+        res = self.client.get(f"/{API_VER}/payments/{res.json()['id']}/")
+
+        assert res.status_code == 200
+        assert res.json()["state"] == PaymentStates.INITIATING.value
+
+    def test_initiate_payment_task(
+        self, mock_card: Mock, mock_mpesa: Mock, *args: Optional[Any]
+    ) -> None:
+        payment = payment_fixtures.create_payment_object(self.owner.person)
+        payment.state = PaymentStates.INITIATING.value
+        payment.save()
+
+        initiate_payment(str(payment.id))
+        # a redelivered task finds the payment claimed
+        initiate_payment(str(payment.id))
+
+        mock_mpesa.assert_called_once()
+        payment.refresh_from_db()
+        assert payment.state == PaymentStates.PENDING.value
+
+    def test_initiate_payment_task__provider_errors(
+        self, mock_card: Mock, mock_mpesa: Mock, *args: Optional[Any]
+    ) -> None:
+        payment = payment_fixtures.create_payment_object(self.owner.person)
+        payment.state = PaymentStates.INITIATING.value
+        payment.save()
+
+        # never reached the provider, handed back for the retry
+        mock_mpesa.side_effect = requests.ConnectionError
+        with self.assertRaises(requests.ConnectionError):
+            initiate_payment.run(str(payment.id))
+        payment.refresh_from_db()
+        assert payment.state == PaymentStates.INITIATING.value
+
+        # the push may have gone out, left for the callback
+        mock_mpesa.side_effect = requests.ReadTimeout
+        assert initiate_payment.run(str(payment.id)) == PaymentStates.PENDING.value
+        payment.refresh_from_db()
+        assert payment.state == PaymentStates.PENDING.value
+        assert mock_mpesa.call_count == 2
+
     def test_create_payment__inavlid_ticket_type(self, *args: Optional[Any]) -> None:
         payment_data = payment_fixtures.payment_create_fixture(
             person=self.owner.person,
@@ -57,6 +162,25 @@ class PaymentTestCase(TestCase):
 
         assert res.status_code == 400
 
+    def test_create_payment__invalid_quantity(self, *args: Optional[Any]) -> None:
+        ticket_type = event_fixtures.create_ticket_type_obj(owner=self.owner.person)
+        pre_create_amount = ticket_type.amount
+
+        for quantity in [-5, 0, "x"]:
+            payment_data = payment_fixtures.payment_create_fixture(
+                person=self.owner.person,
+                ticket_types=[{"id": str(ticket_type.id), "amount": quantity}],
+            )
+
+            res = self.client.post(
+                f"/{API_VER}/payments/", data=payment_data, format="json"
+            )
+
+            assert res.status_code == 400
+        ticket_type.refresh_from_db()
+        assert ticket_type.amount == pre_create_amount
+        assert not Payment.objects.exists()
+
     def test_list_payment_methods(self, *args: Optional[Any]) -> None:
         payment_method = payment_fixtures.create_payment_method_obj()
 
@@ -199,3 +323,662 @@ class PaymentTestCase(TestCase):
         )
         assert res.status_code == 200
         assert int(res.json()["amount"]) == 0
+
+    def test_checkout_query_count_independent_of_basket(
+        self, *args: Optional[Any]
+    ) -> None:
+        event = event_fixtures.create_event_object(self.owner.person)
+        ticket_types = [
+            event_fixtures.create_ticket_type_obj(event=event) for _ in range(5)
+        ]
+        query_counts = []
+        for basket in [ticket_types[:1], ticket_types]:
+            payment_data = payment_fixtures.payment_create_fixture(
+                person=self.owner.person,
+                ticket_types=[{"id": str(tt.id), "amount": 2} for tt in basket],
+            )
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(
+                    f"/{API_VER}/payments/", data=payment_data, format="json"
+                )
+            assert res.status_code == 200
+            query_counts.append(len(queries))
+            assert Ticket.objects.filter(
+                payment_id=res.json()["id"]
+            ).count() == 2 * len(basket)
+
+        assert query_counts[0] == query_counts[1]
+        for ticket_type in ticket_types:
+            ticket_type.refresh_from_db()
+        assert ticket_types[0].amount == 1200 - 4
+        assert ticket_types[4].amount == 1200 - 2
+
+
+class ProviderClientTestCase(TestCase):
+    def setUp(self) -> None:
+        self.stub = iPayStubServer(signing_key="stub-key").start()
+        self.addCleanup(self.stub.stop)
+        self.client = ProviderClient(
+            name="ipay-stub",
+            base_url=self.stub.url,
+            endpoints=ipay_client.endpoints,
+            backoff=0.01,
+            breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+        )
+
+    def test_c2b_receive_against_stub(self) -> None:
+        payment = payment_fixtures.create_payment_object(amount=100.0)
+        processor = iPayMPesa(client=self.client, signing_key="stub-key")
+
+        processor.c2b_receive(payment=payment)
+
+        payment.refresh_from_db()
+        assert [request["path"] for request in self.stub.requests] == [
+            "/payments/v2/transact",
+            "/payments/v2/transact/push/mpesa",
+        ]
+        assert PaymentTransactionLogs.objects.filter(
+            payment=payment, state=PaymentTransactionState.INITIATED.value
+        ).exists()
+        stats = self.client.stats()["endpoints"]
+        assert stats["initiate"]["count"] == 1
+        assert stats["mpesa_push"]["count"] == 1
+
+    def test_transaction_state_from_search(self) -> None:
+        payment = payment_fixtures.create_payment_object()
+        processor = iPayMPesa(client=self.client, signing_key="stub-key")
+
+        assert processor.get_transaction_state(payment=payment) is None
+        self.stub.search_status = iPayCallbackStatus.SUCCESS.value
+        assert processor.get_transaction_state(payment=payment) == (
+            PaymentStates.PAID.value
+        )
+
+    def test_gateway_errors_retried(self) -> None:
+        self.stub.fail_next = 2
+
+        res = self.client.post("initiate", data={"oid": "1"})
+
+        assert res.status_code == 200
+        assert len(self.stub.requests) == 3
+        assert self.client.stats()["endpoints"]["initiate"]["errors"] == {"HTTP_503": 2}
+        assert self.client.breaker.state == CircuitBreaker.CLOSED
+
+    def test_circuit_opens_after_failures(self) -> None:
+        self.client.retries = 0
+        self.stub.fail_next = 10
+
+        for _ in range(2):
+            assert self.client.post("initiate", data={}).status_code == 503
+        with self.assertRaises(CircuitOpenError):
+            self.client.post("initiate", data={})
+
+        assert len(self.stub.requests) == 2
+        assert self.client.breaker.state == CircuitBreaker.OPEN
+
+    def test_rate_limited_endpoint(self) -> None:
+        self.client.rate_limits = {"initiate": RateLimiter(rate=20, burst=1)}
+
+        started = time.monotonic()
+        for _ in range(3):
+            self.client.post("initiate", data={"oid": "1"})
+
+        assert time.monotonic() - started >= 0.09
+        assert len(self.stub.requests) == 3
+
+
+class PaymentCallbackTestCase(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient(False)
+        self.payment = payment_fixtures.create_payment_object()
+        self.payment.state = PaymentStates.PENDING.value
+        self.payment.save()
+
+    def test_callback_stored_once(self) -> None:
+        data = payment_fixtures.payment_callback_fixture(self.payment)
+
+        for _ in range(2):
+            res = self.client.post(f"/{API_VER}/payments/callback/", data=data)
+            assert res.status_code == 200
+
+        assert PaymentCallback.objects.filter(transaction_id=data["txncd"]).count() == 1
+        self.payment.refresh_from_db()
+        assert self.payment.state == PaymentStates.PENDING.value
+
+    def test_callback_query_string(self) -> None:
+        data = payment_fixtures.payment_callback_fixture(self.payment)
+
+        res = self.client.get(f"/{API_VER}/payments/callback/", data=data)
+
+        assert res.status_code == 200
+        assert PaymentCallback.objects.filter(payment_number=self.payment.number)
+
+    def test_callback_invalid_signature(self) -> None:
+        data = payment_fixtures.payment_callback_fixture(self.payment)
+        data["mc"] = "100000.0"
+
+        res = self.client.post(f"/{API_VER}/payments/callback/", data=data)
+
+        assert res.status_code == 403
+        assert not PaymentCallback.objects.exists()
+
+    @mock.patch("payments.services.send_payment_tickets.apply_async")
+    def test_callbacks_applied_in_batch(self, send_emails: Mock) -> None:
+        failed = payment_fixtures.create_payment_object()
+        for payment, status in (
+            (self.payment, iPayCallbackStatus.SUCCESS),
+            (failed, iPayCallbackStatus.FAILED),
+        ):
+            payment_service.ingest_callback(
+                payment_fixtures.payment_callback_fixture(payment, status)
+            )
+
+        assert process_payment_callbacks() == 2
+        relay_outbox()
+
+        self.payment.refresh_from_db()
+        failed.refresh_from_db()
+        assert self.payment.state == PaymentStates.PAID.value
+        assert self.payment.verified
+        assert self.payment.transaction_id == f"TXN{self.payment.number}"
+        assert failed.state == PaymentStates.FAILED.value
+        assert not PaymentCallback.objects.filter(processed=False).exists()
+        assert PaymentTransactionLogs.objects.filter(
+            payment=self.payment, state=PaymentTransactionState.SUCCEEDED.value
+        ).exists()
+        send_emails.assert_called_once()
+        assert send_emails.call_args.kwargs["args"] == [str(self.payment.id)]
+        assert list(
+            PaymentStateTransition.objects.filter(payment=failed).values_list(
+                "from_state", "to_state", "source"
+            )
+        ) == [(PaymentStates.PENDING.value, PaymentStates.FAILED.value, "callback")]
+
+    @mock.patch("payments.services.send_payment_tickets.apply_async")
+    def test_confirmed_payment_not_downgraded(self, send_emails: Mock) -> None:
+        Payment.objects.filter(pk=self.payment.pk).update(
+            state=PaymentStates.PAID.value
+        )
+        payment_service.ingest_callback(
+            payment_fixtures.payment_callback_fixture(
+                self.payment, iPayCallbackStatus.FAILED
+            )
+        )
+
+        process_payment_callbacks()
+        relay_outbox()
+
+        self.payment.refresh_from_db()
+        assert self.payment.state == PaymentStates.PAID.value
+        send_emails.assert_not_called()
+
+
+class BeatScheduleTestCase(TestCase):
+    def test_beat_entries_sent_to_consumed_queues(self) -> None:
+        with open(settings.BASE_DIR / "scripts" / "launch-celery.sh") as script:
+            match = re.search(r"worker .*-Q (\S+)", script.read())
+        assert match
+        consumed = set(match.group(1).split(","))
+
+        # callbacks, the sweeper and the flushes only run if a worker takes them
+        for name, entry in celery.conf.beat_schedule.items():
+            queue = entry.get("options", {}).get(
+                "queue", celery.conf.task_default_queue
+            )
+            assert queue in consumed, f"{name} is sent to {queue}"
+
+
+class PaymentSweepTestCase(TestCase):
+    def setUp(self) -> None:
+        self.ticket_type = event_fixtures.create_ticket_type_obj()
+        self.ticket_type.amount = 10
+        self.ticket_type.save()
+
+    def create_order(self, state: PaymentStates, minutes_ago: int) -> Payment:
+        payment = payment_fixtures.create_payment_object()
+        payment_service.issue_tickets(
+            payment,
+            {str(self.ticket_type.id): self.ticket_type},
+            {str(self.ticket_type.id): 2},
+        )
+        Payment.objects.filter(pk=payment.pk).update(
+            state=state.value,
+            created_at=datetime.now() - timedelta(minutes=minutes_ago),
+        )
+        payment.refresh_from_db()
+        return payment
+
+    @mock.patch.object(iPayMPesa, "get_transaction_state", return_value=None)
+    def test_expired_payments_voided(self, _: Mock) -> None:
+        expired = self.create_order(PaymentStates.PENDING, minutes_ago=90)
+        failed = self.create_order(PaymentStates.FAILED, minutes_ago=90)
+        recent = self.create_order(PaymentStates.PENDING, minutes_ago=1)
+        paid = self.create_order(PaymentStates.PAID, minutes_ago=90)
+
+        report = payment_service.sweep_expired(
+            expiry=timedelta(minutes=30), chunk_size=1
+        )
+
+        assert report == {
+            "voided": 2,
+            "confirmed": 0,
+            "reclaimed": {str(self.ticket_type.event_id): 4},
+        }
+        states = dict(Payment.objects.values_list("id", "state"))
+        assert states[expired.id] == PaymentStates.VOIDED.value
+        assert states[failed.id] == PaymentStates.VOIDED.value
+        assert states[recent.id] == PaymentStates.PENDING.value
+        assert states[paid.id] == PaymentStates.PAID.value
+        assert TicketType.objects.get(pk=self.ticket_type.pk).amount == 6
+        rollup = TicketSalesRollup.objects.get(ticket_type=self.ticket_type)
+        assert rollup.tickets == 4
+
+    @mock.patch("payments.services.send_payment_tickets.apply_async")
+    @mock.patch.object(iPayMPesa, "get_transaction_state")
+    def test_provider_confirmed_payments_kept(
+        self, get_transaction_state: Mock, send_emails: Mock
+    ) -> None:
+        payment = self.create_order(PaymentStates.PENDING, minutes_ago=90)
+        get_transaction_state.return_value = PaymentStates.PAID.value
+
+        # the provider is asked before voiding unless disabled
+        report = payment_service.sweep_expired(expiry=timedelta(minutes=30))
+        relay_outbox()
+
+        assert report["voided"] == 0 and report["confirmed"] == 1
+        payment.refresh_from_db()
+        assert payment.state == PaymentStates.PAID.value
+        assert TicketType.objects.get(pk=self.ticket_type.pk).amount == 8
+        send_emails.assert_called_once()
+
+    @mock.patch("payments.services.send_payment_tickets.apply_async")
+    def test_late_payment_reinstates_voided_order(self, send_emails: Mock) -> None:
+        payment = self.create_order(PaymentStates.PENDING, minutes_ago=90)
+        payment_service.sweep_expired(
+            expiry=timedelta(minutes=30), check_provider=False
+        )
+        payment_service.ingest_callback(
+            payment_fixtures.payment_callback_fixture(
+                payment, iPayCallbackStatus.SUCCESS
+            )
+        )
+
+        process_payment_callbacks()
+        relay_outbox()
+
+        payment.refresh_from_db()
+        assert payment.state == PaymentStates.PAID.value
+        assert not payment.refund_due
+        assert TicketType.objects.get(pk=self.ticket_type.pk).amount == 8
+        assert TicketSalesRollup.objects.get(ticket_type=self.ticket_type).tickets == 2
+        send_emails.assert_called_once()
+
+    @mock.patch("payments.services.send_payment_tickets.apply_async")
+    def test_late_payment_flagged_for_refund_when_sold_out(
+        self, send_emails: Mock
+    ) -> None:
+        payment = self.create_order(PaymentStates.PENDING, minutes_ago=90)
+        payment_service.sweep_expired(
+            expiry=timedelta(minutes=30), check_provider=False
+        )
+        TicketType.objects.filter(pk=self.ticket_type.pk).update(amount=1)
+        data = payment_fixtures.payment_callback_fixture(
+            payment, iPayCallbackStatus.SUCCESS
+        )
+        payment_service.ingest_callback(data)
+
+        process_payment_callbacks()
+        relay_outbox()
+
+        payment.refresh_from_db()
+        assert payment.state == PaymentStates.VOIDED.value
+        assert payment.refund_due
+        assert PaymentCallback.objects.get(transaction_id=data["txncd"]).rejected
+        assert PaymentTransactionLogs.objects.filter(
+            payment=payment, state=PaymentTransactionState.FAILED.value
+        ).exists()
+        assert TicketType.objects.get(pk=self.ticket_type.pk).amount == 1
+        send_emails.assert_not_called()
+
+
+class IdempotencyTestCase(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient(False)
+        self.store = IdempotencyStore(
+            redis_client, f"test_idempotency:{uuid.uuid4()}", ttl=60, wait_timeout=5
+        )
+
+    def tearDown(self) -> None:
+        for key in redis_client.scan_iter(f"{self.store.key}:*"):
+            redis_client.delete(key)
+
+    @mock.patch("payments.services.initiate_payment.apply_async")
+    def test_checkout_replayed(self, *args: Any) -> None:
+        payment_data = payment_fixtures.payment_create_fixture()
+        headers = {"HTTP_IDEMPOTENCY_KEY": str(uuid.uuid4())}
+
+        with mock.patch("core.idempotency.idempotency_store", self.store):
+            first = self.client.post(
+                f"/{API_VER}/payments/", data=payment_data, format="json", **headers
+            )
+            replay = self.client.post(
+                f"/{API_VER}/payments/", data=payment_data, format="json", **headers
+            )
+            payment_data["ticket_types"][0]["amount"] += 1
+            reused = self.client.post(
+                f"/{API_VER}/payments/", data=payment_data, format="json", **headers
+            )
+
+        assert first.status_code == 200
+        assert replay.status_code == 200
+        assert replay.json() == first.json()
+        assert replay.headers[REPLAYED_HEADER] == "true"
+        assert reused.status_code == 422
+        assert Payment.objects.count() == 1
+
+    def test_in_flight_duplicates_wait(self) -> None:
+        calls = []
+
+        def handler() -> Tuple[int, Any]:
+            calls.append(1)
+            time.sleep(0.3)
+            return 201, {"id": len(calls)}
+
+        def run(_: int) -> StoredResponse:
+            return self.store.run("test", "key", "fingerprint", handler)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            responses = list(executor.map(run, range(4)))
+
+        assert len(calls) == 1
+        assert {response.body["id"] for response in responses} == {1}
+        assert sum(not response.replayed for response in responses) == 1
+
+    def test_response_returned_when_it_cant_be_stored(self) -> None:
+        set_key = redis_client.set
+
+        def set_unless_response(key: str, *args: Any, **kwargs: Any) -> Any:
+            if not key.endswith(":in_flight"):
+                raise redis.ConnectionError()
+            return set_key(key, *args, **kwargs)
+
+        with mock.patch.object(redis_client, "set", side_effect=set_unless_response):
+            stored = self.store.run("test", "key", "fingerprint", lambda: (201, {}))
+
+        assert (stored.status, stored.replayed) == (201, False)
+        assert not list(redis_client.scan_iter(f"{self.store.key}:*"))
+
+    def test_server_errors_not_stored(self) -> None:
+        statuses = iter([503, 200])
+
+        def handler() -> Tuple[int, Any]:
+            return next(statuses), {}
+
+        assert self.store.run("test", "key", "fingerprint", handler).status == 503
+        assert self.store.run("test", "key", "fingerprint", handler).status == 200
+        assert self.store.run("test", "key", "fingerprint", handler).replayed
+
+
+@mock.patch("payments.services.send_payment_tickets.apply_async")
+class PaymentStateTransitionTestCase(TestCase):
+    def setUp(self) -> None:
+        self.payment = payment_fixtures.create_payment_object()
+
+    def update_state(self, state: PaymentStates) -> Payment:
+        return payment_service.update(
+            obj_data={"state": state.value},
+            serializer=PaymentUpdateSerializer,
+            obj_id=str(self.payment.id),
+        )
+
+    def test_tickets_sent_once_on_confirmation(self, send_tickets: Mock) -> None:
+        for _ in range(3):
+            payment = self.update_state(PaymentStates.PAID)
+        relay_outbox()
+
+        assert payment.state == PaymentStates.PAID.value
+        assert payment.verified
+        send_tickets.assert_called_once_with(
+            args=[str(self.payment.id)],
+            kwargs={},
+            queue=settings.CELERY_NOTIFICATIONS_QUEUE,
+        )
+        assert list(self.payment.transitions.values_list("from_state", "to_state")) == [
+            (PaymentStates.PENDING.value, PaymentStates.PAID.value)
+        ]
+
+    def test_disallowed_transition_ignored(self, send_tickets: Mock) -> None:
+        self.update_state(PaymentStates.PAID)
+
+        payment = self.update_state(PaymentStates.PENDING)
+
+        assert payment.state == PaymentStates.PAID.value
+        assert self.payment.transitions.count() == 1
+
+    def test_unknown_state_rejected(self, send_tickets: Mock) -> None:
+        with self.assertRaises(ObjectInvalidException):
+            payment_service.transition(str(self.payment.id), "REFUNDED", source="test")
+
+
+class PayoutTestCase(TestCase):
+    def setUp(self) -> None:
+        self.stub = iPayStubServer(signing_key="stub-key").start()
+        self.addCleanup(self.stub.stop)
+        client = ProviderClient(
+            name="ipay-stub",
+            base_url=self.stub.url,
+            endpoints=ipay_client.endpoints,
+            backoff=0,
+        )
+        processors = mock.patch.object(
+            payment_processor_registry,
+            "get",
+            return_value=Route(
+                name="ipay_stub",
+                method=PaymentProviders.MPESA.value,
+                processor=iPayMPesa(client=client, signing_key="stub-key"),
+                client=client,
+                endpoints=("b2b_mpesa",),
+            ),
+        )
+        processors.start()
+        self.addCleanup(processors.stop)
+
+        self.partner = partner_fixtures.create_partner_obj()
+        partner_ledger.post(
+            str(self.partner.id),
+            [
+                (LedgerEntryType.SALE.value, 1000.0, "sale"),
+                (LedgerEntryType.COMMISSION.value, -30.0, "sale"),
+            ],
+        )
+        partner_ledger.post(
+            str(partner_fixtures.create_partner_obj().id),
+            [(LedgerEntryType.SMS.value, -20.0, None)],
+        )
+        self.run = self.create_run()
+        self.batch = payout_runner.create_batch(str(self.run.id))
+
+    def create_run(self) -> ReconciliationRun:
+        return ReconciliationRun.objects.create(
+            watermark=datetime.now(), completed_at=datetime.now()
+        )
+
+    def test_partners_in_credit_paid_once(self) -> None:
+        payout = Payout.objects.get(batch=self.batch)
+        assert payout.partner == self.partner
+        assert payout.amount == 970.0
+
+        assert payout_runner.run(str(self.batch.id)) == {PayoutStates.SENT.value: 1}
+        assert payout_runner.run(str(self.batch.id)) == {}
+        assert payout_runner.create_batch(str(self.run.id)) == self.batch
+        # the next run only pays what was earned since
+        assert not payout_runner.create_batch(
+            str(self.create_run().id)
+        ).payouts.exists()
+
+        payout.refresh_from_db()
+        self.batch.refresh_from_db()
+        assert payout.state == PayoutStates.SENT.value
+        assert self.batch.completed_at
+        assert [request["path"] for request in self.stub.requests] == [
+            "/b2b/v1/external/mpesa"
+        ]
+        assert self.stub.requests[0]["form"]["reference"] == str(payout.id)
+        assert partner_ledger.balance(str(self.partner.id)).payouts == payout.amount
+
+    def test_declined_payout_resent(self) -> None:
+        self.stub.transfer_status = 0
+        assert payout_runner.run(str(self.batch.id)) == {PayoutStates.FAILED.value: 1}
+
+        self.stub.transfer_status = 1
+        assert payout_runner.run(str(self.batch.id)) == {PayoutStates.SENT.value: 1}
+        assert Payout.objects.get(batch=self.batch).attempts == 2
+
+    def test_gateway_error_not_retried(self) -> None:
+        self.stub.fail_next = 1
+        self.stub.fail_status = 504
+
+        assert payout_runner.run(str(self.batch.id)) == {PayoutStates.SENDING.value: 1}
+        assert len(self.stub.requests) == 1
+
+    def test_unknown_outcome_not_resent(self) -> None:
+        self.stub.fail_next = 1
+        self.stub.fail_status = 500
+
+        assert payout_runner.run(str(self.batch.id)) == {PayoutStates.SENDING.value: 1}
+        assert payout_runner.run(str(self.batch.id)) == {}
+        assert len(self.stub.requests) == 1
+        assert partner_ledger.balance(str(self.partner.id)).payouts == 0
+        # a payout that may have gone out isn't paid again by the next run
+        assert not payout_runner.create_batch(
+            str(self.create_run().id)
+        ).payouts.exists()
+
+
+class ProcessorRegistryTestCase(TestCase):
+    def setUp(self) -> None:
+        self.stub = iPayStubServer(signing_key="stub-key").start()
+        self.addCleanup(self.stub.stop)
+        self.health = ProviderHealth(
+            redis_client, f"test_payment_health_{uuid.uuid4().hex}", window=60
+        )
+        self.addCleanup(
+            lambda: [
+                redis_client.delete(key)
+                for key in redis_client.scan_iter(f"{self.health.key}:*")
+            ]
+        )
+        self.registry = ProcessorRegistry(
+            self.health, max_error_rate=0.5, max_p95_ms=1000, min_calls=4
+        )
+        self.primary, self.fallback = [
+            ProviderClient(
+                name=name,
+                base_url=self.stub.url,
+                endpoints=ipay_client.endpoints,
+                retries=0,
+                breaker=CircuitBreaker(failure_threshold=10, reset_timeout=60),
+            )
+            for name in ("primary", "fallback")
+        ]
+        for client in (self.primary, self.fallback):
+            self.registry.register(
+                Route(
+                    name=client.name,
+                    method=PaymentProviders.MPESA.value,
+                    processor=iPayMPesa(client=client, signing_key="stub-key"),
+                    client=client,
+                    endpoints=("initiate",),
+                )
+            )
+
+    def test_preferred_route(self) -> None:
+        assert self.registry.route(PaymentProviders.MPESA.value).name == "primary"
+        with self.assertRaises(HttpErrorException) as raised:
+            self.registry.route(PaymentProviders.BANK.value)
+        assert raised.exception.code == ErrorCodes.PROVIDER_NOT_SUPPORTED
+
+    def test_fails_over_on_errors(self) -> None:
+        self.stub.fail_next = 4
+        for _ in range(4):
+            self.primary.post("initiate", data={"oid": "1"})
+
+        health = self.registry.route_health(self.registry.get("MPESA", "primary"))
+        assert health["endpoints"]["initiate"]["calls"] == 4
+        assert health["endpoints"]["initiate"]["error_rate"] == 1.0
+        assert not health["healthy"]
+        assert self.registry.route(PaymentProviders.MPESA.value).name == "fallback"
+
+    def test_fails_over_when_slow(self) -> None:
+        for _ in range(4):
+            self.health.observe("primary", "initiate", 2000, None)
+
+        assert self.registry.report()[0]["endpoints"]["initiate"]["p95_ms"] == 2500
+        assert self.registry.route(PaymentProviders.MPESA.value).name == "fallback"
+
+    def test_open_circuit_and_no_healthy_route(self) -> None:
+        self.primary.breaker.failures = 10
+        self.primary.breaker.record_failure()
+        assert self.registry.route(PaymentProviders.MPESA.value).name == "fallback"
+
+        for _ in range(4):
+            self.health.observe("fallback", "initiate", 10, "ConnectionError")
+        # one checkout goes through as a probe, the rest are refused
+        assert self.registry.route(PaymentProviders.MPESA.value).name == "fallback"
+        with self.assertRaises(HttpErrorException) as raised:
+            self.registry.route(PaymentProviders.MPESA.value)
+        assert raised.exception.status_code == 503
+        assert raised.exception.code == ErrorCodes.PROVIDER_UNAVAILABLE
+
+    def test_successful_probe_restores_route(self) -> None:
+        self.primary.breaker.failures = 10
+        self.primary.breaker.record_failure()
+        for _ in range(4):
+            self.health.observe("fallback", "initiate", 10, "ConnectionError")
+        self.registry.route(PaymentProviders.MPESA.value)
+
+        self.health.observe("fallback", "initiate", 10, None)
+
+        for _ in range(3):
+            route = self.registry.route(PaymentProviders.MPESA.value)
+            assert route.name == "fallback"
+        health = self.registry.route_health(route)
+        assert not health["healthy"] and health["recovering"]
+
+    def test_payout_circuit_kept_apart(self) -> None:
+        client = ProviderClient(
+            name="payouts",
+            base_url=self.stub.url,
+            endpoints=ipay_client.endpoints,
+            breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60),
+            breakers={"b2b_mpesa": CircuitBreaker(failure_threshold=1)},
+        )
+        route = self.registry.register(
+            Route(
+                name="payouts",
+                method=PaymentProviders.BANK.value,
+                processor=iPayCard(client=client, signing_key="stub-key"),
+                client=client,
+                endpoints=("initiate",),
+            )
+        )
+        self.stub.fail_next = 1
+        self.stub.fail_status = 500
+        client.post("b2b_mpesa", data={"reference": "1"})
+
+        assert client.breaker_for("b2b_mpesa").state == CircuitBreaker.OPEN
+        assert self.registry.route_health(route)["circuit"] == CircuitBreaker.CLOSED
+        assert self.registry.route(PaymentProviders.BANK.value) == route
+
+    def test_health_endpoint(self) -> None:
+        client = APIClient()
+        assert client.get(f"/{API_VER}/payments/health/").status_code == 403
+
+        client.force_authenticate(
+            User.objects.create_user(username=random_string(), is_staff=True)
+        )
+        res = client.get(f"/{API_VER}/payments/health/")
+
+        assert res.status_code == 200
+        assert {route["name"] for route in res.json()} == {"ipay_mpesa", "ipay_card"}
@@ -1,13 +1,22 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 
-from payments.views import PaymentsViewSet, fund_sms_package, list_payment_methods
+from payments.views import (
+    PaymentsViewSet,
+    fund_sms_package,
+    list_payment_methods,
+    payment_callback,
+    payment_processor_health,
+)
 
 router = DefaultRouter()
 
 router.register("", viewset=PaymentsViewSet, basename="paymets")
 
-urlpatterns = router.urls + [
+# explicit paths go first so the viewset's detail route doesn't shadow them
+urlpatterns = [
     path("methods/", list_payment_methods, name="list_payment_methods"),
     path("fund/sms/package/", fund_sms_package, name="fund_sms_package"),
-]
+    path("callback/", payment_callback, name="payment_callback"),
+    path("health/", payment_processor_health, name="payment_processor_health"),
+] + router.urls
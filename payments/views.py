@@ -1,16 +1,22 @@
+from http import HTTPStatus
+
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import IsAdminUser
 from rest_framework.request import Request
 from rest_framework.response import Response
 
+from core.error_codes import ErrorCodes
+from core.exceptions import HttpErrorException
+from core.idempotency import idempotent
 from core.views import AbstractPermissionedView
 from partner.permissions import PartnerOwnerPermissions
 from partner.serializers import PartnerSMSPackageReadSerializer
 from partner.utils import get_request_membership_or_ownership
+from payments.configs import payment_processor_registry
 from payments.serilaizers import (
     PaymentCreateSerializer,
-    PaymentCreateSerializerInner,
     PaymentMethodSerialzier,
     PaymentReadSerializer,
     SMSPaymentCreateSerializer,
@@ -29,6 +35,22 @@ def list_payment_methods(request: Request) -> Response:
     return Response(PaymentMethodSerialzier(methods, many=True).data)
 
 
+@swagger_auto_schema(method="GET", responses={200: "Health of each payment processor"})
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def payment_processor_health(request: Request) -> Response:
+    return Response(payment_processor_registry.report())
+
+
+@swagger_auto_schema(methods=["GET", "POST"], responses={200: "Callback received"})
+@api_view(["GET", "POST"])
+def payment_callback(request: Request) -> Response:
+    # iPay redirects with the result in the query string, other flows post it
+    data = request.query_params if request.method == "GET" else request.data
+    payment_service.ingest_callback(data.dict() if hasattr(data, "dict") else data)
+    return Response({"received": True})
+
+
 @swagger_auto_schema(
     method="post",
     request_body=SMSPaymentCreateSerializer,
@@ -52,9 +74,18 @@ class PaymentsViewSet(AbstractPermissionedView):
     @swagger_auto_schema(
         request_body=PaymentCreateSerializer, responses={200: PaymentReadSerializer}
     )
+    @idempotent("payments.checkout")
     def create(self, request: Request) -> Response:
-        obj_data = payment_service.validate_ticket_types_and_person(request.data)
-        payment = payment_service.create(
-            obj_data=obj_data, serializer=PaymentCreateSerializerInner
-        )
+        order = PaymentCreateSerializer(data=request.data)
+        order.is_valid(raise_exception=True)
+        payment = payment_service.checkout(order.validated_data)
+        return Response(PaymentReadSerializer(payment).data)
+
+    @swagger_auto_schema(responses={200: PaymentReadSerializer})
+    def retrieve(self, request: Request, pk: str) -> Response:
+        payment = payment_service.get(pk=pk)
+        if not payment:
+            raise HttpErrorException(
+                status_code=HTTPStatus.NOT_FOUND, code=ErrorCodes.INVALID_PAYMENT_ID
+            )
         return Response(PaymentReadSerializer(payment).data)
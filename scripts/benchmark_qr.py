@@ -0,0 +1,38 @@
+"""
+Compare the cost of rendering ticket QR codes as PNG and inline SVG, with
+and without the render cache.
+
+    python scripts/benchmark_qr.py [iterations]
+"""
+import hashlib
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tickets.qr import QRFormat, render_qr  # noqa: E402
+
+
+def main(iterations: int) -> None:
+    hashes = [
+        hashlib.md5(str(i).encode("UTF-8")).hexdigest() for i in range(iterations)
+    ]
+    for qr_format in QRFormat:
+        uncached = timeit.timeit(
+            lambda: [render_qr.__wrapped__(h, qr_format) for h in hashes], number=1
+        )
+        render_qr.cache_clear()
+        [render_qr(h, qr_format) for h in hashes]
+        cached = timeit.timeit(
+            lambda: [render_qr(h, qr_format) for h in hashes], number=1
+        )
+        size = len(render_qr(hashes[0], qr_format))
+        print(
+            f"{qr_format.value}: {uncached / iterations * 1000:.3f}ms/render, "
+            f"{cached / iterations * 1000000:.3f}us/cached render, {size} bytes"
+        )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
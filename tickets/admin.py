@@ -2,6 +2,7 @@ from typing import Any, Sequence
 
 from django.contrib import admin
 
+from core.outbox import enqueue
 from eticketing_api import settings
 from notifications.tasks import send_ticket_email
 from tickets.models import Ticket, TicketScan
@@ -10,7 +11,8 @@ from tickets.models import Ticket, TicketScan
 @admin.action(description="Send Ticket(s)")
 def send_tickets_manual(modeladmin: Any, r: Any, tickets: Sequence[Ticket]) -> Any:
     for ticket in tickets:
-        send_ticket_email.apply_async(
+        enqueue(
+            send_ticket_email,
             args=(ticket.id,),
             queue=settings.CELERY_NOTIFICATIONS_QUEUE,
         )
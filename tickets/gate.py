@@ -0,0 +1,238 @@
+import json
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import redis
+from django.db import connection
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.redis import redis_client
+from eticketing_api import settings
+from events.models import TicketType
+from payments.constants import PaymentStates
+from tickets.models import Ticket
+from tickets.serializers import TicketReadSerializer
+
+# Returns {remaining, uses, ticket_id} after consuming a use, {-1} when the
+# ticket isn't loaded and {-2} when it has no uses left
+ADMIT_SCRIPT = """
+local remaining = redis.call('HGET', KEYS[1], ARGV[1])
+if not remaining then
+    return {-1}
+end
+if tonumber(remaining) <= 0 then
+    return {-2}
+end
+remaining = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+local uses = redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+local ticket_id = redis.call('HGET', KEYS[3], ARGV[1])
+redis.call('HSET', KEYS[4], ticket_id, uses)
+return {remaining, uses, ticket_id}
+"""
+
+# Merges a ticket's uses counted elsewhere into the event's counts, the
+# lower remaining and higher uses win. Tickets that aren't loaded are only
+# added when ARGV[4] is 1
+SYNC_SCRIPT = """
+local remaining = redis.call('HGET', KEYS[1], ARGV[1])
+if not remaining and ARGV[4] ~= '1' then
+    return 0
+end
+if not remaining or tonumber(remaining) > tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+end
+local uses = redis.call('HGET', KEYS[2], ARGV[1])
+if not uses or tonumber(uses) < tonumber(ARGV[3]) then
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[3])
+end
+return 1
+"""
+
+CLAIM_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 and redis.call('EXISTS', KEYS[2]) == 0 then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+end
+return 1
+"""
+
+GATE_NOT_LOADED = -1
+GATE_USED_UP = -2
+
+
+class GateValidator:
+    """
+    Per event validation state for gate scans held in redis.
+
+    Loading an event stores the remaining uses of each of its paid tickets
+    keyed by ticket hash, along with the ticket as read by the gates.
+    Admitting a ticket decrements that count in a single script so two
+    gates scanning the same code can't both let it through, and marks the
+    ticket for write back to ``Ticket.uses``. Tickets that aren't loaded
+    are left to the database, uses counted there are merged back in when
+    the event is reloaded.
+    """
+
+    def __init__(self, client: redis.Redis, key: str, ttl: int, lock_timeout: int = 60):
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+        self.pending_key = f"{key}:pending"
+        self.processing_key = f"{key}:processing"
+        self.lock_key = f"{key}:flush_lock"
+        self.lock_timeout = lock_timeout
+        self._admit = client.register_script(ADMIT_SCRIPT)
+        self._claim = client.register_script(CLAIM_SCRIPT)
+        self._sync = client.register_script(SYNC_SCRIPT)
+
+    def _event_keys(self, event_id: str) -> List[str]:
+        return [
+            f"{self.key}:event:{event_id}:remaining",
+            f"{self.key}:event:{event_id}:uses",
+            f"{self.key}:event:{event_id}:tickets",
+        ]
+
+    def _ticket_key(self, ticket_id: str) -> str:
+        return f"{self.key}:ticket:{ticket_id}"
+
+    def load_event(self, event_id: str, chunk_size: int = 1000) -> int:
+        """
+        Load the event's paid tickets. Tickets already loaded keep their
+        live counts so the event can be reloaded to pick up new sales,
+        unless the database has counted more uses, e.g. while redis was
+        unreachable
+        """
+        remaining_key, uses_key, tickets_key = self._event_keys(event_id)
+        tickets = (
+            Ticket.objects.filter(
+                ticket_type__event_id=event_id,
+                payment__state=PaymentStates.PAID.value,
+                hash__isnull=False,
+            )
+            .select_related("payment__person", "ticket_type__event")
+            .iterator(chunk_size=chunk_size)
+        )
+        loaded = 0
+        pipe = self.client.pipeline(transaction=False)
+        for ticket in tickets:
+            ticket_id, ticket_hash = str(ticket.id), ticket.hash
+            self._sync(
+                keys=[remaining_key, uses_key],
+                args=[
+                    ticket_hash,
+                    max(ticket.ticket_type.use_limit - ticket.uses, 0),
+                    ticket.uses,
+                    1,
+                ],
+                client=pipe,
+            )
+            pipe.hset(tickets_key, ticket_hash, ticket_id)
+            pipe.set(
+                self._ticket_key(ticket_id),
+                json.dumps(
+                    {
+                        "event_id": event_id,
+                        "hash": ticket_hash,
+                        "ticket": TicketReadSerializer(ticket).data,
+                    },
+                    cls=JSONEncoder,
+                ),
+                ex=self.ttl,
+            )
+            loaded += 1
+            if loaded % chunk_size == 0:
+                pipe.execute()
+        for key in self._event_keys(event_id):
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+        return loaded
+
+    def sync_uses(
+        self, event_id: str, ticket_hash: str, uses: int, use_limit: int
+    ) -> bool:
+        """
+        Merge uses counted in the database into a loaded ticket's counts so
+        the gates don't admit it again, returns whether it was loaded
+        """
+        remaining_key, uses_key, _ = self._event_keys(event_id)
+        return bool(
+            self._sync(
+                keys=[remaining_key, uses_key],
+                args=[ticket_hash, max(use_limit - uses, 0), uses, 0],
+            )
+        )
+
+    def admit(self, event_id: str, ticket_hash: str) -> Tuple[int, Optional[int]]:
+        """
+        Consume a use of the ticket, returns the remaining uses and the
+        ticket's total uses or one of GATE_NOT_LOADED/GATE_USED_UP
+        """
+        result = self._admit(
+            keys=self._event_keys(event_id) + [self.pending_key], args=[ticket_hash]
+        )
+        if result[0] < 0:
+            return result[0], None
+        return int(result[0]), int(result[1])
+
+    def admit_ticket(
+        self, ticket_id: str
+    ) -> Tuple[int, Optional[int], Optional[Dict[str, Any]]]:
+        """
+        Consume a use of the ticket by id, also returns the ticket as it was
+        read when its event was loaded
+        """
+        loaded = self.client.get(self._ticket_key(ticket_id))
+        if not loaded:
+            return GATE_NOT_LOADED, None, None
+        gate_ticket = json.loads(loaded)
+        remaining, uses = self.admit(gate_ticket["event_id"], gate_ticket["hash"])
+        return remaining, uses, gate_ticket["ticket"]
+
+    def flush(self) -> int:
+        """
+        Write consumed uses back to the tickets. Uses are written as totals
+        so a batch that is retried after a failure doesn't double count
+        """
+        lock = self.client.lock(
+            self.lock_key, timeout=self.lock_timeout, blocking_timeout=self.lock_timeout
+        )
+        if not lock.acquire():
+            return 0
+        try:
+            self._claim(keys=[self.pending_key, self.processing_key])
+            batch: Dict[str, str] = self.client.hgetall(self.processing_key)
+            if batch:
+                self._write_uses(
+                    (ticket_id, int(uses)) for ticket_id, uses in batch.items()
+                )
+                self.client.delete(self.processing_key)
+            return len(batch)
+        finally:
+            lock.release()
+
+    def _write_uses(
+        self, uses: Iterable[Tuple[str, int]], chunk_size: int = 500
+    ) -> None:
+        rows = list(uses)
+        ticket_table = Ticket._meta.db_table
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), chunk_size):
+                end = start + chunk_size
+                chunk = rows[start:end]
+                values = ", ".join(["(%s::uuid, %s::integer)"] * len(chunk))
+                cursor.execute(
+                    f"""
+                    UPDATE {ticket_table} ticket
+                    SET uses = GREATEST(ticket.uses, gate.uses),
+                        redeemed = GREATEST(ticket.uses, gate.uses)
+                            >= ticket_type.use_limit
+                    FROM (VALUES {values}) AS gate (id, uses),
+                        {TicketType._meta.db_table} ticket_type
+                    WHERE ticket.id = gate.id
+                        AND ticket_type.id = ticket.ticket_type_id
+                    """,
+                    [param for row in chunk for param in row],
+                )
+
+
+gate_validator = GateValidator(
+    redis_client, settings.GATE_KEY, ttl=settings.GATE_KEY_TTL_SECONDS
+)
@@ -0,0 +1,22 @@
+from datetime import datetime
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from tickets.services import ticket_service
+
+
+class Command(BaseCommand):
+    help = "Rebuild hourly ticket sales rollups from issued tickets"
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--since",
+            type=datetime.fromisoformat,
+            default=None,
+            help="only rebuild buckets from this ISO date/time onwards",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        rebuilt = ticket_service.rebuild_sales_rollups(since=options["since"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} sales rollups"))
@@ -1 +1 @@
-from events.models import Ticket, TicketScan  # noqa
+from events.models import Ticket, TicketSalesRollup, TicketScan  # noqa
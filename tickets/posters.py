@@ -0,0 +1,169 @@
+import base64
+import hashlib
+import json
+import os
+import time
+from tempfile import mkstemp
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from eticketing_api import settings
+
+
+class PosterCache:
+    """
+    Worker local, content addressed cache for event posters.
+
+    Poster bytes are stored once under ``blobs/<sha256>`` regardless of how
+    many urls point at them, ``index/<sha1(url)>.json`` maps a url to its blob
+    and the ETag it was served with. Blobs are evicted least recently used
+    first once the cache grows past ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        *,
+        root: str,
+        max_bytes: int,
+        revalidate_after: int,
+        timeout: Tuple[float, float],
+        pool_size: int = 16,
+    ) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "blobs", digest)
+
+    def _index_path(self, url: str) -> str:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, "index", f"{key}.json")
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = mkstemp(dir=directory)
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+
+    def _read_index(self, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._index_path(url), "r") as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_index(self, url: str, entry: Dict[str, Any]) -> None:
+        self._write_atomic(self._index_path(url), json.dumps(entry).encode("utf-8"))
+
+    def _read_blob(self, digest: str) -> Optional[bytes]:
+        path = self._blob_path(digest)
+        try:
+            with open(path, "rb") as blob_file:
+                content = blob_file.read()
+        except OSError:
+            return None
+        # mtime doubles as the last access time for LRU eviction
+        os.utime(path, None)
+        return content
+
+    def _store_blob(self, content: bytes) -> str:
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            os.utime(path, None)
+        else:
+            self._write_atomic(path, content)
+            self.evict()
+        return digest
+
+    def evict(self) -> int:
+        blobs_dir = os.path.join(self.root, "blobs")
+        try:
+            entries = [entry for entry in os.scandir(blobs_dir) if entry.is_file()]
+        except OSError:
+            return 0
+        stats = [(entry.path, entry.stat()) for entry in entries]
+        total = sum(stat.st_size for _, stat in stats)
+        evicted = 0
+        for path, stat in sorted(stats, key=lambda item: item[1].st_mtime):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= stat.st_size
+            evicted += 1
+        return evicted
+
+    def get(self, url: str) -> bytes:
+        entry = self._read_index(url)
+        cached = self._read_blob(entry["digest"]) if entry else None
+        if cached is not None and entry:
+            if time.time() - entry["validated_at"] < self.revalidate_after:
+                return cached
+
+        headers = {}
+        if cached is not None and entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        try:
+            res = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            # a stale poster beats failing the whole ticket render
+            if cached is not None:
+                return cached
+            raise
+
+        if res.status_code == 304 and cached is not None and entry:
+            entry["validated_at"] = time.time()
+            self._write_index(url, entry)
+            return cached
+        if res.status_code >= 300:
+            if cached is not None:
+                return cached
+            # an error page must never be embedded in a ticket as the poster
+            raise requests.HTTPError(
+                f"Poster fetch failed with status {res.status_code}", response=res
+            )
+
+        digest = self._store_blob(res.content)
+        self._write_index(
+            url,
+            {
+                "digest": digest,
+                "etag": res.headers.get("ETag"),
+                "validated_at": time.time(),
+            },
+        )
+        return res.content
+
+    def get_base64(self, url: str) -> str:
+        return base64.b64encode(self.get(url)).decode("utf-8")
+
+    def prefetch(self, urls: Iterable[str]) -> int:
+        fetched = 0
+        for url in urls:
+            try:
+                self.get(url)
+                fetched += 1
+            except requests.RequestException:
+                continue
+        return fetched
+
+
+poster_cache = PosterCache(
+    root=settings.POSTER_CACHE_DIR,
+    max_bytes=settings.POSTER_CACHE_MAX_BYTES,
+    revalidate_after=settings.POSTER_CACHE_REVALIDATE_SECONDS,
+    timeout=settings.POSTER_FETCH_TIMEOUT,
+)
@@ -0,0 +1,32 @@
+import base64
+from enum import Enum
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+from qrcode.image.svg import SvgPathImage
+
+# Ticket hashes are immutable once issued so a rendered code can be reused
+# for every resend of the same ticket
+QR_CACHE_SIZE = 4096
+
+
+class QRFormat(str, Enum):
+    PNG = "PNG"
+    SVG = "SVG"
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr(data: str, qr_format: QRFormat = QRFormat.PNG) -> str:
+    """
+    Render ``data`` as a base64 encoded PNG or as an inline SVG document
+    """
+    qr = qrcode.QRCode()
+    qr.add_data(data)
+    if qr_format == QRFormat.SVG:
+        return qr.make_image(image_factory=SvgPathImage).to_string(encoding="unicode")
+
+    image = qr.make_image(fill="black")
+    buffer: BytesIO = BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
@@ -0,0 +1,199 @@
+from datetime import datetime
+from functools import reduce
+from operator import or_
+from typing import Dict, Iterable, Optional, Tuple
+
+import redis
+from django.db import transaction
+from django.db.models import Q
+
+from core.redis import redis_client
+from eticketing_api import settings
+from partner.models import PartnerPerson
+from tickets.models import Ticket, TicketScan
+
+ScanKey = Tuple[str, str]
+
+# Moves the live buffers aside for flushing unless a previous flush
+# left its batch behind, in which case that batch is retried first
+CLAIM_BATCH_SCRIPT = """
+for i = 1, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i]) == 1 and redis.call('EXISTS', KEYS[i + 1]) == 0 then
+        redis.call('RENAME', KEYS[i], KEYS[i + 1])
+    end
+end
+return 1
+"""
+
+
+class ScanBuffer:
+    """
+    Write-behind buffer for ticket scan audit records.
+
+    Scans are kept in a redis hash keyed by ``<agent_id>:<ticket_id>`` so
+    repeat scans of a ticket by the same agent collapse into one record,
+    redemptions are kept in a set with the same keys. A periodic flush
+    writes both to ``TicketScan`` in bulk. Batches are only dropped from
+    redis once written, so a failed flush is retried and the writes skip
+    records that already made it to the database.
+    """
+
+    def __init__(self, client: redis.Redis, key: str, lock_timeout: int = 60):
+        self.client = client
+        self.pending_key = f"{key}:pending"
+        self.redeemed_key = f"{key}:redeemed"
+        self.processing_key = f"{key}:processing"
+        self.processing_redeemed_key = f"{key}:processing_redeemed"
+        self.lock_key = f"{key}:flush_lock"
+        self.lock_timeout = lock_timeout
+        self._claim_batch = client.register_script(CLAIM_BATCH_SCRIPT)
+
+    @staticmethod
+    def _field(agent_id: str, ticket_id: str) -> str:
+        return f"{agent_id}:{ticket_id}"
+
+    @staticmethod
+    def _split(field: str) -> ScanKey:
+        agent_id, ticket_id = field.split(":", 1)
+        return agent_id, ticket_id
+
+    def record(self, agent_id: str, ticket_id: str) -> None:
+        scanned_at = datetime.now()
+        try:
+            self.client.hsetnx(
+                self.pending_key,
+                self._field(agent_id, ticket_id),
+                scanned_at.isoformat(),
+            )
+        except redis.RedisError:
+            self._write({(agent_id, ticket_id): scanned_at}, [])
+
+    def mark_redeemed(self, agent_id: str, ticket_id: str) -> None:
+        try:
+            self.client.sadd(self.redeemed_key, self._field(agent_id, ticket_id))
+        except redis.RedisError:
+            self._write({}, [(agent_id, ticket_id)])
+
+    def flush(self, agent_id: Optional[str] = None, blocking: bool = True) -> int:
+        """
+        Write buffered scans to the database, only those of ``agent_id``
+        when given. Returns the number of buffered entries written, a
+        non blocking flush gives up if another flush is running or redis
+        is unavailable
+        """
+        try:
+            lock = self.client.lock(
+                self.lock_key,
+                timeout=self.lock_timeout,
+                blocking_timeout=self.lock_timeout if blocking else 1,
+            )
+            if not lock.acquire():
+                return 0
+        except redis.RedisError:
+            if blocking:
+                raise
+            return 0
+        try:
+            flushed = self._flush_claimed()
+            if agent_id:
+                return flushed + self._flush_agent(agent_id)
+            self._claim_batch(
+                keys=[
+                    self.pending_key,
+                    self.processing_key,
+                    self.redeemed_key,
+                    self.processing_redeemed_key,
+                ]
+            )
+            return flushed + self._flush_claimed()
+        finally:
+            lock.release()
+
+    def _flush_claimed(self) -> int:
+        scans = self.client.hgetall(self.processing_key)
+        redeemed = self.client.smembers(self.processing_redeemed_key)
+        if not scans and not redeemed:
+            return 0
+        self._write(
+            {
+                self._split(field): datetime.fromisoformat(scanned_at)
+                for field, scanned_at in scans.items()
+            },
+            [self._split(field) for field in redeemed],
+        )
+        self.client.delete(self.processing_key, self.processing_redeemed_key)
+        return len(scans) + len(redeemed)
+
+    def _flush_agent(self, agent_id: str) -> int:
+        match = self._field(agent_id, "*")
+        scans = dict(self.client.hscan_iter(self.pending_key, match=match))
+        redeemed = list(self.client.sscan_iter(self.redeemed_key, match=match))
+        if not scans and not redeemed:
+            return 0
+        self._write(
+            {
+                self._split(field): datetime.fromisoformat(scanned_at)
+                for field, scanned_at in scans.items()
+            },
+            [self._split(field) for field in redeemed],
+        )
+        if scans:
+            self.client.hdel(self.pending_key, *scans.keys())
+        if redeemed:
+            self.client.srem(self.redeemed_key, *redeemed)
+        return len(scans) + len(redeemed)
+
+    def _write(
+        self, scans: Dict[ScanKey, datetime], redeemed: Iterable[ScanKey]
+    ) -> None:
+        redeemed = list(redeemed)
+        keys = set(scans.keys()) | set(redeemed)
+        agent_ids = {agent_id for agent_id, _ in keys}
+        ticket_ids = {ticket_id for _, ticket_id in keys}
+        # tickets or agents deleted while their scans were buffered are dropped
+        valid_agents = {
+            str(pk)
+            for pk in PartnerPerson.objects.filter(id__in=agent_ids).values_list(
+                "id", flat=True
+            )
+        }
+        valid_tickets = {
+            str(pk)
+            for pk in Ticket.objects.filter(id__in=ticket_ids).values_list(
+                "id", flat=True
+            )
+        }
+        existing = {
+            (str(agent_id), str(ticket_id))
+            for agent_id, ticket_id in TicketScan.objects.filter(
+                agent_id__in=valid_agents, ticket_id__in=valid_tickets
+            ).values_list("agent_id", "ticket_id")
+        }
+        new_scans = [
+            TicketScan(agent_id=agent_id, ticket_id=ticket_id)
+            for agent_id, ticket_id in scans
+            if agent_id in valid_agents
+            and ticket_id in valid_tickets
+            and (agent_id, ticket_id) not in existing
+        ]
+
+        with transaction.atomic():
+            TicketScan.objects.bulk_create(new_scans)
+            if new_scans:
+                # created_at is stamped on insert, restore the time of the scan
+                for scan in new_scans:
+                    scan.created_at = scans[(scan.agent_id, scan.ticket_id)]
+                TicketScan.objects.bulk_update(new_scans, ["created_at"])
+            if redeemed:
+                TicketScan.objects.filter(
+                    reduce(
+                        or_,
+                        (
+                            Q(agent_id=agent_id, ticket_id=ticket_id)
+                            for agent_id, ticket_id in redeemed
+                        ),
+                    )
+                ).update(redeem_triggered=True)
+
+
+scan_buffer = ScanBuffer(redis_client, settings.SCAN_BUFFER_KEY)
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
 from core.serializers import BaseSerializer, InDBBaseSerializer
+from events.constants import SalesGranularity
 from partner.serializers import PersonSerializer
 
 
@@ -55,9 +56,22 @@ class TicketReadSerializer(InDBBaseSerializer, TicketSerializer):
 
 class CountAtDate(serializers.Serializer):
     count = serializers.IntegerField()
+    revenue = serializers.FloatField()
     date = serializers.CharField(max_length=255)
 
 
+class SalesOverTimeQuerySerializer(serializers.Serializer):
+    start = serializers.DateTimeField(
+        required=False, help_text="defaults to seven days ago"
+    )
+    end = serializers.DateTimeField(required=False)
+    granularity = serializers.ChoiceField(
+        choices=[granularity.value for granularity in SalesGranularity],
+        default=SalesGranularity.DAY.value,
+    )
+    event_id = serializers.UUIDField(required=False)
+
+
 class TotalSalesOverTime(serializers.Serializer):
     data = serializers.ListField(child=CountAtDate())  # type: ignore
 
@@ -1,20 +1,29 @@
+import uuid
+from collections import defaultdict
 from datetime import datetime, timedelta
 from http import HTTPStatus
-from typing import Any, Dict, Optional
+from typing import Any, DefaultDict, Dict, Iterable, Optional, Tuple
 
-from django.db import transaction
-from django.db.models import Count
-from django.db.models.functions import TruncDay
+import redis
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, When
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncWeek
 from django.db.models.query import QuerySet
 
 from core.error_codes import ErrorCodes
 from core.exceptions import HttpErrorException
 from core.services import CRUDService
+from events.constants import SalesGranularity, TicketValidityStates
+from events.models import TicketType
 from events.services import event_service
 from payments.constants import PaymentStates
-from tickets.models import Ticket, TicketScan
+from payments.models import Payment
+from tickets.gate import GATE_NOT_LOADED, GATE_USED_UP, gate_validator
+from tickets.models import Ticket, TicketSalesRollup, TicketScan
+from tickets.scans import scan_buffer
 from tickets.serializers import (
     TicketCreateSerializer,
+    TicketReadSerializer,
     TicketScanCreateSerializer,
     TicketUpdateInnerSerializer,
 )
@@ -32,55 +41,324 @@ class TicketService(
         except Ticket.DoesNotExist:
             obj.hash = hash
             obj.save()
+            self.record_sales([obj])
 
-    def redeem(self, pk: str, agent_id: str) -> Ticket:
+    def redeem(self, pk: str, agent_id: str) -> Dict[str, Any]:
+        """
+        Count a use of the ticket against the event's gate validation set
+        when it's loaded, otherwise in a single conditional update that only
+        touches the ticket while it's paid for and under its use limit.
+        Either way concurrent scans at different gates can't both let it
+        through. Returns the ticket as read by the gates, loaded tickets are
+        answered from redis without touching the database
+        """
         try:
-            ticket: Ticket = Ticket.objects.get(pk=pk)
-        except Ticket.DoesNotExist:
+            uuid.UUID(str(pk))
+        except ValueError:
             raise HttpErrorException(
                 status_code=HTTPStatus.NOT_FOUND, code=ErrorCodes.INVALID_TICKET_ID
             )
-        if ticket.payment.state != PaymentStates.PAID.value:
+
+        try:
+            remaining, uses, gate_ticket = gate_validator.admit_ticket(str(pk))
+        except redis.RedisError:
+            remaining, uses, gate_ticket = GATE_NOT_LOADED, None, None
+        if remaining == GATE_USED_UP:
             raise HttpErrorException(
-                status_code=HTTPStatus.FORBIDDEN,
-                code=ErrorCodes.UNPAID_FOR_TICKET,
+                status_code=HTTPStatus.FORBIDDEN, code=ErrorCodes.REDEEMED_TICKET
             )
-        if ticket.ticket_type.use_limit <= ticket.uses:
+        if uses is not None and gate_ticket is not None:
+            scan_buffer.mark_redeemed(agent_id, str(pk))
+            # the database catches up when the gate flushes its uses
+            gate_ticket["uses"] = max(gate_ticket["uses"], uses)
+            gate_ticket["redeemed"] = remaining == 0
+            if gate_ticket["redeemed"]:
+                gate_ticket["valid"] = TicketValidityStates.REDEEMED.value
+            return gate_ticket
+
+        ticket_table = Ticket._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH target AS (
+                    SELECT ticket.id, payment.state AS payment_state
+                    FROM {ticket_table} ticket
+                    JOIN {Payment._meta.db_table} payment
+                        ON payment.id = ticket.payment_id
+                    WHERE ticket.id = %(pk)s
+                ), redeemed AS (
+                    UPDATE {ticket_table} ticket
+                    SET uses = ticket.uses + 1,
+                        redeemed = ticket.uses + 1 >= ticket_type.use_limit
+                    FROM target, {TicketType._meta.db_table} ticket_type
+                    WHERE ticket.id = target.id
+                        AND ticket_type.id = ticket.ticket_type_id
+                        AND target.payment_state = %(paid)s
+                        AND ticket.uses < ticket_type.use_limit
+                    RETURNING ticket.id, ticket.uses, ticket.redeemed
+                )
+                SELECT target.payment_state, redeemed.id IS NOT NULL,
+                    redeemed.uses, redeemed.redeemed
+                FROM target LEFT JOIN redeemed ON redeemed.id = target.id
+                """,
+                {"pk": str(pk), "paid": PaymentStates.PAID.value},
+            )
+            row = cursor.fetchone()
+
+        if not row:
+            raise HttpErrorException(
+                status_code=HTTPStatus.NOT_FOUND, code=ErrorCodes.INVALID_TICKET_ID
+            )
+        payment_state, updated, uses, redeemed = row
+        if not updated:
             raise HttpErrorException(
                 status_code=HTTPStatus.FORBIDDEN,
-                code=ErrorCodes.REDEEMED_TICKET,
+                code=ErrorCodes.UNPAID_FOR_TICKET
+                if payment_state != PaymentStates.PAID.value
+                else ErrorCodes.REDEEMED_TICKET,
             )
 
-        with transaction.atomic():
-            ticket = Ticket.objects.select_for_update().get(pk=pk)
-            ticket.uses += 1
-            if ticket.uses >= ticket.ticket_type.use_limit:
-                ticket.redeemed = True
-            ticket.save()
-
-        scan: Optional[TicketScan] = (
-            TicketScan.objects.filter(
-                ticket_id=pk, agent_id=agent_id, redeem_triggered=False  # type: ignore
+        scan_buffer.mark_redeemed(agent_id, str(pk))
+
+        ticket: Ticket = Ticket.objects.select_related(
+            "payment__person", "ticket_type__event"
+        ).get(pk=pk)
+        if ticket.hash:
+            try:
+                gate_validator.sync_uses(
+                    str(ticket.ticket_type.event_id),
+                    ticket.hash,
+                    uses,
+                    ticket.ticket_type.use_limit,
+                )
+            except redis.RedisError:
+                # picked up from the database when the event is reloaded
+                pass
+        # report this redemption even if another gate has redeemed since
+        ticket.uses, ticket.redeemed = uses, redeemed
+        return TicketReadSerializer(ticket).data
+
+    def _sales_buckets(
+        self, tickets: Iterable[Ticket]
+    ) -> Tuple[Dict[Tuple[datetime, str], Tuple[int, float]], Dict[str, Any]]:
+        """
+        Count tickets and what was paid for them per hourly bucket, a
+        payment is shared between its tickets by list price the same way
+        the partner ledger credits sales. Also returns the ticket types
+        the buckets are for
+        """
+        tickets = list(tickets)
+        if not tickets:
+            return {}, {}
+        order_amounts: Dict[str, float] = {}
+        order_prices: DefaultDict[str, int] = defaultdict(int)
+        order_tickets: DefaultDict[str, int] = defaultdict(int)
+        ticket_types: Dict[str, Any] = {}
+        for row in Ticket.objects.filter(
+            payment_id__in={ticket.payment_id for ticket in tickets}
+        ).values(
+            "payment_id",
+            "ticket_type_id",
+            amount=F("payment__amount"),
+            price=F("ticket_type__price"),
+            event_id=F("ticket_type__event_id"),
+            partner_id=F("ticket_type__event__partner_id"),
+        ):
+            payment_id = str(row["payment_id"])
+            order_amounts[payment_id] = row["amount"]
+            order_prices[payment_id] += row["price"]
+            order_tickets[payment_id] += 1
+            ticket_types[str(row["ticket_type_id"])] = row
+
+        buckets: DefaultDict[Tuple[datetime, str], Tuple[int, float]] = defaultdict(
+            lambda: (0, 0.0)
+        )
+        for ticket in tickets:
+            payment_id = str(ticket.payment_id)
+            ticket_type_id = str(ticket.ticket_type_id)
+            paid = (
+                order_amounts[payment_id]
+                * ticket_types[ticket_type_id]["price"]
+                / order_prices[payment_id]
+                if order_prices[payment_id]
+                else order_amounts[payment_id] / order_tickets[payment_id]
+            )
+            bucket = ticket.created_at.replace(minute=0, second=0, microsecond=0)
+            count, revenue = buckets[(bucket, ticket_type_id)]
+            buckets[(bucket, ticket_type_id)] = (count + 1, revenue + paid)
+        return buckets, ticket_types
+
+    def record_sales(self, tickets: Iterable[Ticket]) -> None:
+        """
+        Add newly issued tickets to their hourly sales rollups, concurrent
+        writers increment the same row instead of overwriting each other
+        """
+        buckets, ticket_types = self._sales_buckets(tickets)
+        if not buckets:
+            return
+
+        rows = []
+        for (bucket, ticket_type_id), (count, revenue) in buckets.items():
+            ticket_type = ticket_types[ticket_type_id]
+            rows.append(
+                (
+                    uuid.uuid4(),
+                    datetime.now(),
+                    datetime.today().date(),
+                    bucket,
+                    ticket_type["event_id"],
+                    ticket_type_id,
+                    ticket_type["partner_id"],
+                    count,
+                    revenue,
+                )
+            )
+
+        table = TicketSalesRollup._meta.db_table
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(rows))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (id, created_at, updated_at, bucket, event_id,
+                    ticket_type_id, partner_id, tickets, revenue)
+                VALUES {values}
+                ON CONFLICT (bucket, ticket_type_id) DO UPDATE SET
+                    tickets = {table}.tickets + EXCLUDED.tickets,
+                    revenue = {table}.revenue + EXCLUDED.revenue,
+                    updated_at = EXCLUDED.updated_at
+                """,
+                [param for row in rows for param in row],
             )
-            .order_by("created_at")
-            .first()
+
+    def retract_sales(self, tickets: Iterable[Ticket]) -> None:
+        """
+        Take voided tickets back out of the rollups they were recorded in
+        """
+        buckets, _ = self._sales_buckets(tickets)
+        if not buckets:
+            return
+        rows = [
+            (bucket, ticket_type_id, count, revenue)
+            for (bucket, ticket_type_id), (count, revenue) in buckets.items()
+        ]
+        table = TicketSalesRollup._meta.db_table
+        values = ", ".join(
+            ["(%s::timestamptz, %s::uuid, %s::integer, %s::double precision)"]
+            * len(rows)
         )
-        if scan:
-            scan.redeem_triggered = True
-            scan.save()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {table} rollup
+                SET tickets = GREATEST(rollup.tickets - voided.tickets, 0),
+                    revenue = GREATEST(rollup.revenue - voided.revenue, 0),
+                    updated_at = %s
+                FROM (VALUES {values})
+                    AS voided (bucket, ticket_type_id, tickets, revenue)
+                WHERE rollup.bucket = voided.bucket
+                    AND rollup.ticket_type_id = voided.ticket_type_id
+                """,
+                [datetime.today().date()] + [param for row in rows for param in row],
+            )
 
-        return ticket
+    def rebuild_sales_rollups(self, since: Optional[datetime] = None) -> int:
+        """
+        Recompute hourly rollups from the tickets table, buckets at or
+        after ``since`` are replaced so the rebuild can be re-run safely
+        """
+        tickets: QuerySet[Ticket] = Ticket.objects.exclude(
+            payment__state=PaymentStates.VOIDED.value
+        )
+        rollups_to_replace = TicketSalesRollup.objects.all()
+        if since:
+            since = since.replace(minute=0, second=0, microsecond=0)
+            tickets = tickets.filter(created_at__gte=since)
+            rollups_to_replace = rollups_to_replace.filter(bucket__gte=since)
 
-    def counts_over_time(self, partner_id: str) -> QuerySet:
-        last_week = datetime.today() - timedelta(days=7)
+        order = (
+            Ticket.objects.filter(payment_id=OuterRef("payment_id"))
+            .values("payment_id")
+            .order_by()
+        )
+        aggregates = (
+            tickets.annotate(
+                bucket=TruncHour("created_at"),
+                order_price=Subquery(
+                    order.annotate(total=Sum("ticket_type__price")).values("total")
+                ),
+                order_tickets=Subquery(
+                    order.annotate(total=Count("id")).values("total")
+                ),
+            )
+            .values(
+                "bucket",
+                "ticket_type_id",
+                event_id=F("ticket_type__event_id"),
+                partner_id=F("ticket_type__event__partner_id"),
+            )
+            .annotate(
+                count=Count("id"),
+                revenue=Sum(
+                    Case(
+                        When(
+                            order_price=0,
+                            then=F("payment__amount") / F("order_tickets"),
+                        ),
+                        default=F("payment__amount")
+                        * F("ticket_type__price")
+                        / F("order_price"),
+                        output_field=FloatField(),
+                    )
+                ),
+            )
+            .order_by()
+        )
+        rollups = [
+            TicketSalesRollup(
+                bucket=row["bucket"],
+                event_id=row["event_id"],
+                ticket_type_id=row["ticket_type_id"],
+                partner_id=row["partner_id"],
+                tickets=row["count"],
+                revenue=row["revenue"],
+            )
+            for row in aggregates.iterator()
+        ]
+        # buckets whose tickets have all been voided or deleted since the
+        # last rebuild would otherwise keep their old counts
+        with transaction.atomic():
+            rollups_to_replace.delete()
+            TicketSalesRollup.objects.bulk_create(rollups, batch_size=1000)
+        return len(rollups)
+
+    def counts_over_time(
+        self,
+        partner_id: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        granularity: SalesGranularity = SalesGranularity.DAY,
+        event_id: Optional[str] = None,
+    ) -> QuerySet:
+        trunc_map = {
+            SalesGranularity.HOUR: TruncHour,
+            SalesGranularity.DAY: TruncDay,
+            SalesGranularity.WEEK: TruncWeek,
+            SalesGranularity.MONTH: TruncMonth,
+        }
+        filters: Dict[str, Any] = {
+            "partner_id": partner_id,
+            "bucket__gte": start or datetime.today() - timedelta(days=7),
+        }
+        if end:
+            filters["bucket__lt"] = end
+        if event_id:
+            filters["event_id"] = event_id
         return (
-            Ticket.objects.all()
-            .annotate(date=TruncDay("created_at"))
+            TicketSalesRollup.objects.filter(**filters)
+            .annotate(date=trunc_map[granularity]("bucket"))
             .values("date")
-            .annotate(count=Count("id"))
+            .annotate(count=Sum("tickets"), revenue=Sum("revenue"))
             .order_by("-date")
-            .filter(ticket_type__event__partner_id=partner_id)
-            .filter(created_at__gte=last_week)
         )
 
     def get_by_hash(self, hash: str, person_id: str, agent_id: str) -> Ticket:
@@ -103,10 +381,7 @@ class TicketService(
                 code=ErrorCodes.UNRESOLVABLE_HASH,
             )
 
-        if not TicketScan.objects.filter(
-            agent_id=agent_id, ticket_id=str(ticket.id)  # type: ignore
-        ).exists():
-            TicketScan.objects.create(agent_id=agent_id, ticket_id=str(ticket.id))
+        scan_buffer.record(agent_id, str(ticket.id))
 
         return ticket
 
@@ -0,0 +1,47 @@
+from datetime import date, timedelta
+
+from celery import shared_task
+from django.db.models.query import QuerySet
+
+from eticketing_api import settings
+from events.constants import EventState
+from events.models import Event
+from tickets.gate import gate_validator
+from tickets.posters import poster_cache
+from tickets.scans import scan_buffer
+
+
+@shared_task(name="prefetch_event_posters")
+def prefetch_event_posters() -> int:
+    # Warm this worker's poster cache ahead of the ticket email rush
+    # for events that are coming up soon
+    upcoming = date.today() + timedelta(days=settings.POSTER_PREFETCH_DAYS)
+    events: QuerySet[Event] = (
+        Event.objects.filter(event_date__gte=date.today(), event_date__lte=upcoming)
+        .exclude(event_state__in=[EventState.CLOSED, EventState.ARCHIVED])
+        .only("poster")
+    )
+    return poster_cache.prefetch(event.poster.url for event in events if event.poster)
+
+
+@shared_task(name="flush_ticket_scans")
+def flush_ticket_scans() -> int:
+    return scan_buffer.flush()
+
+
+@shared_task(name="load_gate_validation")
+def load_gate_validation() -> int:
+    # Events are reloaded through the day so tickets sold after
+    # the gates open can still be validated from redis
+    events: QuerySet[Event] = Event.objects.filter(
+        event_date__lte=date.today(), event_end_date__gte=date.today()
+    ).exclude(event_state__in=[EventState.CLOSED, EventState.ARCHIVED])
+    return sum(
+        gate_validator.load_event(str(event_id))
+        for event_id in events.values_list("id", flat=True)
+    )
+
+
+@shared_task(name="flush_gate_redemptions")
+def flush_gate_redemptions() -> int:
+    return gate_validator.flush()
@@ -1,20 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-
-from django.test import Client, TestCase
+from io import StringIO
+from tempfile import TemporaryDirectory
+from typing import Optional
+from unittest import mock
+
+import redis
+import requests
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 
+from core.exceptions import HttpErrorException
+from core.redis import redis_client
 from core.utils import random_string
 from eticketing_api import settings
 from events.fixtures import event_fixtures
+from notifications.fixtures.notification_fixtures import MockResp
 from partner.constants import PersonType
 from partner.fixtures import partner_fixtures
 from partner.fixtures.partner_fixtures import create_auth_token
 from partner.utils import create_access_token_lite
 from payments.fixtures import payment_fixtures
+from payments.models import Payment
 from tickets.fixtures import ticket_fixtures
+from tickets.gate import GATE_USED_UP, GateValidator
+from tickets.models import Ticket, TicketSalesRollup, TicketScan
+from tickets.posters import PosterCache
+from tickets.qr import QRFormat, render_qr
+from tickets.scans import ScanBuffer
+from tickets.services import ticket_service
 from tickets.utils import (
     compute_ticket_hash,
     generate_ticket_qr,
+    generate_ticket_qrs,
     get_ticket_hash_from_qr,
 )
 
@@ -303,6 +324,36 @@ class TicketTestCase(TestCase):
 
         assert image_hash == ticket.hash
 
+    def test_ticket_qr_code_svg_is_cached(self) -> None:
+        event = event_fixtures.create_event_object(self.person)
+        ticket_type = event_fixtures.create_ticket_type_obj(event=event)
+        payment = payment_fixtures.create_payment_object(self.person)
+        ticket = ticket_fixtures.create_ticket_obj(ticket_type, payment)
+        ticket.hash = compute_ticket_hash(ticket)
+        ticket.save()
+        render_qr.cache_clear()
+
+        first = generate_ticket_qr(ticket, QRFormat.SVG)
+        second = generate_ticket_qr(ticket, QRFormat.SVG)
+
+        assert "<svg" in first
+        assert first is second
+        assert render_qr.cache_info().hits == 1
+
+    def test_ticket_qrs_batch(self) -> None:
+        event = event_fixtures.create_event_object(self.person)
+        ticket_type = event_fixtures.create_ticket_type_obj(event=event)
+        payment = payment_fixtures.create_payment_object(self.person)
+        tickets = [
+            ticket_fixtures.create_ticket_obj(ticket_type, payment) for _ in range(3)
+        ]
+        Ticket.objects.filter(pk=tickets[0].pk).update(hash=None)
+
+        rendered = list(generate_ticket_qrs(Ticket.objects.filter(payment=payment)))
+
+        assert {ticket.id for ticket, _ in rendered} == {t.id for t in tickets}
+        assert not Ticket.objects.filter(payment=payment, hash__isnull=True).exists()
+
     def test_search_tickets(self) -> None:
         event = event_fixtures.create_event_object(self.owner.person)
         ticket_type = event_fixtures.create_ticket_type_obj(event=event)
@@ -329,6 +380,7 @@ class TicketTestCase(TestCase):
         tickets[2].created_at = datetime.utcnow() - timedelta(days=1)
         tickets[2].save()
         ticket_fixtures.create_ticket_obj()
+        call_command("backfill_sales_rollups", stdout=StringIO())
 
         res = self.client.get(f"/{API_VER}/tickets/count/by/date/")
 
@@ -337,3 +389,324 @@ class TicketTestCase(TestCase):
         counts_without_date = [count["count"] for count in counts]
         assert 2 in counts_without_date
         assert 1 in counts_without_date
+
+    def test_ticket_sales_rollup_by_month(self) -> None:
+        event = event_fixtures.create_event_object(self.owner.person)
+        ticket_type = event_fixtures.create_ticket_type_obj(event=event)
+        other_type = event_fixtures.create_ticket_type_obj(event=event)
+        payment = payment_fixtures.create_payment_object(self.person, amount=45.0)
+        ticket_service.record_sales(
+            [
+                ticket_fixtures.create_ticket_obj(tt, payment)
+                for tt in [ticket_type, ticket_type, other_type]
+            ]
+        )
+
+        res = self.client.get(
+            f"/{API_VER}/tickets/count/by/date/"
+            f"?granularity=month&event_id={event.id}"
+            f"&start={(datetime.now() - timedelta(days=400)).date()}"
+        )
+
+        assert res.status_code == 200
+        counts = res.json()["data"]
+        assert len(counts) == 1
+        assert counts[0]["count"] == 3
+        # revenue is what was paid for the order, not its list price
+        assert counts[0]["revenue"] == payment.amount
+
+    def test_sales_rollups_written_in_one_statement(self) -> None:
+        event = event_fixtures.create_event_object(self.owner.person)
+        payment = payment_fixtures.create_payment_object(self.person)
+        tickets = [
+            ticket_fixtures.create_ticket_obj(
+                event_fixtures.create_ticket_type_obj(event=event), payment
+            )
+            for _ in range(3)
+        ]
+
+        with CaptureQueriesContext(connection) as recorded:
+            ticket_service.record_sales(tickets)
+        with CaptureQueriesContext(connection) as retracted:
+            ticket_service.retract_sales(tickets)
+
+        # executemany is logged as "<n> times <sql>"
+        assert [query["sql"].split()[0] for query in recorded] == ["SELECT", "INSERT"]
+        assert [query["sql"].split()[0] for query in retracted] == [
+            "SELECT",
+            "UPDATE",
+        ]
+        rollups = TicketSalesRollup.objects.filter(event=event)
+        assert rollups.count() == 3
+        assert not rollups.exclude(tickets=0, revenue=0).exists()
+
+    def test_rebuild_sales_rollups_replaces_stale_buckets(self) -> None:
+        event = event_fixtures.create_event_object(self.owner.person)
+        ticket_type = event_fixtures.create_ticket_type_obj(event=event)
+        paid = payment_fixtures.create_payment_object(self.person, amount=30.0)
+        voided = payment_fixtures.create_payment_object(self.person)
+        ticket_service.record_sales(
+            [ticket_fixtures.create_ticket_obj(ticket_type, paid) for _ in range(2)]
+        )
+        voided_ticket = ticket_fixtures.create_ticket_obj(ticket_type, voided)
+        voided_ticket.created_at = datetime.utcnow() - timedelta(days=2)
+        voided_ticket.save()
+        ticket_service.record_sales([voided_ticket])
+        Payment.objects.filter(pk=voided.pk).update(state="VOIDED")
+
+        assert ticket_service.rebuild_sales_rollups() == 1
+        assert ticket_service.rebuild_sales_rollups() == 1
+
+        rollups = TicketSalesRollup.objects.filter(ticket_type=ticket_type)
+        assert rollups.count() == 1
+        assert rollups[0].tickets == 2
+        assert rollups[0].revenue == paid.amount
+
+    def test_ticket_sales_invalid_granularity(self) -> None:
+        res = self.client.get(f"/{API_VER}/tickets/count/by/date/?granularity=year")
+
+        assert res.status_code == 422
+
+
+class PosterCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        self.cache_dir = TemporaryDirectory()
+        self.poster_cache = PosterCache(
+            root=self.cache_dir.name,
+            max_bytes=10 * 1024 * 1024,
+            revalidate_after=300,
+            timeout=(1, 1),
+        )
+
+    def tearDown(self) -> None:
+        self.cache_dir.cleanup()
+
+    def test_poster_served_from_cache(self) -> None:
+        url = f"https://{random_string()}.test/poster.jpg"
+        with mock.patch.object(self.poster_cache.session, "get") as mock_get:
+            mock_get.return_value = MockResp(etag="v1")
+            first = self.poster_cache.get(url)
+            second = self.poster_cache.get(url)
+
+        assert first == second
+        assert mock_get.call_count == 1
+
+    def test_poster_revalidated_with_etag(self) -> None:
+        url = f"https://{random_string()}.test/poster.jpg"
+        self.poster_cache.revalidate_after = 0
+        with mock.patch.object(self.poster_cache.session, "get") as mock_get:
+            mock_get.return_value = MockResp(etag="v1")
+            content = self.poster_cache.get(url)
+            mock_get.return_value = MockResp(status_code=304)
+            revalidated = self.poster_cache.get(url)
+
+        assert revalidated == content
+        assert mock_get.call_args.kwargs["headers"] == {"If-None-Match": "v1"}
+
+    def test_poster_error_response_not_served(self) -> None:
+        url = f"https://{random_string()}.test/poster.jpg"
+        with mock.patch.object(self.poster_cache.session, "get") as mock_get:
+            mock_get.return_value = MockResp(status_code=404)
+            with self.assertRaises(requests.HTTPError):
+                self.poster_cache.get(url)
+            # a poster cached earlier is still served while the origin errors
+            self.poster_cache.revalidate_after = 0
+            mock_get.return_value = MockResp(etag="v1")
+            content = self.poster_cache.get(url)
+            mock_get.return_value = MockResp(status_code=500)
+
+            assert self.poster_cache.get(url) == content
+
+    def test_poster_cache_evicts_least_recently_used(self) -> None:
+        self.poster_cache.max_bytes = 0
+        url = f"https://{random_string()}.test/poster.jpg"
+        with mock.patch.object(self.poster_cache.session, "get") as mock_get:
+            mock_get.return_value = MockResp()
+            self.poster_cache.get(url)
+            self.poster_cache.get(url)
+
+        # nothing fits in a zero byte cache so every read goes to the network
+        assert mock_get.call_count == 2
+
+
+class ScanBufferTestCase(TestCase):
+    def setUp(self) -> None:
+        self.scan_buffer = ScanBuffer(redis_client, f"test_scans:{random_string()}")
+        self.agent = partner_fixtures.create_partner_person(
+            person_type=PersonType.TICKETING_AGENT
+        )
+        self.ticket = ticket_fixtures.create_ticket_obj()
+
+    def tearDown(self) -> None:
+        redis_client.delete(
+            self.scan_buffer.pending_key,
+            self.scan_buffer.redeemed_key,
+            self.scan_buffer.processing_key,
+            self.scan_buffer.processing_redeemed_key,
+        )
+
+    def test_repeat_scans_flushed_once(self) -> None:
+        agent_id, ticket_id = str(self.agent.id), str(self.ticket.id)
+        self.scan_buffer.record(agent_id, ticket_id)
+        self.scan_buffer.record(agent_id, ticket_id)
+
+        assert not TicketScan.objects.filter(ticket_id=ticket_id).exists()
+        assert self.scan_buffer.flush() == 1
+        # entries already in the database are skipped on a repeat flush
+        self.scan_buffer.record(agent_id, ticket_id)
+        self.scan_buffer.flush()
+
+        assert TicketScan.objects.filter(ticket_id=ticket_id).count() == 1
+
+    def test_redeem_flushed_with_scan(self) -> None:
+        agent_id, ticket_id = str(self.agent.id), str(self.ticket.id)
+        self.scan_buffer.record(agent_id, ticket_id)
+        self.scan_buffer.mark_redeemed(agent_id, ticket_id)
+
+        assert self.scan_buffer.flush(agent_id=agent_id) == 2
+
+        scan = TicketScan.objects.get(ticket_id=ticket_id, agent_id=agent_id)
+        assert scan.redeem_triggered
+
+    def test_failed_batch_is_retried(self) -> None:
+        agent_id, ticket_id = str(self.agent.id), str(self.ticket.id)
+        self.scan_buffer.record(agent_id, ticket_id)
+        with mock.patch.object(
+            self.scan_buffer, "_write", side_effect=DatabaseError
+        ), self.assertRaises(DatabaseError):
+            self.scan_buffer.flush()
+
+        assert self.scan_buffer.flush() == 1
+        assert TicketScan.objects.filter(ticket_id=ticket_id).exists()
+
+
+class TicketRedeemConcurrencyTestCase(TransactionTestCase):
+    def _redeem(self, ticket_id: str, agent_id: str) -> Optional[int]:
+        try:
+            return ticket_service.redeem(pk=ticket_id, agent_id=agent_id)["uses"]
+        except HttpErrorException:
+            return None
+        finally:
+            connection.close()
+
+    @mock.patch("tickets.services.scan_buffer")
+    def test_concurrent_redeems_respect_use_limit(self, _: mock.Mock) -> None:
+        ticket_type = event_fixtures.create_ticket_type_obj(use_limit=3)
+        ticket = ticket_fixtures.create_ticket_obj(ticket_type)
+        ticket.payment.state = "PAID"
+        ticket.payment.save()
+        agent = partner_fixtures.create_partner_person(
+            person_type=PersonType.TICKETING_AGENT
+        )
+
+        with ThreadPoolExecutor(max_workers=12) as executor:
+            results = list(
+                executor.map(
+                    lambda _: self._redeem(str(ticket.id), str(agent.id)), range(24)
+                )
+            )
+
+        ticket.refresh_from_db()
+        assert sorted(uses for uses in results if uses) == [1, 2, 3]
+        assert ticket.uses == 3
+        assert ticket.redeemed
+
+
+class GateValidatorTestCase(TestCase):
+    def setUp(self) -> None:
+        self.gate_validator = GateValidator(
+            redis_client, f"test_gate:{random_string()}", ttl=60
+        )
+        patcher = mock.patch("tickets.services.gate_validator", self.gate_validator)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.event = event_fixtures.create_event_object()
+        self.ticket_type = event_fixtures.create_ticket_type_obj(
+            event=self.event, use_limit=2
+        )
+        self.ticket = ticket_fixtures.create_ticket_obj(self.ticket_type)
+        self.ticket.hash = compute_ticket_hash(self.ticket)
+        self.ticket.save()
+        self.ticket.payment.state = "PAID"
+        self.ticket.payment.save()
+        self.agent = partner_fixtures.create_partner_person(
+            person_type=PersonType.TICKETING_AGENT
+        )
+
+    def tearDown(self) -> None:
+        keys = list(redis_client.scan_iter(f"{self.gate_validator.key}:*"))
+        if keys:
+            redis_client.delete(*keys)
+
+    def test_redeem_from_gate_and_write_back(self) -> None:
+        assert self.gate_validator.load_event(str(self.event.id)) == 1
+
+        with self.assertNumQueries(0):
+            first = ticket_service.redeem(str(self.ticket.id), str(self.agent.id))
+        second = ticket_service.redeem(str(self.ticket.id), str(self.agent.id))
+        with self.assertRaises(HttpErrorException) as exc:
+            ticket_service.redeem(str(self.ticket.id), str(self.agent.id))
+
+        assert (first["uses"], first["redeemed"], first["valid"]) == (1, False, "VALID")
+        assert (second["uses"], second["redeemed"], second["valid"]) == (
+            2,
+            True,
+            "REDEEMED",
+        )
+        assert first["id"] == str(self.ticket.id)
+        assert exc.exception.status_code == 403
+        self.ticket.refresh_from_db()
+        assert self.ticket.uses == 0
+
+        assert self.gate_validator.flush() == 1
+        self.ticket.refresh_from_db()
+        assert self.ticket.uses == 2
+        assert self.ticket.redeemed
+
+    def test_reload_keeps_live_counts(self) -> None:
+        self.gate_validator.load_event(str(self.event.id))
+        self.gate_validator.admit(str(self.event.id), self.ticket.hash)
+
+        self.gate_validator.load_event(str(self.event.id))
+
+        assert self.gate_validator.admit(str(self.event.id), self.ticket.hash) == (
+            0,
+            2,
+        )
+
+    def test_database_uses_merged_into_gate(self) -> None:
+        self.gate_validator.load_event(str(self.event.id))
+        with mock.patch.object(
+            self.gate_validator, "admit_ticket", side_effect=redis.RedisError
+        ):
+            ticket_service.redeem(str(self.ticket.id), str(self.agent.id))
+
+        assert self.gate_validator.admit(str(self.event.id), self.ticket.hash) == (
+            0,
+            2,
+        )
+
+    def test_database_uses_merged_on_reload(self) -> None:
+        self.gate_validator.load_event(str(self.event.id))
+        # redis is unreachable for the scans and the write back alike
+        with mock.patch.object(
+            self.gate_validator, "admit_ticket", side_effect=redis.RedisError
+        ), mock.patch.object(
+            self.gate_validator, "sync_uses", side_effect=redis.RedisError
+        ):
+            ticket_service.redeem(str(self.ticket.id), str(self.agent.id))
+            ticket_service.redeem(str(self.ticket.id), str(self.agent.id))
+
+        self.gate_validator.load_event(str(self.event.id))
+
+        assert self.gate_validator.admit(str(self.event.id), self.ticket.hash) == (
+            GATE_USED_UP,
+            None,
+        )
+
+    def test_unloaded_ticket_redeemed_in_database(self) -> None:
+        ticket = ticket_service.redeem(str(self.ticket.id), str(self.agent.id))
+
+        assert ticket["uses"] == 1
+        self.ticket.refresh_from_db()
+        assert self.ticket.uses == 1
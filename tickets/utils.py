@@ -2,20 +2,19 @@ import base64
 import hashlib
 import os
 from datetime import datetime
-from io import BytesIO
 from tempfile import NamedTemporaryFile
-from typing import Any, Union
+from typing import Any, Iterable, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 import pdfkit
-import qrcode
-import requests
 from django.template.loader import render_to_string
 
 from eticketing_api import settings
 from events.models import Event
 from partner.models import Person
 from tickets.models import Ticket
+from tickets.posters import poster_cache
+from tickets.qr import QRFormat, render_qr
 
 if os.environ.get("ENV") == "dev" or os.environ.get("GITHUB_WORKFLOW"):
     import cv2  # noqa
@@ -27,7 +26,7 @@ def compute_ticket_hash(ticket: Ticket) -> str:
     """
     person: Person = ticket.payment.person
     event: Event = ticket.ticket_type.event
-    ticket_dict = ticket.__dict__
+    ticket_dict = ticket.__dict__.copy()
     ticket_dict.update(person.__dict__)
     ticket_dict.update(event.__dict__)
     ticket_dict.update({"now": datetime.now()})
@@ -38,15 +37,29 @@ def compute_ticket_hash(ticket: Ticket) -> str:
     return hashlib.md5(str_to_be_hashed.encode("UTF-8")).hexdigest()
 
 
-def generate_ticket_qr(ticket: Ticket) -> str:
-    qr = qrcode.QRCode()
-    ticket.hash = compute_ticket_hash(ticket)
-    qr.add_data(ticket.hash)
-    image = qr.make_image(fill="black")
-    buffer: BytesIO = BytesIO()
-    image.save(buffer, format="PNG")
-    image_str: str = base64.b64encode(buffer.getvalue()).decode("utf-8")
-    return image_str
+def generate_ticket_qr(ticket: Ticket, qr_format: QRFormat = QRFormat.PNG) -> str:
+    if not ticket.hash:
+        ticket.hash = compute_ticket_hash(ticket)
+    return render_qr(ticket.hash, qr_format)
+
+
+def generate_ticket_qrs(
+    tickets: Iterable[Ticket], qr_format: QRFormat = QRFormat.PNG
+) -> Iterator[Tuple[Ticket, str]]:
+    """
+    Render QR codes for a batch of tickets, hashes missing on any of
+    the tickets are computed and persisted in a single update
+    """
+    unhashed: List[Ticket] = []
+    rendered: List[Tuple[Ticket, str]] = []
+    for ticket in tickets:
+        if not ticket.hash:
+            ticket.hash = compute_ticket_hash(ticket)
+            unhashed.append(ticket)
+        rendered.append((ticket, render_qr(ticket.hash, qr_format)))
+    if unhashed:
+        Ticket.objects.bulk_update(unhashed, ["hash"])
+    yield from rendered
 
 
 def get_ticket_hash_from_qr(image_str: str) -> str:
@@ -61,13 +74,18 @@ def get_ticket_hash_from_qr(image_str: str) -> str:
         raise EnvironmentError("Ticket hashes can only be decoded on dev")
 
 
-def generate_ticket_pdf(ticket: Ticket) -> Any:
+def generate_ticket_pdf(
+    ticket: Ticket, qr_format: QRFormat = QRFormat.PNG, image: Optional[str] = None
+) -> Any:
+    """
+    Render the ticket as a pdf, ``image`` is its QR code when it was
+    already rendered in ``qr_format`` with the rest of a batch
+    """
     date_obj = ticket.ticket_type.event.event_date
     date_str: str = datetime.strftime(date_obj, "%d-%B")
     date: list = date_str.split("-")
-    image = generate_ticket_qr(ticket)
-    poster_data = requests.get(f"{ticket.ticket_type.event.poster.url}").content
-    poster = base64.b64encode(poster_data).decode("utf-8")
+    image = image or generate_ticket_qr(ticket, qr_format)
+    poster = poster_cache.get_base64(f"{ticket.ticket_type.event.poster.url}")
 
     ticket_html = render_to_string(
         "ticket.html",
@@ -75,6 +93,7 @@ def generate_ticket_pdf(ticket: Ticket) -> Any:
             "date": date,
             "ticket_type": ticket.ticket_type,
             "image": image,
+            "svg_qr": qr_format == QRFormat.SVG,
             "poster": poster,
             "env": os.environ.get("ENV", None) == "dev",
             "ticket": ticket,
@@ -91,15 +110,14 @@ def generate_ticket_pdf(ticket: Ticket) -> Any:
     return temp_file
 
 
-def generate_ticket_html(ticket: Ticket) -> str:
+def generate_ticket_html(ticket: Ticket, qr_format: QRFormat = QRFormat.SVG) -> str:
     date_obj = ticket.ticket_type.event.event_date
     date_str: str = datetime.strftime(date_obj, "%d-%B")
     date: list = date_str.split("-")
-    image = generate_ticket_qr(ticket)
-    poster_data = requests.get(
+    image = generate_ticket_qr(ticket, qr_format)
+    poster = poster_cache.get_base64(
         f"{settings.BASE_S3_URL}{ticket.ticket_type.event.poster}"
-    ).content
-    poster = base64.b64encode(poster_data).decode("utf-8")
+    )
 
     return render_to_string(
         "ticket.html",
@@ -107,6 +125,7 @@ def generate_ticket_html(ticket: Ticket) -> str:
             "date": date,
             "ticket_type": ticket.ticket_type,
             "image": image,
+            "svg_qr": qr_format == QRFormat.SVG,
             "poster": poster,
             "env": os.environ.get("ENV", None) == "dev",
             "ticket": ticket,
@@ -15,6 +15,7 @@ from core.pagination import CustomPagination
 from core.serializers import DefaultQuerySerialzier
 from core.utils import get_selected_fields, stream_model_data
 from core.views import AbstractPermissionedView
+from events.constants import SalesGranularity
 from partner.permissions import (
     PartnerMembershipPermissions,
     PartnerOwnerPermissions,
@@ -24,7 +25,9 @@ from partner.permissions import (
     get_request_person_id,
     get_request_user_id,
 )
+from tickets.scans import scan_buffer
 from tickets.serializers import (
+    SalesOverTimeQuerySerializer,
     TicketReadSerializer,
     TicketScanSerializer,
     TotalSalesOverTime,
@@ -35,12 +38,30 @@ paginator = PageNumberPagination()
 paginator.page_size = 15
 
 
-@swagger_auto_schema(method="get", responses={200: TotalSalesOverTime})
+@swagger_auto_schema(
+    method="get",
+    responses={200: TotalSalesOverTime},
+    query_serializer=SalesOverTimeQuerySerializer,
+)
 @api_view(["GET"])
 @permission_classes([PartnerMembershipPermissions])
 def ticket_sales_per_day(request: Request) -> Response:
     partner_id = get_request_partner_id(request)
-    counts_set = ticket_service.counts_over_time(partner_id)
+    query = SalesOverTimeQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        raise HttpErrorException(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            code=ErrorCodes.UNPROCESSABLE_FILTER,
+            extra=str(query.errors),
+        )
+    params = query.validated_data
+    counts_set = ticket_service.counts_over_time(
+        partner_id,
+        start=params.get("start"),
+        end=params.get("end"),
+        granularity=SalesGranularity(params["granularity"]),
+        event_id=params.get("event_id"),
+    )
     counts = {"data": counts_set}
     return Response(TotalSalesOverTime(counts).data)  # type: ignore
 
@@ -50,8 +71,7 @@ def ticket_sales_per_day(request: Request) -> Response:
 @permission_classes([TicketingAgentPermissions])
 def redeem_ticket(request: Request, pk: str) -> Response:
     agent_id = get_request_partner_person_id(request)
-    ticket = ticket_service.redeem(pk=pk, agent_id=agent_id)
-    return Response(TicketReadSerializer(ticket).data)
+    return Response(ticket_service.redeem(pk=pk, agent_id=agent_id))
 
 
 @swagger_auto_schema(method="get", responses={200: TicketReadSerializer(many=True)})
@@ -91,6 +111,8 @@ def export_tickets(request: Request) -> StreamingHttpResponse:
 @api_view(["GET"])
 @permission_classes([TicketingAgentPermissions])
 def list_scan_records(request: Request) -> Response:
+    # read through the write-behind buffer so recent scans are listed
+    scan_buffer.flush(agent_id=get_request_partner_person_id(request), blocking=False)
     filters = request.query_params.dict()
     filters["agent__person_id"] = get_request_user_id(request)
     tickets = ticket_scan_service.get_filtered(filters=filters, paginator=paginator)